@@ -0,0 +1,100 @@
+import os
+import json
+import time
+
+####################################################
+# Anytime traces of the solvers.
+#
+# A Tracer appends one JSON line per record to the
+# trace file of an input:
+#   input, size  - the input being solved
+#   solver       - the stage that made the record
+#                  (greedy, partition, ilp, refine,
+#                  anneal, ...)
+#   elapsed      - seconds since the solve started
+#   step         - students placed or annealing steps
+#   score        - the score of the current assignment,
+#                  null while the greedy is still
+#                  placing students
+#   best_score   - the best score seen so far
+#   accepted, rejected - annealing moves so far
+# Records are kept at least trace_interval seconds
+# apart, except for the ones a stage forces when it
+# finishes. read_traces and time_to_target turn a
+# folder of traces back into time-to-target numbers,
+# which the autograder plots with --curves.
+####################################################
+
+# seconds between records of a running stage
+trace_interval = 0.1
+
+
+class Tracer:
+    '''
+        Writes the trace of one input, see the top of this file
+    '''
+
+    def __init__(self, trace_file, input_name, interval=None):
+        self.trace_file = open(trace_file, "w")
+        self.input_name = input_name
+        self.size = input_name.split("/")[0]
+        self.interval = trace_interval if interval is None else interval
+        self.start_time = time.time()
+        self.next_record = self.start_time
+        self.best_score = None
+
+    def record(self, solver, step, score, best_score=None, accepted=None, rejected=None, force=False):
+        '''
+            Writes a record unless the last one was less than interval seconds ago and force is not set
+        '''
+        now = time.time()
+        if not force and now < self.next_record:
+            return
+        self.next_record = now + self.interval
+        for candidate in (score, best_score):
+            if candidate is not None and (self.best_score is None or candidate > self.best_score):
+                self.best_score = candidate
+        self.trace_file.write(json.dumps({
+            "input": self.input_name, "size": self.size, "solver": solver, "elapsed": round(now - self.start_time, 4),
+            "step": step, "score": score, "best_score": self.best_score, "accepted": accepted, "rejected": rejected,
+        }) + "\n")
+
+    def close(self):
+        self.trace_file.close()
+
+
+def read_traces(trace_folder):
+    '''
+        Outputs:
+            a dictionary mapping each traced input to its list of records, in the order written
+    '''
+    traces = {}
+    for file_name in sorted(os.listdir(trace_folder)):
+        if not file_name.endswith(".jsonl"):
+            continue
+        with open(trace_folder + "/" + file_name) as trace_file:
+            for line in trace_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line of a solve that was killed
+                    continue
+                traces.setdefault(record["input"], []).append(record)
+    return traces
+
+
+def time_to_target(records, target_fraction):
+    '''
+        When an input first came within target_fraction of its final best score
+
+        Outputs:
+            (elapsed, solver) of the first record whose best score reached target_fraction of the
+            final one, or None if the input was never scored
+    '''
+    scored = [record for record in records if record["best_score"] is not None]
+    if not scored:
+        return None
+    target = target_fraction * scored[-1]["best_score"]
+    for record in scored:
+        if record["best_score"] >= target:
+            return record["elapsed"], record["solver"]
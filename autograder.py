@@ -1,8 +1,13 @@
-import sys
 import os
-# import json
-import matplotlib.pyplot as plt
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from output_scorer import score_output
+from instance_cache import hash_input, stat_input
+from output_sidecar import file_digest
+from anytime_trace import read_traces, time_to_target
 
 make_graphs = True
 version_name = 'YOURNAME'
@@ -12,51 +17,185 @@ path_to_outputs = "./outputs"
 path_to_graphs = "./graphs"
 size_categories = ["small", "medium", "large"]
 
+# scores of (input, output) pairs already graded, keyed by their contents
+path_to_score_cache = "./score_cache.json"
+# bump when score_output changes so old scores are thrown away
+score_cache_version = 1
 
-def score_all_outputs(output_folder, silent=True):
-    all_scores = {}
+# fractions of the final score that --curves reports the time to
+target_fractions = [0.9, 0.99, 1.0]
+
+
+def load_score_cache(cache_file):
+    '''
+        Loads the score cache, or an empty one when it is missing, unreadable or of another version
+
+        Outputs:
+            a dictionary with "files", mapping each scored file or input folder to its [stats, hash],
+            and "scores", mapping "<input hash>:<output hash>" to [score, msg]
+    '''
+    try:
+        with open(cache_file) as cache:
+            score_cache = json.load(cache)
+        if score_cache.get("version") == score_cache_version:
+            return score_cache
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {"version": score_cache_version, "files": {}, "scores": {}}
+
+
+def save_score_cache(cache_file, score_cache):
+    temp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+    with open(temp_file, "w") as cache:
+        json.dump(score_cache, cache)
+    os.replace(temp_file, cache_file)
+
+
+def cached_digest(score_cache, path, stats, digest):
+    '''
+        Returns the hash of a file or input folder, only computing it with digest when its
+        [size, mtime] stats differ from the ones it was last hashed with
+    '''
+    key = os.path.abspath(path)
+    known = score_cache["files"].get(key)
+    if known is not None and known[0] == stats:
+        return known[1]
+    content_hash = digest(path)
+    score_cache["files"][key] = [stats, content_hash]
+    return content_hash
+
+
+def score_key(score_cache, input_folder, output_file):
+    '''
+        The key of an (input, output) pair in the score cache, or None if either cannot be read
+    '''
+    try:
+        output_stat = os.stat(output_file)
+        input_hash = cached_digest(score_cache, input_folder, stat_input(input_folder), hash_input)
+        output_hash = cached_digest(score_cache, output_file, [[output_stat.st_size, output_stat.st_mtime_ns]], file_digest)
+    except OSError:
+        return None
+    return input_hash + ":" + output_hash
+
+
+def timed_score_output(input_folder, output_file):
+    '''
+        score_output along with the seconds it took, the unit of work of the scoring pool. An input
+        or output that cannot be scored at all, e.g. because a file is missing, scores -1 with the
+        error as its message.
+
+        Outputs:
+            (score, msg, seconds, failed) - failed is whether score_output raised
+    '''
+    start_time = time.time()
+    try:
+        score, msg = score_output(input_folder, output_file)
+    except Exception as e:
+        return -1, "Could not score: {!r}".format(e), time.time() - start_time, True
+    return score, msg, time.time() - start_time, False
+
+
+def grade_outputs(output_folder, silent=True, num_workers=1, cache_file=None):
+    '''
+        Scores the output of every input, skipping the (input, output) pairs whose contents were
+        already scored and fanning the others out to a pool of num_workers processes
+
+        Inputs:
+            output_folder - the folder holding one folder of .out files per size category
+            silent - whether to keep quiet about each score
+            num_workers - the number of scoring processes, in-process when 1
+            cache_file - the score cache to read and update, or None to score everything
+
+        Outputs:
+            a list of rows, one per input, each a dictionary with size, input, score, seconds
+            (0 for cached scores), cached and msg; inputs that could not be scored have score -1
+            and the error as msg
+    '''
+    score_cache = load_score_cache(cache_file) if cache_file is not None else None
+    rows = []
+    pending = []
     for size in size_categories:
-        category_scores = {}
         category_path = path_to_inputs + "/" + size
         output_category_path = output_folder + "/" + size
+        if not os.path.isdir(output_category_path):
+            os.mkdir(output_category_path)
+
+        for input_folder in os.listdir(os.fsencode(category_path)):
+            input_name = os.fsdecode(input_folder)
+            paths = (category_path + "/" + input_name, output_category_path + "/" + input_name + ".out")
+            key = score_key(score_cache, *paths) if score_cache is not None else None
+            row = {"size": size, "input": input_name, "score": None, "seconds": 0.0, "cached": False, "msg": ""}
+            if key is not None and key in score_cache["scores"]:
+                row["score"], row["msg"] = score_cache["scores"][key]
+                row["cached"] = True
+            else:
+                pending.append((row, key, paths))
+            rows.append(row)
+
+    def record(row, key, result):
+        row["score"], row["msg"], row["seconds"], failed = result
+        # errors may be passing, so they are scored again next time
+        if key is not None and not failed:
+            score_cache["scores"][key] = [row["score"], row["msg"]]
+        if not silent:
+            print("{}-{} scored {}".format(row["size"], row["input"], row["score"]))
+
+    try:
+        if num_workers == 1:
+            for row, key, paths in pending:
+                record(row, key, timed_score_output(*paths))
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                futures = {executor.submit(timed_score_output, *paths): (row, key) for row, key, paths in pending}
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # the worker itself died
+                        result = (-1, "Could not score: {!r}".format(e), 0.0, True)
+                    record(*futures[future], result)
+    finally:
+        # keep whatever was scored, even when interrupted
+        if score_cache is not None and pending:
+            save_score_cache(cache_file, score_cache)
+    if not silent:
+        print("Scored {} outputs, {} from the cache".format(len(rows), len(rows) - len(pending)))
+    return rows
+
 
-        loaded_cached = False
-        '''
-        cached_filename = output_folder + "/" + size + "_cached_scores.json"
-        try:
-            print("Looking for cached file: {}".format(cached_filename))
-            with open(cached_filename, "r") as cached_file:
-                print("Loading from cached evaluation scores for " + size + "...")
-                category_scores = json.load(cached_file)
-                print("Read {} successfully.".format(cached_filename))
-                loaded_cached = True
-        except FileNotFoundError as e:
-            pass
-        '''
-
-        if not loaded_cached:
-
-            category_dir = os.fsencode(category_path)
-
-            if not os.path.isdir(output_category_path):
-                os.mkdir(output_category_path)
-
-            for input_folder in os.listdir(category_dir):
-                input_name = os.fsdecode(input_folder)
-                score, msg = score_output(category_path + "/" + input_name,
-                                          output_category_path + "/" + input_name + ".out")
-                if not silent:
-                    print("{}-{} scored {}".format(size, input_name, score))
-                category_scores[input_name] = score
-            '''
-            with open(cached_filename, "w") as cached_file:
-                json.dump(category_scores, cached_file)
-            '''
-        all_scores[size] = category_scores
+def score_all_outputs(output_folder, silent=True, num_workers=1, cache_file=None):
+    '''
+        Outputs:
+            a dictionary mapping each size category to a dictionary from input name to score,
+            see grade_outputs for the inputs
+    '''
+    return scores_by_size(grade_outputs(output_folder, silent, num_workers, cache_file))
+
+
+def scores_by_size(rows):
+    all_scores = {size: {} for size in size_categories}
+    for row in rows:
+        all_scores[row["size"]][row["input"]] = row["score"]
     return all_scores
 
 
+def write_report(rows, report_file):
+    '''
+        Writes the rows of grade_outputs to report_file, as CSV when its name ends in .csv and as JSON otherwise
+    '''
+    fields = ["size", "input", "score", "seconds", "cached", "msg"]
+    with open(report_file, "w", newline="") as report:
+        if report_file.endswith(".csv"):
+            writer = csv.DictWriter(report, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump([{field: row[field] for field in fields} for row in rows], report, indent=1)
+
+
 def make_histogram(name, size, scores):
+    # matplotlib takes most of a second to import, so only the plotting functions load it
+    import matplotlib.pyplot as plt
     fname = path_to_graphs + "/" + name + "-" + size + "-density" + ".png"
     unlabeled_scores = []
     for challenge in scores.keys():
@@ -70,6 +209,7 @@ def make_histogram(name, size, scores):
 
 
 def make_curve_graph(name, size, scores):
+    import matplotlib.pyplot as plt
     fname = path_to_graphs + "/" + name + "-" + size + "-curve" + ".png"
     unlabeled_scores = []
     for challenge in scores.keys():
@@ -84,6 +224,45 @@ def make_curve_graph(name, size, scores):
     plt.clf()
 
 
+def make_time_to_target_graph(name, size, traces):
+    '''
+        Plots, for each fraction in target_fractions, the share of the traced inputs of a size category
+        that are within that fraction of their final score against the seconds spent on them
+    '''
+    import matplotlib.pyplot as plt
+    fname = path_to_graphs + "/" + name + "-" + size + "-time-to-target" + ".png"
+    records = [traces[input_name] for input_name in sorted(traces) if input_name.split("/")[0] == size]
+    for target_fraction in target_fractions:
+        reached = [time_to_target(input_records, target_fraction) for input_records in records]
+        seconds = sorted(result[0] for result in reached if result is not None)
+        plt.step(seconds, [(i + 1) / len(records) for i in range(len(seconds))], where="post",
+                 label="{:.0%} of final score".format(target_fraction))
+    plt.xlabel("Seconds")
+    plt.ylabel("Fraction of inputs")
+    plt.ylim(0, 1)
+    plt.legend()
+    plt.title("Time to target for " + size + " " + name)
+    plt.savefig(fname)
+    plt.clf()
+
+
+def summarize_time_to_target(traces):
+    '''
+        Prints, per size category and target fraction, the median seconds the traced inputs took to
+        come within it of their final score and the stage that most often got them there
+    '''
+    for size in size_categories:
+        records = [traces[input_name] for input_name in sorted(traces) if input_name.split("/")[0] == size]
+        for target_fraction in target_fractions:
+            reached = [result for result in (time_to_target(input_records, target_fraction) for input_records in records) if result is not None]
+            if not reached:
+                continue
+            seconds = sorted(result[0] for result in reached)
+            solvers = [result[1] for result in reached]
+            print("{} {:.0%}: {} inputs, median {:.3f}s, mostly by {}".format(
+                size, target_fraction, len(reached), seconds[len(seconds) // 2], max(set(solvers), key=solvers.count)))
+
+
 def compute_leaderboard_score(all_scores):
     total = 0
     count = 0
@@ -95,16 +274,47 @@ def compute_leaderboard_score(all_scores):
     return total / count
 
 
-if __name__ == "__main__":
+def make_parser(prog=None):
+    '''The command line options of autograder.py, also used by `python3 main.py grade`'''
+    parser = argparse.ArgumentParser(prog=prog, description="Score every output under --outputs")
+    parser.add_argument("--inputs", default=path_to_inputs, help="folder with the size category folders (default: %(default)s)")
+    parser.add_argument("--outputs", default=path_to_outputs, help="folder with the .out files to score (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="number of scoring processes (default: number of cores)")
+    parser.add_argument("--no-cache", action="store_true", help="score every output again instead of reusing " + path_to_score_cache)
+    parser.add_argument("--report", default=None, help="write the score and timing of each input to this .json or .csv file")
+    parser.add_argument("--curves", default=None, metavar="FOLDER",
+                        help="instead of scoring, plot how fast the traces in FOLDER (from solver.py --trace) reach their final scores")
+    return parser
+
+
+def run(args):
+    '''Runs autograder.py with the options parsed by make_parser'''
+    global path_to_inputs, path_to_outputs
+    path_to_inputs = args.inputs
+    path_to_outputs = args.outputs
     print("Will do: {}".format(size_categories))
     if not os.path.isdir(path_to_graphs):
         os.mkdir(path_to_graphs)
 
-    old_scores = score_all_outputs(path_to_outputs, False)
+    if args.curves is not None:
+        traces = read_traces(args.curves)
+        summarize_time_to_target(traces)
+        for size in size_categories:
+            make_time_to_target_graph(version_name, size, traces)
+        return
+
+    rows = grade_outputs(path_to_outputs, False, args.workers or os.cpu_count() or 1, None if args.no_cache else path_to_score_cache)
+    if args.report is not None:
+        write_report(rows, args.report)
+    old_scores = scores_by_size(rows)
 
     print("Leaderboard score: {}".format(compute_leaderboard_score(old_scores)))
 
     if make_graphs:
         for size in size_categories:
             make_histogram(version_name, size, old_scores[size])
-            make_curve_graph(version_name, size, old_scores[size])
\ No newline at end of file
+            make_curve_graph(version_name, size, old_scores[size])
+
+
+if __name__ == "__main__":
+    run(make_parser().parse_args())
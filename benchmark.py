@@ -0,0 +1,286 @@
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import solver
+import instance_cache
+from instance import load_instance
+from output_scorer import score_output
+from simann import SimulatedAnnealer
+from generate_instances import generate_instance
+
+####################################################
+# To run:
+#   python3 benchmark.py [--output results.json] [--baseline baseline.json]
+#
+# Times the hot paths of the solver and the scorer
+# on a fixed set of inputs from each size category:
+#   parse     - parsing graph.gml and parameters.txt
+#   load      - parse_input, through the instance cache
+#   greedy    - the greedy assignment
+#   anneal    - anneal_steps annealing steps
+#   score     - score_output on the text output
+#   score_npy - score_output with the binary sidecar
+#
+# Each benchmark is repeated and reported as the
+# median and 95th percentile of its wall time, plus
+# the peak memory of one extra run under tracemalloc.
+# Given a baseline from an earlier --output, every
+# median more than tolerance slower than it is
+# flagged and the exit status is 1.
+#
+#   python3 benchmark.py --scaling 1000,10000,100000
+#
+# instead generates an input of each number of
+# students with generate_instances.py and reports
+# the time and peak memory of parsing it, solving it
+# with each of scaling_engines and scoring the
+# result, each timed once and traced once.
+####################################################
+
+path_to_inputs = "./all_inputs"
+
+# representative inputs of each size category
+benchmark_inputs = ["small/1", "small/50", "medium/1", "medium/143", "large/1000", "large/1030"]
+
+repeats = 5
+anneal_steps = 2000
+anneal_temperature = 1.0
+# how much slower than the baseline a median may get before it is flagged
+tolerance = 0.2
+
+scaling_sizes = [1000, 10000, 100000]
+# the seeding passed to solver.solve for each engine of the scaling benchmark
+scaling_engines = ["greedy", "partition"]
+
+
+def measure(function, num_repeats):
+    '''
+        Times function num_repeats times, then once more under tracemalloc
+
+        Outputs:
+            a dictionary with the median and p95 wall time in seconds and the peak memory in bytes
+    '''
+    seconds = []
+    for _ in range(num_repeats):
+        start_time = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "median": float(np.median(seconds)),
+        "p95": float(np.percentile(seconds, 95)),
+        "peak_memory": peak_memory,
+        "repeats": num_repeats,
+    }
+
+
+def measure_once(function):
+    '''
+        Times one run of function, then runs it again under tracemalloc for its peak memory
+
+        Outputs:
+            (result, measurement) - what function returned, or None if it ran out of memory, and a
+            dictionary with the seconds and peak memory in bytes, or the seconds until it ran out
+            of memory and an error
+    '''
+    start_time = time.perf_counter()
+    try:
+        result = function()
+    except MemoryError:
+        return None, {"seconds": time.perf_counter() - start_time, "peak_memory": 0, "error": "MemoryError"}
+    seconds = time.perf_counter() - start_time
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, {"seconds": seconds, "peak_memory": peak_memory}
+
+
+def benchmark_input(input_name, output_folder, num_repeats):
+    '''
+        Runs every benchmark on one input
+
+        Inputs:
+            input_name - "<size>/<name>" under path_to_inputs
+            output_folder - a scratch folder for the output files scored
+            num_repeats - how often each benchmark is timed
+
+        Outputs:
+            a dictionary mapping each benchmark name to the result of measure
+    '''
+    input_folder = path_to_inputs + "/" + input_name
+    instance = solver.parse_input(input_folder)
+    bus_assignments, student_to_bus = solver.greedy_assignment(instance)
+
+    text_output = output_folder + "/" + input_name.replace("/", "-") + ".out"
+    solver.write_output(text_output, bus_assignments)
+    sidecar_output = output_folder + "/" + input_name.replace("/", "-") + "-npy.out"
+    solver.write_output(sidecar_output, bus_assignments, instance, student_to_bus)
+
+    annealer = SimulatedAnnealer(instance, student_to_bus, seed=0)
+    results = {
+        "parse": measure(lambda: load_instance(input_folder), num_repeats),
+        "load": measure(lambda: solver.parse_input(input_folder), num_repeats),
+        "greedy": measure(lambda: solver.greedy_assignment(instance), num_repeats),
+        "anneal": measure(lambda: annealer.sample(anneal_temperature, anneal_steps), num_repeats),
+        "score": measure(lambda: score_output(input_folder, text_output), num_repeats),
+        "score_npy": measure(lambda: score_output(input_folder, sidecar_output), num_repeats),
+    }
+    results["anneal"]["steps_per_second"] = anneal_steps / results["anneal"]["median"]
+    return results
+
+
+def run_benchmarks(input_names=None, num_repeats=None):
+    '''
+        Outputs:
+            a dictionary mapping each input name to the results of benchmark_input
+    '''
+    input_names = benchmark_inputs if input_names is None else input_names
+    num_repeats = repeats if num_repeats is None else num_repeats
+    output_folder = tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        return {input_name: benchmark_input(input_name, output_folder, num_repeats) for input_name in input_names}
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+
+def scaling_benchmark(sizes=None, engines=None, seed=0):
+    '''
+        Generates an input of each size and times parsing, solving and scoring it
+
+        Inputs:
+            sizes - numbers of students, scaling_sizes by default
+            engines - the seedings to solve with, scaling_engines by default
+            seed - seeds the generated inputs
+
+        Outputs:
+            a dictionary mapping each size to the measurements of measure_once for "parse" and for
+            "<engine>" and "<engine>_score", the latter with the score reached
+    '''
+    sizes = scaling_sizes if sizes is None else sizes
+    engines = scaling_engines if engines is None else engines
+    work_folder = tempfile.mkdtemp(prefix="scaling-")
+    # keep the generated inputs out of the real instance cache
+    cache_folder = instance_cache.path_to_cache
+    instance_cache.path_to_cache = work_folder + "/instance_cache"
+    results = {}
+    try:
+        for num_students in sizes:
+            input_folder = "{}/{}".format(work_folder, num_students)
+            generate_instance(input_folder, num_students, seed=seed)
+            instance, results[num_students] = measure_once(lambda: load_instance(input_folder))
+            results[num_students] = {"parse": results[num_students]}
+            # so that scoring measures a cached load, like the autograder after a solver run
+            solver.parse_input(input_folder)
+            for engine in engines:
+                solution, results[num_students][engine] = measure_once(lambda: solver.solve(instance, seeding=engine))
+                if solution is None:
+                    continue
+                output_file = "{}/{}-{}.out".format(work_folder, num_students, engine)
+                with open(output_file, "w") as output:
+                    output.write(solution)
+                score, results[num_students][engine + "_score"] = measure_once(lambda: score_output(input_folder, output_file))
+                if score is not None:
+                    results[num_students][engine + "_score"]["score"] = score[0]
+            print_scaling_row(num_students, results[num_students])
+    finally:
+        instance_cache.path_to_cache = cache_folder
+        shutil.rmtree(work_folder, ignore_errors=True)
+    return results
+
+
+def print_scaling_row(num_students, measurements):
+    print("{:>8} students: ".format(num_students) + ", ".join(
+        "{} {:.2f}s {:.1f} MiB{}".format(name, measurement["seconds"], measurement["peak_memory"] / 2 ** 20,
+                                          " ({})".format(measurement["error"]) if "error" in measurement else "")
+        for name, measurement in measurements.items()))
+
+
+def find_regressions(results, baseline, allowed=None):
+    '''
+        Compares the medians of results with the ones of a baseline run
+
+        Outputs:
+            a list of (input name, benchmark name, baseline median, median) for every median more
+            than allowed (tolerance by default) slower than its baseline
+    '''
+    allowed = tolerance if allowed is None else allowed
+    regressions = []
+    for input_name, benchmarks in results.items():
+        for benchmark_name, result in benchmarks.items():
+            before = baseline.get(input_name, {}).get(benchmark_name)
+            if before is not None and result["median"] > before["median"] * (1 + allowed):
+                regressions.append((input_name, benchmark_name, before["median"], result["median"]))
+    return regressions
+
+
+def print_results(results):
+    print("{:<12} {:<10} {:>10} {:>10} {:>12}".format("input", "benchmark", "median ms", "p95 ms", "peak KiB"))
+    for input_name, benchmarks in results.items():
+        for benchmark_name, result in benchmarks.items():
+            print("{:<12} {:<10} {:>10.2f} {:>10.2f} {:>12.1f}".format(input_name, benchmark_name, 1000 * result["median"],
+                                                                     1000 * result["p95"], result["peak_memory"] / 1024))
+        print("{:<12} {:<10} {:>10.0f} steps/s".format(input_name, "anneal", benchmarks["anneal"]["steps_per_second"]))
+
+
+def make_parser(prog=None):
+    '''The command line options of benchmark.py, also used by `python3 main.py bench`'''
+    parser = argparse.ArgumentParser(prog=prog, description="Time parsing, solving, annealing and scoring on representative inputs")
+    parser.add_argument("input_names", nargs="*", metavar="inputs", help="inputs to benchmark as <size>/<name> (default: benchmark_inputs)")
+    parser.add_argument("--inputs", default=path_to_inputs, help="folder with the size category folders (default: %(default)s)")
+    parser.add_argument("--repeats", type=int, default=repeats, help="timed runs of each benchmark (default: %(default)s)")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="flag medians more than --tolerance slower than in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=tolerance,
+                        help="allowed slowdown against the baseline, as a fraction (default: %(default)s)")
+    parser.add_argument("--scaling", default=None, metavar="N,N,...",
+                        help="instead time generated inputs of these numbers of students, e.g. " + ",".join(map(str, scaling_sizes)))
+    return parser
+
+
+def run(args):
+    '''
+        Runs benchmark.py with the options parsed by make_parser
+
+        Outputs:
+            1 if a benchmark regressed against the baseline, for the exit status
+    '''
+    global path_to_inputs
+    path_to_inputs = args.inputs
+    if args.scaling is not None:
+        results = scaling_benchmark([int(size) for size in args.scaling.split(",")])
+        if args.output is not None:
+            with open(args.output, "w") as output_file:
+                json.dump(results, output_file, indent=1)
+        return
+
+    results = run_benchmarks(args.input_names or None, args.repeats)
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for input_name, benchmark_name, before, after in regressions:
+            print("REGRESSION {} {}: {:.2f} ms -> {:.2f} ms".format(input_name, benchmark_name, 1000 * before, 1000 * after))
+        if regressions:
+            return 1
+        print("No regressions against {}".format(args.baseline))
+
+
+if __name__ == '__main__':
+    sys.exit(run(make_parser().parse_args()))
@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import argparse
+import http.client
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import solver
+from instance_cache import load_cached_instance
+from output_scorer import score_assignments, score_bus_array, is_valid_bus_array
+
+####################################################
+# To run:
+#   python3 daemon.py [--port 8170] [--workers N]
+#
+# Loads every input once and serves solve and score
+# requests over HTTP on localhost, so scripts that
+# solve or score many times don't pay for starting
+# Python, importing NumPy and loading the inputs
+# on every call. Requests are JSON bodies POSTed to
+#   /score - {"input": "small/1", "student_to_bus": [...]}
+#            or {"input": ..., "buses": [[names], ...]}
+#            -> {"score": ..., "msg": ...}
+#   /solve - {"input": "small/1", "budget": seconds,
+#             "engine": "anneal", "tabu" or "tempering",
+#             "replicas": chains for "tempering",
+#             "seeding": "greedy" or "partition",
+#             "seed": ...}
+#            -> {"score", "seconds", "student_to_bus", "buses"}
+# and GET /instances lists the inputs loaded.
+# Scores are computed in the request's thread, solves
+# in a pool of worker processes, and connections are
+# kept alive, so DaemonClient below can send
+# thousands of requests over one connection.
+####################################################
+
+path_to_inputs = "./all_inputs"
+size_categories = ["small", "medium", "large"]
+
+host = "127.0.0.1"
+port = 8170
+
+engines = ["anneal", "tabu", "tempering"]
+seedings = ["greedy", "partition"]
+
+# "<size>/<input name>" -> Instance; filled by load_instances before the workers start, so forked
+# workers share it, and filled on demand by each worker otherwise
+instances = {}
+
+
+class RequestError(Exception):
+    '''A request the daemon cannot serve, with the HTTP status to answer it with'''
+
+    def __init__(self, status, msg):
+        super().__init__(msg)
+        self.status = status
+
+
+def load_instances(inputs_path, input_names=None):
+    '''
+        Loads inputs through the instance cache into instances
+
+        Inputs:
+            inputs_path - the path to the folder containing the size category folders
+            input_names - the "<size>/<input name>"s to load, every input by default
+
+        Outputs:
+            a list of (input name, error message) for the inputs that could not be loaded
+    '''
+    if input_names is None:
+        input_names = [size + "/" + input_name for size, input_name in solver.list_inputs(inputs_path, size_categories)]
+    failures = []
+    for input_name in input_names:
+        try:
+            instances[input_name] = load_cached_instance(inputs_path + "/" + input_name)
+        except Exception as e:
+            failures.append((input_name, str(e)))
+    return failures
+
+
+def get_instance(inputs_path, input_name):
+    '''The Instance of input_name, loaded on first use; raises RequestError for an unknown input'''
+    instance = instances.get(input_name)
+    if instance is not None:
+        return instance
+    input_folder = inputs_path + "/" + input_name
+    if ".." in input_name.split("/") or not os.path.isfile(input_folder + "/graph.gml"):
+        raise RequestError(404, "Unknown input {}".format(input_name))
+    try:
+        instance = load_cached_instance(input_folder)
+    except Exception as e:
+        raise RequestError(400, "Could not load input {}: {}".format(input_name, e))
+    instances[input_name] = instance
+    return instance
+
+
+def score_request(inputs_path, request):
+    '''
+        Scores the assignment in a /score request
+
+        Outputs:
+            {"score": ..., "msg": ...} as returned by output_scorer.score_output
+    '''
+    instance = get_instance(inputs_path, request.get("input", ""))
+    if "student_to_bus" in request:
+        student_to_bus = np.asarray(request["student_to_bus"])
+        if student_to_bus.ndim != 1 or (len(student_to_bus) > 0 and student_to_bus.dtype.kind not in "iu"):
+            raise RequestError(400, "student_to_bus must be a list of bus indices")
+        if len(student_to_bus) != instance.num_students:
+            return {"score": -1, "msg": "Expected a bus for each of {} students, found {}".format(instance.num_students, len(student_to_bus))}
+        if not is_valid_bus_array(instance, student_to_bus):
+            # the name checks give the reason
+            score, msg = score_assignments(instance, bus_lists(instance, student_to_bus))
+        else:
+            score = score_bus_array(instance, student_to_bus)
+            msg = "Valid output submitted with score: {}".format(score)
+    elif "buses" in request:
+        score, msg = score_assignments(instance, request["buses"])
+    else:
+        raise RequestError(400, "A score request needs student_to_bus or buses")
+    return {"score": score, "msg": msg}
+
+
+def bus_lists(instance, student_to_bus):
+    '''The names on each bus of a student->bus array, with out of range buses dropped'''
+    buses = [[] for _ in range(instance.num_buses)]
+    for student, bus in enumerate(student_to_bus.tolist()):
+        if 0 <= bus < instance.num_buses:
+            buses[bus].append(instance.student_names[student])
+    return buses
+
+
+def solve_job(inputs_path, input_name, budget, engine, seeding, seed, replicas=None):
+    '''
+        Solves one input, in a worker process
+
+        Outputs:
+            the response to a /solve request
+    '''
+    start_time = time.time()
+    instance = get_instance(inputs_path, input_name)
+    deadline = None if budget is None else start_time + budget
+    bus_assignments, student_to_bus = solver.anytime_assignment(instance, deadline, seed=seed, seeding=seeding, engine=engine,
+                                                                replicas=replicas)
+    return {
+        "score": score_bus_array(instance, student_to_bus),
+        "seconds": time.time() - start_time,
+        "student_to_bus": student_to_bus.tolist(),
+        "buses": [bus_assignments[bus] for bus in range(instance.num_buses)],
+    }
+
+
+def solve_request(inputs_path, executor, request):
+    '''Checks a /solve request and runs it on the worker pool'''
+    input_name = request.get("input", "")
+    get_instance(inputs_path, input_name)
+    engine = request.get("engine", "anneal")
+    seeding = request.get("seeding", "greedy")
+    budget = request.get("budget")
+    replicas = request.get("replicas")
+    if engine not in engines:
+        raise RequestError(400, "engine must be one of {}".format(", ".join(engines)))
+    if seeding not in seedings:
+        raise RequestError(400, "seeding must be one of {}".format(", ".join(seedings)))
+    if budget is not None and (not isinstance(budget, (int, float)) or budget < 0):
+        raise RequestError(400, "budget must be a number of seconds")
+    if replicas is not None and (not isinstance(replicas, int) or isinstance(replicas, bool) or replicas < 1):
+        raise RequestError(400, "replicas must be a positive number of chains")
+    return executor.submit(solve_job, inputs_path, input_name, budget, engine, seeding, request.get("seed"), replicas).result()
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    # keep connections alive between requests, and don't hold back small responses waiting for an ack
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == "/instances":
+            self.respond(200, {"instances": sorted(instances)})
+        else:
+            self.respond(404, {"error": "Unknown path {}".format(self.path)})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                raise RequestError(400, "The request body is not JSON")
+            if not isinstance(request, dict):
+                raise RequestError(400, "The request body must be a JSON object")
+            if self.path == "/score":
+                response = score_request(self.server.inputs_path, request)
+            elif self.path == "/solve":
+                response = solve_request(self.server.inputs_path, self.server.executor, request)
+            else:
+                raise RequestError(404, "Unknown path {}".format(self.path))
+        except RequestError as e:
+            self.respond(e.status, {"error": str(e)})
+            return
+        except Exception as e:
+            self.respond(500, {"error": "{}: {}".format(type(e).__name__, e)})
+            return
+        self.respond(200, response)
+
+    def respond(self, status, response):
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # a line per request would drown out everything else when scoring thousands of times
+        pass
+
+
+def serve(inputs_path=None, num_workers=None, server_port=None, preload=True):
+    '''
+        Loads the inputs and serves requests until interrupted
+
+        Inputs:
+            inputs_path - the folder with the size category folders, path_to_inputs by default
+            num_workers - the number of solver processes (one per core by default)
+            server_port - the port to listen on, port by default
+            preload - whether to load every input up front rather than on its first request
+    '''
+    inputs_path = path_to_inputs if inputs_path is None else inputs_path
+    server_port = port if server_port is None else server_port
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    if preload:
+        start_time = time.time()
+        failures = load_instances(inputs_path)
+        for input_name, msg in failures:
+            print("Could not load {}: {}".format(input_name, msg))
+        print("Loaded {} inputs in {:.1f} s".format(len(instances), time.time() - start_time))
+
+    server = ThreadingHTTPServer((host, server_port), DaemonHandler)
+    server.daemon_threads = True
+    server.inputs_path = inputs_path
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        server.executor = executor
+        print("Serving on http://{}:{} with {} solver workers".format(host, server_port, num_workers))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+class DaemonClient:
+    '''
+        Sends requests to a running daemon over one kept-alive connection
+
+        Example:
+            client = DaemonClient()
+            score, msg = client.score("small/1", student_to_bus)
+    '''
+
+    def __init__(self, server_port=None, timeout=None):
+        self.connection = http.client.HTTPConnection(host, port if server_port is None else server_port, timeout=timeout)
+
+    def request(self, path, payload=None):
+        '''
+            Outputs:
+                the decoded JSON response; a response with an error raises RuntimeError
+        '''
+        if payload is None:
+            self.connection.request("GET", path)
+        else:
+            self.connection.request("POST", path, json.dumps(payload).encode(), {"Content-Type": "application/json"})
+        response = self.connection.getresponse()
+        body = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(body.get("error", "HTTP {}".format(response.status)))
+        return body
+
+    def score(self, input_name, student_to_bus=None, buses=None):
+        '''Scores a student->bus array or a list of the names on each bus, returning (score, msg)'''
+        if student_to_bus is not None:
+            payload = {"input": input_name, "student_to_bus": np.asarray(student_to_bus).tolist()}
+        else:
+            payload = {"input": input_name, "buses": buses}
+        response = self.request("/score", payload)
+        return response["score"], response["msg"]
+
+    def solve(self, input_name, budget=None, engine="anneal", seeding="greedy", seed=None, replicas=None):
+        '''Solves an input on the daemon, returning the response to the /solve request'''
+        return self.request("/solve", {"input": input_name, "budget": budget, "engine": engine, "seeding": seeding, "seed": seed,
+                                       "replicas": replicas})
+
+    def instances(self):
+        return self.request("/instances")["instances"]
+
+    def close(self):
+        self.connection.close()
+
+
+def make_parser(prog=None):
+    '''The command line options of daemon.py, also used by `python3 main.py serve`'''
+    parser = argparse.ArgumentParser(prog=prog, description="Serve solve and score requests on localhost with every input loaded once")
+    parser.add_argument("--port", type=int, default=port, help="port to listen on (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="number of solver processes (default: one per core)")
+    parser.add_argument("--inputs", default=path_to_inputs, help="folder with the size category folders (default: %(default)s)")
+    parser.add_argument("--lazy", action="store_true", help="load each input on its first request instead of at startup")
+    return parser
+
+
+def run(args):
+    serve(args.inputs, args.workers, args.port, not args.lazy)
+
+
+if __name__ == '__main__':
+    run(make_parser().parse_args())
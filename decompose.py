@@ -0,0 +1,163 @@
+import numpy as np
+from instance import Instance
+
+####################################################
+# Splits an input into the part that needs the
+# heuristics and the part that does not.
+#
+# A connected component of the friendship graph that
+# no rowdy group touches and that fits on a bus keeps
+# every one of its friendships when it rides one bus
+# whole, so these "free" components (isolated students
+# included) are bin-packed onto buses first fit
+# decreasing. Everything else -- components touched by
+# a rowdy group (a group spanning several components
+# makes all of them hard) and components too big for a
+# bus -- becomes a smaller Instance on the remaining
+# buses, solved by whatever the caller passes in.
+####################################################
+
+
+def connected_components(instance):
+    '''
+        Labels each student with the smallest student index of its friendship component
+
+        Outputs:
+            an integer array with the component label of each student
+    '''
+    labels = np.arange(instance.num_students)
+    sources = np.asarray(instance.edges[:, 0])
+    targets = np.asarray(instance.edges[:, 1])
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, sources, labels[targets])
+        np.minimum.at(labels, targets, labels[sources])
+        # pointer jumping: follow labels to their own labels until nothing changes
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def split_students(instance):
+    '''
+        Outputs:
+            (free_components, hard_students)
+            free_components - a list of student index arrays, one per component that can ride a bus whole
+            hard_students - a sorted array of the remaining students
+    '''
+    labels = connected_components(instance)
+    component_sizes = np.bincount(labels, minlength=instance.num_students)
+    hard = component_sizes[labels] > instance.size_bus
+    touched = np.zeros(instance.num_students, dtype=bool)
+    touched[labels[np.asarray(instance.group_members)]] = True
+    hard |= touched[labels]
+
+    order = np.argsort(labels[~hard], kind="stable")
+    free_students = np.flatnonzero(~hard)[order]
+    boundaries = np.flatnonzero(np.diff(labels[free_students])) + 1
+    free_components = np.split(free_students, boundaries) if len(free_students) > 0 else []
+    return free_components, np.flatnonzero(hard)
+
+
+def pack_components(components, size_bus):
+    '''
+        First fit decreasing: the largest components first, each into the first bus it fits on
+
+        Outputs:
+            a list of buses, each a list of components
+    '''
+    buses = []
+    loads = []
+    for component in sorted(components, key=len, reverse=True):
+        for bus_idx, load in enumerate(loads):
+            if load + len(component) <= size_bus:
+                buses[bus_idx].append(component)
+                loads[bus_idx] += len(component)
+                break
+        else:
+            buses.append([component])
+            loads.append(len(component))
+    return buses
+
+
+def spread_buses(buses, num_buses, instance):
+    '''
+        Splits packed buses until there are num_buses of them: whole components are moved onto
+        new buses first, and only when every bus holds a single component is a component split,
+        by moving off its student with the fewest friends
+    '''
+    buses = [list(bus) for bus in buses]
+    while len(buses) < num_buses:
+        shared = [bus_idx for bus_idx, bus in enumerate(buses) if len(bus) > 1]
+        if shared:
+            bus = max((buses[bus_idx] for bus_idx in shared), key=lambda bus: sum(len(component) for component in bus))
+            bus.sort(key=len)
+            buses.append([bus.pop(0)])
+            continue
+        bus = max(buses, key=lambda bus: len(bus[0]))
+        component = bus[0]
+        if len(component) <= 1:
+            break
+        degrees = np.diff(np.asarray(instance.adjacency_indptr))[component]
+        loneliest = int(np.argmin(degrees))
+        bus[0] = np.delete(component, loneliest)
+        buses.append([component[loneliest:loneliest + 1]])
+    return buses
+
+
+def sub_instance(instance, students, num_buses):
+    '''
+        The Instance induced by a sorted array of students, keeping every rowdy group (restricted to students)
+    '''
+    index = np.full(instance.num_students, -1, dtype=np.int64)
+    index[students] = np.arange(len(students))
+    edges = np.asarray(instance.edges)
+    edges = index[edges[(index[edges[:, 0]] >= 0) & (index[edges[:, 1]] >= 0)]]
+    group_members = index[np.asarray(instance.group_members)]
+    kept = group_members >= 0
+    # members kept before each position of group_members, read off at the group boundaries
+    kept_before = np.concatenate([[0], np.cumsum(kept)])
+    group_indptr = kept_before[np.asarray(instance.group_indptr)]
+    names = [instance.student_names[i] for i in students.tolist()]
+    return Instance(names, num_buses, instance.size_bus, edges.reshape(-1, 2), group_indptr, group_members[kept])
+
+
+def decomposed_assignment(instance, solve_hard):
+    '''
+        Packs the free components of an input and solves the rest as a smaller input
+
+        Inputs:
+            instance - the Instance to solve
+            solve_hard - a function taking an Instance and returning a valid student->bus array for it
+
+        Outputs:
+            a student->bus array, or None when there is nothing to split off or the split leaves the
+            hard students too few buses to fit on or to break up their rowdy groups (the caller then
+            solves the input whole)
+    '''
+    free_components, hard_students = split_students(instance)
+    if len(free_components) == 0:
+        return None
+    num_buses = instance.num_buses
+    size_bus = instance.size_bus
+    buses = pack_components(free_components, size_bus)
+    if len(buses) > num_buses:
+        return None
+
+    hard_buses = min(num_buses - len(buses), len(hard_students))
+    if len(hard_students) > 0 and hard_buses * size_bus < len(hard_students):
+        return None
+    # on a single bus every rowdy group of the hard students would stay whole
+    if hard_buses == 1 and instance.num_groups > 0:
+        return None
+    buses = spread_buses(buses, num_buses - hard_buses, instance)
+    if len(buses) + hard_buses != num_buses:
+        return None
+
+    student_to_bus = np.full(instance.num_students, -1, dtype=np.int64)
+    if hard_buses > 0:
+        student_to_bus[hard_students] = solve_hard(sub_instance(instance, hard_students, hard_buses))
+    for bus_idx, bus in enumerate(buses):
+        for component in bus:
+            student_to_bus[component] = hard_buses + bus_idx
+    return student_to_bus
@@ -0,0 +1,355 @@
+import numpy as np
+
+####################################################
+# Incremental evaluation of the true objective.
+#
+# A friendship is kept when both students are on the
+# same bus and neither student is in a rowdy group
+# that sits entirely on one bus. ScoreEvaluator keeps
+# that count up to date while students are moved, so
+# local search can ask for the exact change of a move
+# or swap without rescoring the whole assignment.
+####################################################
+
+
+class ScoreEvaluator:
+    '''
+        Tracks the number of kept friendships of a (possibly partial) bus assignment
+
+        Moving a student costs O(degree + groups of the student) unless the move breaks up
+        or completes a rowdy group, in which case the friendships of the members whose
+        friendships start or stop counting are looked up as well.
+
+        Attributes:
+            instance - the Instance being solved
+            student_to_bus - an integer array with the bus of each student, -1 if unplaced
+            bus_loads - an integer array with the number of students on each bus
+            group_bus_counts - a (groups, buses) integer array with the number of members of each group on each bus
+            intact_groups_of_student - an integer array with the number of rowdy groups of each student that
+                sit entirely on one bus; a student's friendships only count while this is 0
+            alive_friend_counts - a (students, buses) integer array with the number of friends of each student
+                on each bus whose friendships count, or None when it would not fit in max_friend_count_cells
+            kept - the number of kept friendships (self-loops included)
+            bus_riders - a set of the students on each bus, built by the first call of riders_of
+            total_edges - the number of friendships in the input
+    '''
+
+    # above this many cells, friends on a bus are counted from the adjacency instead of being tracked
+    max_friend_count_cells = 20000000
+
+    def __init__(self, instance, student_to_bus=None, track_friend_counts=True):
+        self.instance = instance
+        self.num_buses = instance.num_buses
+        # plain ndarray views, slicing cached memory maps on every move is noticeably slower
+        student_group_indptr = np.asarray(instance.student_group_indptr).tolist()
+        student_group_indices = np.asarray(instance.student_group_indices)
+        self.student_groups = [student_group_indices[student_group_indptr[i]:student_group_indptr[i + 1]]
+                               for i in range(instance.num_students)]
+        adjacency_indptr = np.asarray(instance.adjacency_indptr).tolist()
+        adjacency_indices = np.asarray(instance.adjacency_indices)
+        self.student_neighbors = [adjacency_indices[adjacency_indptr[i]:adjacency_indptr[i + 1]]
+                                  for i in range(instance.num_students)]
+        group_indptr = np.asarray(instance.group_indptr).tolist()
+        group_members = np.asarray(instance.group_members)
+        self.group_member_lists = [group_members[group_indptr[g]:group_indptr[g + 1]] for g in range(instance.num_groups)]
+        # the same as plain lists, to look groups up one at a time
+        self.student_group_ids = [groups.tolist() for groups in self.student_groups]
+        self.group_sizes_list = np.diff(group_indptr).tolist()
+        self.marked = np.zeros(instance.num_students, dtype=bool)
+        self.track_friend_counts = track_friend_counts and instance.num_students * instance.num_buses <= self.max_friend_count_cells
+        self.total_edges = len(instance.edges)
+        self.group_sizes = np.diff(instance.group_indptr)
+        self.member_groups = np.repeat(np.arange(instance.num_groups), self.group_sizes)
+        self.self_loops = np.bincount(instance.edges[instance.edges[:, 0] == instance.edges[:, 1], 0],
+                                      minlength=instance.num_students)
+        self.history = []
+        if student_to_bus is None:
+            student_to_bus = np.full(instance.num_students, -1, dtype=np.int64)
+        self.reset(student_to_bus)
+
+    def reset(self, student_to_bus):
+        '''Recomputes every count from scratch for the given assignment and clears the undo history'''
+        instance = self.instance
+        self.student_to_bus = np.array(student_to_bus, dtype=np.int64)
+        placed = self.student_to_bus >= 0
+        self.bus_loads = np.bincount(self.student_to_bus[placed], minlength=self.num_buses)
+
+        max_group = self.group_sizes.max() if len(self.group_sizes) > 0 else 0
+        dtype = np.int16 if max_group < np.iinfo(np.int16).max else np.int32
+        self.group_bus_counts = np.zeros((instance.num_groups, self.num_buses), dtype=dtype)
+        member_buses = self.student_to_bus[instance.group_members]
+        placed_members = member_buses >= 0
+        np.add.at(self.group_bus_counts, (self.member_groups[placed_members], member_buses[placed_members]), 1)
+
+        intact = (self.group_bus_counts == self.group_sizes[:, None]).any(axis=1) & (self.group_sizes > 0)
+        self.intact_groups_of_student = np.bincount(instance.group_members[intact[self.member_groups]],
+                                                    minlength=instance.num_students)
+
+        sources = instance.edges[:, 0]
+        targets = instance.edges[:, 1]
+        alive = self.intact_groups_of_student == 0
+        self.kept = int(np.count_nonzero((self.student_to_bus[sources] == self.student_to_bus[targets])
+                                         & placed[sources] & alive[sources] & alive[targets]))
+
+        self.alive_friend_counts = None
+        if self.track_friend_counts:
+            self.alive_friend_counts = np.zeros((instance.num_students, self.num_buses), dtype=np.int32)
+            friends = instance.adjacency_indices
+            students = np.repeat(np.arange(instance.num_students), np.diff(instance.adjacency_indptr))
+            counted = placed[friends] & alive[friends]
+            np.add.at(self.alive_friend_counts, (students[counted], self.student_to_bus[friends[counted]]), 1)
+        self.bus_riders = None
+        self.history = []
+
+    def riders_of(self, bus):
+        '''The students on bus as a sorted integer array, in O(size_bus) once the first call has indexed the buses'''
+        if self.bus_riders is None:
+            self.bus_riders = [set() for _ in range(self.num_buses)]
+            for student, student_bus in enumerate(self.student_to_bus.tolist()):
+                if student_bus >= 0:
+                    self.bus_riders[student_bus].add(student)
+        return np.sort(np.fromiter(self.bus_riders[bus], dtype=np.int64, count=len(self.bus_riders[bus])))
+
+    def score(self):
+        '''The fraction of friendships kept, as reported by output_scorer'''
+        return self.kept / self.total_edges
+
+    def energy(self):
+        '''The number of friendships lost'''
+        return self.total_edges - self.kept
+
+    def group_changes(self, student, bus):
+        '''(group, 1) for each rowdy group of student that moving it to bus would complete, and (group, -1) for each it would break up'''
+        old_bus = int(self.student_to_bus[student])
+        if old_bus == bus or len(self.student_group_ids[student]) == 0:
+            return []
+        can_break = old_bus >= 0 and self.intact_groups_of_student[student] > 0
+        if len(self.student_group_ids[student]) > 8:
+            groups = self.student_groups[student]
+            was_intact = np.zeros(len(groups), dtype=bool)
+            if can_break:
+                was_intact = self.group_bus_counts[groups, old_bus] == self.group_sizes[groups]
+            now_intact = np.zeros(len(groups), dtype=bool)
+            if bus >= 0:
+                now_intact = self.group_bus_counts[groups, bus] + 1 == self.group_sizes[groups]
+            flipped = np.flatnonzero(was_intact != now_intact)
+            return [(group, 1 if now else -1) for group, now in zip(groups[flipped].tolist(), now_intact[flipped].tolist())]
+
+        # with only a few groups, one lookup at a time beats gathering them
+        counts = self.group_bus_counts
+        sizes = self.group_sizes_list
+        changes = []
+        for group in self.student_group_ids[student]:
+            was_intact = can_break and counts.item(group, old_bus) == sizes[group]
+            now_intact = bus >= 0 and counts.item(group, bus) + 1 == sizes[group]
+            if was_intact != now_intact:
+                changes.append((group, 1 if now_intact else -1))
+        return changes
+
+    def changed_groups(self, student, bus):
+        '''The rowdy groups of student that would be completed or broken up by moving it to bus'''
+        return np.array([group for group, _ in self.group_changes(student, bus)], dtype=np.int64)
+
+    def alive_friends_on_bus(self, student, bus):
+        '''The number of friends of student on bus whose friendships currently count'''
+        if self.alive_friend_counts is not None:
+            return int(self.alive_friend_counts[student, bus])
+        friends = self.student_neighbors[student]
+        return int(np.count_nonzero((self.student_to_bus[friends] == bus) & (self.intact_groups_of_student[friends] == 0)))
+
+    def move_delta(self, student, bus):
+        '''The change in kept friendships if student moved to bus (-1 to unplace), without moving it'''
+        old_bus = self.student_to_bus[student]
+        if old_bus == bus:
+            return 0
+        changes = self.group_changes(student, bus)
+        if len(changes) > 0:
+            return self._delta(((student, bus),), changes)
+        if self.intact_groups_of_student[student] > 0:
+            return 0
+        delta = 0
+        if bus >= 0:
+            delta += self.alive_friends_on_bus(student, bus) + int(self.self_loops[student])
+        if old_bus >= 0:
+            delta -= self.alive_friends_on_bus(student, old_bus) + int(self.self_loops[student])
+        return delta
+
+    def swap_delta(self, student, other):
+        '''The change in kept friendships if the two students swapped buses, without swapping them'''
+        bus = self.student_to_bus[student]
+        other_bus = self.student_to_bus[other]
+        if bus == other_bus:
+            return 0
+        moves = ((student, other_bus), (other, bus))
+        changes = self.group_changes(student, other_bus)
+        other_changes = self.group_changes(other, bus)
+        if len(changes) > 0 or len(other_changes) > 0:
+            # the counts of a group the two share do not change, whatever each move would do on its own
+            changes = [(group, change) for group, change in changes if group not in self.student_group_ids[other]] \
+                + [(group, change) for group, change in other_changes if group not in self.student_group_ids[student]]
+            if len(changes) > 0:
+                return self._delta(moves, changes)
+        if bus < 0 or other_bus < 0:
+            return self._delta(moves, [])
+        alive = self.intact_groups_of_student[student] == 0
+        other_alive = self.intact_groups_of_student[other] == 0
+        delta = 0
+        if alive:
+            delta += self.alive_friends_on_bus(student, other_bus) - self.alive_friends_on_bus(student, bus)
+        if other_alive:
+            delta += self.alive_friends_on_bus(other, bus) - self.alive_friends_on_bus(other, other_bus)
+        if alive and other_alive:
+            # each counted the other on the bus it is about to leave
+            delta -= 2 * int(np.count_nonzero(self.student_neighbors[student] == other))
+        return delta
+
+    def _delta(self, moves, group_changes):
+        '''
+            The change in kept friendships if every (student, bus) of moves were made at once and completed
+            (1) or broke up (-1) the groups of group_changes, without making them. A friendship only changes
+            if one of its ends moves or starts or stops counting, so only the friendships of those students
+            are looked at: the ones to friends outside that set through alive_friend_counts (or the friends'
+            buses without it), and the ones inside it one by one.
+        '''
+        student_to_bus = self.student_to_bus
+        intact_groups = self.intact_groups_of_student
+        new_bus = {student: int(bus) for student, bus in moves}
+        intact_change = {}
+        for group, change in group_changes:
+            for member in self.group_member_lists[group].tolist():
+                intact_change[member] = intact_change.get(member, 0) + change
+
+        # the students whose friendships change: the ones moved and the ones whose friendships start or stop counting
+        alive_before = {}
+        alive_after = {}
+        for student in new_bus:
+            intact = int(intact_groups[student])
+            alive_before[student] = intact == 0
+            alive_after[student] = intact + intact_change.get(student, 0) == 0
+        for member, change in intact_change.items():
+            if member not in new_bus:
+                intact = int(intact_groups[member])
+                if (intact == 0) != (intact + change == 0):
+                    alive_before[member] = intact == 0
+                    alive_after[member] = not alive_before[member]
+        students = list(alive_before)
+        bus_before = {student: int(student_to_bus[student]) for student in students}
+        bus_after = {student: new_bus.get(student, bus_before[student]) for student in students}
+
+        counts = self.alive_friend_counts
+        marked = self.marked
+        if len(students) > 1:
+            marked[students] = True
+        delta = 0
+        for student in students:
+            before, after = bus_before[student], bus_after[student]
+            counted_before = alive_before[student] and before >= 0
+            counted_after = alive_after[student] and after >= 0
+            friends = self.student_neighbors[student]
+            inside = friends[marked[friends]].tolist() if len(students) > 1 else []
+            # friendships with students outside the set, whose bus and status stay put
+            if counts is not None:
+                outside_before = int(counts[student, before]) if counted_before else 0
+                outside_after = int(counts[student, after]) if counted_after else 0
+                for friend in inside:
+                    if alive_before[friend]:
+                        friend_bus = bus_before[friend]
+                        outside_before -= counted_before and friend_bus == before
+                        outside_after -= counted_after and friend_bus == after
+            else:
+                outside = friends[~marked[friends]] if len(students) > 1 else friends
+                outside_alive = intact_groups[outside] == 0
+                outside_buses = student_to_bus[outside]
+                outside_before = int(np.count_nonzero(outside_alive & (outside_buses == before))) if counted_before else 0
+                outside_after = int(np.count_nonzero(outside_alive & (outside_buses == after))) if counted_after else 0
+            delta += outside_after - outside_before + int(self.self_loops[student]) * (counted_after - counted_before)
+            # friendships inside the set, seen from the lower end
+            for friend in inside:
+                if friend > student:
+                    delta += (counted_after and alive_after[friend] and bus_after[friend] == after) \
+                        - (counted_before and alive_before[friend] and bus_before[friend] == before)
+        if len(students) > 1:
+            marked[students] = False
+        return int(delta)
+
+    def apply_move(self, student, bus):
+        '''Moves student to bus (-1 to unplace), records the move for undo and returns the change in kept friendships'''
+        old_bus = self.student_to_bus[student]
+        delta = self._move(student, bus)
+        self.history.append((student, old_bus))
+        return delta
+
+    def apply_swap(self, student, other):
+        '''Swaps the buses of two students (recorded as two moves) and returns the change in kept friendships'''
+        other_bus = self.student_to_bus[other]
+        delta = self.apply_move(other, self.student_to_bus[student])
+        return delta + self.apply_move(student, other_bus)
+
+    def undo(self, moves=1):
+        '''Reverts the last recorded moves and returns the change in kept friendships'''
+        delta = 0
+        for _ in range(moves):
+            student, old_bus = self.history.pop()
+            delta += self._move(student, old_bus)
+        return delta
+
+    def clear_history(self):
+        '''Forgets the recorded moves, e.g. once a move is accepted for good'''
+        self.history = []
+
+    def _move(self, student, bus):
+        old_bus = self.student_to_bus[student]
+        if old_bus == bus:
+            return 0
+        changes = self.group_changes(student, bus)
+        if len(changes) == 0:
+            delta = self.move_delta(student, bus)
+            self._relocate(student, old_bus, bus)
+            self.kept += delta
+            return delta
+
+        # completing or breaking up a rowdy group changes which members' friendships count
+        delta = self._delta(((student, bus),), changes)
+        self._relocate(student, old_bus, bus)
+        for group, change in changes:
+            members = self.group_member_lists[group]
+            if change < 0:
+                self.intact_groups_of_student[members] -= 1
+                self._count_friendships_of([m for m in members.tolist() if self.intact_groups_of_student[m] == 0], 1)
+            else:
+                self._count_friendships_of([m for m in members.tolist() if self.intact_groups_of_student[m] == 0], -1)
+                self.intact_groups_of_student[members] += 1
+        self.kept += delta
+        return delta
+
+    def _relocate(self, student, old_bus, bus):
+        groups = self.student_groups[student]
+        has_groups = len(groups) > 0
+        counted = self.alive_friend_counts is not None and self.intact_groups_of_student[student] == 0
+        if self.bus_riders is not None:
+            if old_bus >= 0:
+                self.bus_riders[old_bus].discard(student)
+            if bus >= 0:
+                self.bus_riders[bus].add(student)
+        if old_bus >= 0:
+            self.bus_loads[old_bus] -= 1
+            if has_groups:
+                self.group_bus_counts[groups, old_bus] -= 1
+            if counted:
+                self.alive_friend_counts[self.student_neighbors[student], old_bus] -= 1
+        if bus >= 0:
+            self.bus_loads[bus] += 1
+            if has_groups:
+                self.group_bus_counts[groups, bus] += 1
+            if counted:
+                self.alive_friend_counts[self.student_neighbors[student], bus] += 1
+        self.student_to_bus[student] = bus
+
+    def _count_friendships_of(self, students, sign):
+        # a student's friendships start (sign 1) or stop (sign -1) counting for its friends
+        if self.alive_friend_counts is None:
+            return
+        for student in students:
+            bus = self.student_to_bus[student]
+            if bus >= 0:
+                self.alive_friend_counts[self.student_neighbors[student], bus] += sign
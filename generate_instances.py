@@ -0,0 +1,199 @@
+import os
+import argparse
+import numpy as np
+
+####################################################
+# To run:
+#   python3 generate_instances.py <folder> --students N [options]
+#
+# Writes a synthetic input, graph.gml and
+# parameters.txt in the format of all_inputs, to
+# <folder>. The friendship graph is one of
+#   uniform   - every pair of students equally likely
+#               (Erdos-Renyi with the given mean degree)
+#   powerlaw  - Chung-Lu, expected degrees drawn from
+#               a power law with exponent --exponent
+#   clustered - planted clusters of about a bus worth
+#               of students, --inside of the friendships
+#               within a cluster
+# Rowdy groups have sizes drawn uniformly between
+# --group-min and --group-max; with --friendly-groups
+# each one is grown from a random student through
+# their friends, so breaking it up costs something.
+# Everything is drawn from --seed, and only numpy is
+# needed, so inputs of 100k+ students take seconds.
+####################################################
+
+degree_models = ["uniform", "powerlaw", "clustered"]
+
+
+def draw_pairs(rng, num_students, num_pairs, weights=None):
+    '''Draws num_pairs student pairs, each end independently and uniformly or in proportion to weights'''
+    if weights is None:
+        return rng.integers(0, num_students, size=(num_pairs, 2))
+    return rng.choice(num_students, size=(num_pairs, 2), p=weights / weights.sum())
+
+
+def unique_edges(pairs, num_students):
+    '''Drops self-loops and repeated pairs, and orders each edge smallest student first'''
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    keys = np.unique(np.minimum(pairs[:, 0], pairs[:, 1]) * num_students + np.maximum(pairs[:, 0], pairs[:, 1]))
+    return np.stack([keys // num_students, keys % num_students], axis=1)
+
+
+def generate_edges(rng, num_students, mean_degree, degree_model="uniform", exponent=2.5, cluster_size=None, inside=0.8):
+    '''
+        Draws a friendship graph
+
+        Inputs:
+            rng - a numpy Generator
+            num_students - the number of students
+            mean_degree - the expected number of friends per student
+            degree_model - one of degree_models, see the top of this file
+            exponent - the power law exponent of the powerlaw model
+            cluster_size - the students per cluster of the clustered model
+            inside - the fraction of friendships within a cluster in the clustered model
+
+        Outputs:
+            an (E, 2) integer array of distinct friendships without self-loops
+    '''
+    num_pairs = int(round(num_students * mean_degree / 2))
+    if degree_model == "uniform":
+        pairs = draw_pairs(rng, num_students, num_pairs)
+    elif degree_model == "powerlaw":
+        # Pareto weights with density ~ w^-exponent
+        pairs = draw_pairs(rng, num_students, num_pairs, rng.pareto(exponent - 1, num_students) + 1)
+    elif degree_model == "clustered":
+        cluster_size = max(2, cluster_size or 1)
+        clusters = rng.permutation(num_students)
+        num_inside = int(round(num_pairs * inside))
+        # both ends in the same run of cluster_size students of the permutation
+        first = rng.integers(0, num_students, size=num_inside)
+        cluster_start = first - first % cluster_size
+        cluster_end = np.minimum(cluster_start + cluster_size, num_students)
+        second = cluster_start + (rng.random(num_inside) * (cluster_end - cluster_start)).astype(np.int64)
+        inside_pairs = np.stack([clusters[first], clusters[second]], axis=1)
+        pairs = np.concatenate([inside_pairs, draw_pairs(rng, num_students, num_pairs - num_inside)])
+    else:
+        raise ValueError("unknown degree model {}".format(degree_model))
+    return unique_edges(pairs, num_students)
+
+
+def generate_groups(rng, num_students, num_groups, group_min, group_max, edges=None):
+    '''
+        Draws rowdy groups with sizes uniform between group_min and group_max. Given the edges, each
+        group is grown from a random student by adding random friends of its members (topped up with
+        random students when it runs out of friends), otherwise members are drawn at random.
+
+        Outputs:
+            a list of rowdy groups, each a sorted array of distinct student indices
+    '''
+    group_min = max(1, min(group_min, num_students))
+    group_max = max(group_min, min(group_max, num_students))
+    if edges is not None:
+        order = np.argsort(np.concatenate([edges[:, 0], edges[:, 1]]), kind="stable")
+        friends = np.concatenate([edges[:, 1], edges[:, 0]])[order]
+        indptr = np.zeros(num_students + 1, dtype=np.int64)
+        np.cumsum(np.bincount(np.concatenate([edges[:, 0], edges[:, 1]]), minlength=num_students), out=indptr[1:])
+
+    groups = []
+    for size in rng.integers(group_min, group_max + 1, size=num_groups).tolist():
+        if edges is None:
+            groups.append(np.sort(rng.choice(num_students, size=size, replace=False)))
+            continue
+        members = [int(rng.integers(num_students))]
+        chosen = set(members)
+        attempts = 0
+        while len(members) < size:
+            attempts += 1
+            member = members[int(rng.integers(len(members)))]
+            candidates = friends[indptr[member]:indptr[member + 1]]
+            if len(candidates) > 0 and attempts <= 4 * size:
+                student = int(candidates[int(rng.integers(len(candidates)))])
+            else:
+                student = int(rng.integers(num_students))
+            if student not in chosen:
+                chosen.add(student)
+                members.append(student)
+        groups.append(np.sort(np.array(members, dtype=np.int64)))
+    return groups
+
+
+def write_instance(folder_name, num_students, edges, num_buses, size_bus, groups):
+    '''
+        Writes graph.gml and parameters.txt to folder_name, in the layout NetworkX writes and
+        read_gml in instance.py reads without falling back to NetworkX. Students are named by index.
+    '''
+    os.makedirs(folder_name, exist_ok=True)
+    with open(folder_name + "/graph.gml", "w") as graph_file:
+        graph_file.write("graph [\n")
+        for start in range(0, num_students, 10000):
+            graph_file.write("".join('  node [\n    id {0}\n    label "{0}"\n  ]\n'.format(i)
+                                     for i in range(start, min(start + 10000, num_students))))
+        for start in range(0, len(edges), 10000):
+            graph_file.write("".join("  edge [\n    source {}\n    target {}\n  ]\n".format(u, v)
+                                     for u, v in edges[start:start + 10000].tolist()))
+        graph_file.write("]\n")
+    with open(folder_name + "/parameters.txt", "w") as parameters:
+        parameters.write("{}\n{}\n".format(num_buses, size_bus))
+        for group in groups:
+            parameters.write(str([str(student) for student in group.tolist()]) + "\n")
+
+
+def generate_instance(folder_name, num_students, num_buses=None, size_bus=None, mean_degree=10.0, degree_model="clustered",
+                      exponent=2.5, inside=0.8, num_groups=None, group_min=2, group_max=10, friendly_groups=True, seed=None):
+    '''
+        Draws and writes one input, see the top of this file
+
+        Inputs:
+            folder_name - the folder to write graph.gml and parameters.txt to
+            num_students - the number of students
+            num_buses - the number of buses, num_students // 25 (at least 1) by default
+            size_bus - the capacity of a bus, by default the fewest seats that fit everyone plus 20%
+            mean_degree, degree_model, exponent, inside - see generate_edges
+            num_groups - the number of rowdy groups, num_students // 10 by default
+            group_min, group_max - the range of rowdy group sizes
+            friendly_groups - whether rowdy groups are grown through friendships
+            seed - seeds everything drawn
+
+        Outputs:
+            (num_buses, size_bus, number of friendships, number of rowdy groups)
+    '''
+    if num_buses is None:
+        num_buses = max(1, num_students // 25)
+    if size_bus is None:
+        size_bus = max(1, -(-num_students * 6 // (5 * num_buses)))
+    if num_buses > num_students or num_buses * size_bus < num_students:
+        raise ValueError("{} buses of {} seats cannot hold {} students with none empty".format(num_buses, size_bus, num_students))
+    if num_groups is None:
+        num_groups = num_students // 10
+
+    rng = np.random.default_rng(seed)
+    edges = generate_edges(rng, num_students, mean_degree, degree_model, exponent, size_bus, inside)
+    groups = generate_groups(rng, num_students, num_groups, group_min, group_max, edges if friendly_groups else None)
+    write_instance(folder_name, num_students, edges, num_buses, size_bus, groups)
+    return num_buses, size_bus, len(edges), len(groups)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic input in the format of all_inputs")
+    parser.add_argument("folder", help="the folder to write graph.gml and parameters.txt to")
+    parser.add_argument("--students", type=int, required=True, help="number of students")
+    parser.add_argument("--buses", type=int, default=None, help="number of buses (default: students // 25)")
+    parser.add_argument("--bus-size", type=int, default=None, help="seats per bus (default: enough for everyone plus 20%%)")
+    parser.add_argument("--degree", type=float, default=10.0, help="mean number of friends per student (default: %(default)s)")
+    parser.add_argument("--degree-model", choices=degree_models, default="clustered", help="how friendships are drawn (default: %(default)s)")
+    parser.add_argument("--exponent", type=float, default=2.5, help="power law exponent of the powerlaw model (default: %(default)s)")
+    parser.add_argument("--inside", type=float, default=0.8,
+                        help="fraction of friendships within a cluster in the clustered model (default: %(default)s)")
+    parser.add_argument("--groups", type=int, default=None, help="number of rowdy groups (default: students // 10)")
+    parser.add_argument("--group-min", type=int, default=2, help="smallest rowdy group (default: %(default)s)")
+    parser.add_argument("--group-max", type=int, default=10, help="largest rowdy group (default: %(default)s)")
+    parser.add_argument("--random-groups", action="store_true", help="draw rowdy groups at random instead of through friendships")
+    parser.add_argument("--seed", type=int, default=None, help="seed for everything drawn")
+    args = parser.parse_args()
+    num_buses, size_bus, num_edges, num_groups = generate_instance(
+        args.folder, args.students, args.buses, args.bus_size, args.degree, args.degree_model, args.exponent, args.inside,
+        args.groups, args.group_min, args.group_max, not args.random_groups, args.seed)
+    print("Wrote {} students, {} friendships, {} rowdy groups, {} buses of {} to {}".format(
+        args.students, num_edges, num_groups, num_buses, size_bus, args.folder))
@@ -0,0 +1,148 @@
+import numpy as np
+from evaluator import ScoreEvaluator
+
+####################################################
+# Exact integer program for an input, solved with
+# CBC through PuLP (pip install pulp, CBC ships
+# with it). PuLP is only imported when a model is
+# built, so the rest of the project runs without it.
+#
+# Variables:
+#   on_bus[i, b]   - student i rides bus b
+#   intact[g, b]   - rowdy group g sits entirely on bus b
+#   removed[i]     - student i is in an intact rowdy group
+#   kept[e]        - friendship e is kept
+# A friendship (u, v) can only be kept if u and v
+# share a bus and neither was removed. Bus labels
+# are interchangeable, so student i may only ride
+# buses 0..i, which leaves one labelling of each
+# assignment.
+####################################################
+
+
+def available():
+    '''Returns whether PuLP (and with it the CBC solver) can be imported'''
+    try:
+        import pulp
+    except ImportError:
+        return False
+    return True
+
+
+def canonical_buses(student_to_bus, num_buses):
+    '''
+        Relabels buses in order of their first student, so student i is on a bus numbered at most i
+        as the symmetry breaking constraints require. Unused buses get the remaining labels.
+    '''
+    student_to_bus = np.asarray(student_to_bus)
+    first_students = np.full(num_buses, len(student_to_bus), dtype=np.int64)
+    np.minimum.at(first_students, student_to_bus, np.arange(len(student_to_bus)))
+    relabel = np.empty(num_buses, dtype=np.int64)
+    relabel[np.argsort(first_students, kind="stable")] = np.arange(num_buses)
+    return relabel[student_to_bus]
+
+
+def solve_exact(instance, student_to_bus=None, time_limit=None, threads=1):
+    '''
+        Solves an input with the integer program above
+
+        Inputs:
+            instance - the Instance to solve
+            student_to_bus - a valid assignment to warm start from, e.g. the greedy one
+            time_limit - the seconds CBC may use; the best assignment found so far is returned after that
+            threads - the number of CBC threads
+
+        Outputs:
+            (student_to_bus, optimal)
+            student_to_bus - the best assignment found, never worse than the warm start
+            optimal - whether CBC proved it optimal within the time limit
+    '''
+    import pulp
+
+    num_students = instance.num_students
+    num_buses = instance.num_buses
+    edges = np.asarray(instance.edges).tolist()
+    groups = [instance.members_of(g).tolist() for g in range(instance.num_groups)]
+    groups = [members for members in groups if len(members) > 0]
+
+    model = pulp.LpProblem("bus_assignment", pulp.LpMaximize)
+    on_bus = {(i, b): pulp.LpVariable("on_bus_{}_{}".format(i, b), cat="Binary")
+              for i in range(num_students) for b in range(min(i + 1, num_buses))}
+    intact = {(g, b): pulp.LpVariable("intact_{}_{}".format(g, b), lowBound=0, upBound=1)
+              for g, members in enumerate(groups) for b in range(min(members[0] + 1, num_buses))}
+    removed = [pulp.LpVariable("removed_{}".format(i), lowBound=0, upBound=1) for i in range(num_students)]
+    kept = [pulp.LpVariable("kept_{}".format(e), lowBound=0, upBound=1) for e in range(len(edges))]
+
+    model += pulp.lpSum(kept)
+    for i in range(num_students):
+        model += pulp.lpSum(on_bus[i, b] for b in range(min(i + 1, num_buses))) == 1
+    for b in range(num_buses):
+        riders = [on_bus[i, b] for i in range(b, num_students)]
+        model += pulp.lpSum(riders) >= 1
+        model += pulp.lpSum(riders) <= instance.size_bus
+
+    # a group is intact on b once all of its members ride b; only the lower bound matters since
+    # intact groups only ever cost friendships
+    for g, members in enumerate(groups):
+        for b in range(min(members[0] + 1, num_buses)):
+            model += intact[g, b] >= pulp.lpSum(on_bus[i, b] for i in members) - (len(members) - 1)
+            for i in members:
+                model += removed[i] >= intact[g, b]
+
+    for e, (u, v) in enumerate(edges):
+        model += kept[e] <= 1 - removed[u]
+        if u == v:
+            continue
+        model += kept[e] <= 1 - removed[v]
+        # kept only if u and v share a bus: for each bus, u on it and v not forces kept to 0
+        first, second = min(u, v), max(u, v)
+        for b in range(min(second + 1, num_buses)):
+            if b <= first:
+                model += kept[e] <= 1 - on_bus[second, b] + on_bus[first, b]
+            else:
+                model += kept[e] <= 1 - on_bus[second, b]
+
+    warm_start = None
+    if student_to_bus is not None:
+        warm_start = canonical_buses(student_to_bus, num_buses)
+        set_initial_values(instance, groups, edges, warm_start, on_bus, intact, removed, kept)
+
+    solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit, threads=threads, warmStart=warm_start is not None)
+    try:
+        model.solve(solver)
+    except pulp.PulpSolverError:
+        # CBC refuses some very short time limits; the warm start is still a valid answer
+        return warm_start, False
+
+    found = None
+    if model.sol_status in (pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible):
+        found = np.zeros(num_students, dtype=np.int64)
+        for (i, b), variable in on_bus.items():
+            if variable.value() is not None and variable.value() > 0.5:
+                found[i] = b
+        loads = np.bincount(found, minlength=num_buses)
+        if loads.min() < 1 or loads.max() > instance.size_bus:
+            found = None
+
+    if found is None:
+        return warm_start, False
+    if warm_start is not None and ScoreEvaluator(instance, warm_start, track_friend_counts=False).kept > \
+            ScoreEvaluator(instance, found, track_friend_counts=False).kept:
+        return warm_start, False
+    return found, model.sol_status == pulp.LpSolutionOptimal
+
+
+def set_initial_values(instance, groups, edges, student_to_bus, on_bus, intact, removed, kept):
+    # gives every variable its value in student_to_bus, for CBC to start from
+    for (i, b), variable in on_bus.items():
+        variable.setInitialValue(int(student_to_bus[i] == b))
+    is_removed = np.zeros(instance.num_students, dtype=bool)
+    for (g, b), variable in intact.items():
+        whole = all(student_to_bus[i] == b for i in groups[g])
+        variable.setInitialValue(int(whole))
+        if whole:
+            is_removed[groups[g]] = True
+    for i, variable in enumerate(removed):
+        variable.setInitialValue(int(is_removed[i]))
+    for e, (u, v) in enumerate(edges):
+        kept[e].setInitialValue(int(student_to_bus[u] == student_to_bus[v] and not is_removed[u] and not is_removed[v]))
@@ -0,0 +1,286 @@
+import re
+import numpy as np
+
+####################################################
+# Fast loader for the inputs in all_inputs.
+#
+# The graph.gml files only use a small part of GML:
+# one graph with node [ id label ... ] and
+# edge [ source target ... ] blocks. This reads that
+# dialect line by line straight into integer arrays
+# and falls back to NetworkX for anything else.
+####################################################
+
+# tokens are brackets, quoted strings, or runs of anything else
+gml_token = re.compile(r'\[|\]|"[^"]*"|[^\s\[\]"]+')
+
+
+class UnexpectedGML(Exception):
+    '''Raised by the fast GML reader when a file needs the full NetworkX parser'''
+
+
+class Instance:
+    '''
+        An input held as flat integer arrays. Student i is the i-th node of graph.gml.
+
+        Attributes:
+            student_names - a list of the student names (node labels) in graph order
+            name_to_index - a dictionary mapping each student name to its index
+            num_buses - an integer representing the number of buses you can allocate to
+            size_bus - an integer representing the number of students that can fit on a bus
+            edges - an (E, 2) integer array with every friendship in graph.gml, self-loops included
+            adjacency_indptr, adjacency_indices - the friends of student i (self excluded) are
+                adjacency_indices[adjacency_indptr[i]:adjacency_indptr[i + 1]]
+            group_indptr, group_members - the members of rowdy group g are
+                group_members[group_indptr[g]:group_indptr[g + 1]], sorted
+            student_group_indptr, student_group_indices - the rowdy groups of student i are
+                student_group_indices[student_group_indptr[i]:student_group_indptr[i + 1]], sorted
+    '''
+
+    # every array attribute, in the order they are saved by instance_cache.py
+    array_fields = ["edges", "adjacency_indptr", "adjacency_indices", "group_indptr", "group_members",
+                    "student_group_indptr", "student_group_indices"]
+
+    def __init__(self, student_names, num_buses, size_bus, edges, group_indptr, group_members):
+        self.student_names = student_names
+        self.name_to_index = {name: i for i, name in enumerate(student_names)}
+        self.num_buses = num_buses
+        self.size_bus = size_bus
+        self.edges = edges
+        self.group_indptr = group_indptr
+        self.group_members = group_members
+
+        num_students = len(student_names)
+        friendships = edges[edges[:, 0] != edges[:, 1]]
+        sources = np.concatenate([friendships[:, 0], friendships[:, 1]])
+        targets = np.concatenate([friendships[:, 1], friendships[:, 0]])
+        order = np.argsort(sources, kind="stable")
+        self.adjacency_indices = targets[order]
+        self.adjacency_indptr = np.zeros(num_students + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=num_students), out=self.adjacency_indptr[1:])
+
+        member_groups = np.repeat(np.arange(self.num_groups, dtype=np.int64), np.diff(group_indptr))
+        order = np.argsort(group_members, kind="stable")
+        self.student_group_indices = member_groups[order]
+        self.student_group_indptr = np.zeros(num_students + 1, dtype=np.int64)
+        np.cumsum(np.bincount(group_members, minlength=num_students), out=self.student_group_indptr[1:])
+
+    @classmethod
+    def from_arrays(cls, student_names, num_buses, size_bus, arrays):
+        '''Rebuilds an Instance from already computed arrays (a dictionary keyed by array_fields)'''
+        instance = cls.__new__(cls)
+        instance.student_names = student_names
+        instance.name_to_index = {name: i for i, name in enumerate(student_names)}
+        instance.num_buses = num_buses
+        instance.size_bus = size_bus
+        for field in cls.array_fields:
+            setattr(instance, field, arrays[field])
+        return instance
+
+    @property
+    def num_students(self):
+        return len(self.student_names)
+
+    @property
+    def num_groups(self):
+        return len(self.group_indptr) - 1
+
+    def neighbors(self, student_index):
+        return self.adjacency_indices[self.adjacency_indptr[student_index]:self.adjacency_indptr[student_index + 1]]
+
+    def groups_of(self, student_index):
+        return self.student_group_indices[self.student_group_indptr[student_index]:self.student_group_indptr[student_index + 1]]
+
+    def members_of(self, group_index):
+        return self.group_members[self.group_indptr[group_index]:self.group_indptr[group_index + 1]]
+
+    @property
+    def constraints(self):
+        '''The rowdy groups as lists of student names, the way parameters.txt lists them'''
+        return [[self.student_names[i] for i in self.members_of(g)] for g in range(self.num_groups)]
+
+    def to_graph(self):
+        '''Builds the friendship graph (without self-loops) as a NetworkX object'''
+        import networkx as nx
+        graph = nx.Graph()
+        graph.add_nodes_from(self.student_names)
+        names = self.student_names
+        graph.add_edges_from((names[u], names[v]) for u, v in self.edges.tolist() if u != v)
+        return graph
+
+
+def read_gml(file_name):
+    '''
+        Reads graph.gml without building a graph
+
+        Inputs:
+            file_name - the path to a graph.gml file
+
+        Outputs:
+            (student_names, edges)
+            student_names - a list of node labels in file order
+            edges - an (E, 2) integer array of node indices, in file order
+
+        Raises UnexpectedGML for anything outside the dialect used by the inputs
+        (directed or multigraphs, nested attributes, escapes, missing or repeated
+        ids/labels, duplicated edges) so the caller can use NetworkX instead.
+    '''
+    student_names = []
+    node_ids = []
+    sources = []
+    targets = []
+    stack = []
+    key = None
+    current = None
+
+    with open(file_name) as gml_file:
+        for line in gml_file:
+            if '"' in line or "[" in line or "]" in line:
+                tokens = gml_token.findall(line)
+            else:
+                tokens = line.split()
+            for token in tokens:
+                if key is None:
+                    if token == "]":
+                        if not stack:
+                            raise UnexpectedGML("unbalanced ]")
+                        block = stack.pop()
+                        if block == "node":
+                            if "id" not in current or "label" not in current:
+                                raise UnexpectedGML("node without id or label")
+                            node_ids.append(current["id"])
+                            student_names.append(current["label"])
+                        elif block == "edge":
+                            if "source" not in current or "target" not in current:
+                                raise UnexpectedGML("edge without source or target")
+                            sources.append(current["source"])
+                            targets.append(current["target"])
+                        current = None
+                    elif token == "[" or token[0] == "#":
+                        raise UnexpectedGML("unexpected token {}".format(token))
+                    else:
+                        key = token
+                    continue
+
+                if token == "[":
+                    if stack == [] and key == "graph":
+                        stack.append("graph")
+                    elif stack == ["graph"] and key in ("node", "edge"):
+                        stack.append(key)
+                        current = {}
+                    else:
+                        raise UnexpectedGML("nested list {}".format(key))
+                elif token == "]":
+                    raise UnexpectedGML("missing value for {}".format(key))
+                elif current is not None:
+                    if key in current:
+                        raise UnexpectedGML("repeated {}".format(key))
+                    if key == "label":
+                        if token[0] != '"' or "&" in token or "\\" in token:
+                            raise UnexpectedGML("label {}".format(token))
+                        current[key] = token[1:-1]
+                    elif key in ("id", "source", "target"):
+                        try:
+                            current[key] = int(token)
+                        except ValueError:
+                            raise UnexpectedGML("{} {}".format(key, token))
+                elif key in ("directed", "multigraph") and token != "0":
+                    raise UnexpectedGML("{} graph".format(key))
+                key = None
+
+    if stack or key is not None or not student_names:
+        raise UnexpectedGML("truncated file")
+    if len(set(student_names)) != len(student_names):
+        raise UnexpectedGML("repeated label")
+
+    num_students = len(student_names)
+    node_ids = np.array(node_ids, dtype=np.int64)
+    sources = np.array(sources, dtype=np.int64)
+    targets = np.array(targets, dtype=np.int64)
+    if np.array_equal(node_ids, np.arange(num_students)):
+        if len(sources) and (min(sources.min(), targets.min()) < 0 or max(sources.max(), targets.max()) >= num_students):
+            raise UnexpectedGML("edge to an undefined node")
+    else:
+        id_to_index = {node_id: i for i, node_id in enumerate(node_ids.tolist())}
+        if len(id_to_index) != num_students:
+            raise UnexpectedGML("repeated id")
+        try:
+            sources = np.array([id_to_index[node_id] for node_id in sources.tolist()], dtype=np.int64)
+            targets = np.array([id_to_index[node_id] for node_id in targets.tolist()], dtype=np.int64)
+        except KeyError:
+            raise UnexpectedGML("edge to an undefined node")
+
+    edges = np.stack([sources, targets], axis=1)
+    pairs = np.minimum(sources, targets) * num_students + np.maximum(sources, targets)
+    if len(np.unique(pairs)) != len(pairs):
+        raise UnexpectedGML("duplicated edge")
+    return student_names, edges
+
+
+def read_parameters(file_name):
+    '''
+        Reads parameters.txt
+
+        Outputs:
+            (num_buses, size_bus, constraints)
+            constraints - a list where each element is a list of the student names in a rowdy group
+    '''
+    with open(file_name) as parameters:
+        num_buses = int(parameters.readline())
+        size_bus = int(parameters.readline())
+        constraints = []
+
+        for line in parameters:
+            line = line[1: -2]
+            curr_constraint = [num.replace("'", "") for num in line.split(", ")]
+            constraints.append(curr_constraint)
+
+    return num_buses, size_bus, constraints
+
+
+def flatten_constraints(constraints, name_to_index):
+    '''
+        Turns rowdy groups of names into flat (CSR-style) arrays of student indices.
+        Names that are not students in the graph are dropped.
+
+        Outputs:
+            (group_indptr, group_members)
+    '''
+    group_indptr = np.zeros(len(constraints) + 1, dtype=np.int64)
+    members = []
+    for rg_index, constraint in enumerate(constraints):
+        members.extend(sorted({name_to_index[student] for student in constraint if student in name_to_index}))
+        group_indptr[rg_index + 1] = len(members)
+    return group_indptr, np.array(members, dtype=np.int64)
+
+
+def instance_from_graph(graph, num_buses, size_bus, constraints):
+    '''Builds an Instance from a NetworkX graph and the parsed parameters'''
+    student_names = list(graph.nodes())
+    name_to_index = {name: i for i, name in enumerate(student_names)}
+    edges = np.array([(name_to_index[u], name_to_index[v]) for u, v in graph.edges()], dtype=np.int64).reshape(-1, 2)
+    group_indptr, group_members = flatten_constraints(constraints, name_to_index)
+    return Instance(student_names, num_buses, size_bus, edges, group_indptr, group_members)
+
+
+def load_instance(folder_name):
+    '''
+        Parses an input folder into an Instance
+
+        Inputs:
+            folder_name - a string representing the path to the input folder
+
+        Outputs:
+            an Instance
+    '''
+    num_buses, size_bus, constraints = read_parameters(folder_name + "/parameters.txt")
+    try:
+        student_names, edges = read_gml(folder_name + "/graph.gml")
+    except UnexpectedGML:
+        import networkx as nx
+        graph = nx.read_gml(folder_name + "/graph.gml")
+        return instance_from_graph(graph, num_buses, size_bus, constraints)
+
+    name_to_index = {name: i for i, name in enumerate(student_names)}
+    group_indptr, group_members = flatten_constraints(constraints, name_to_index)
+    return Instance(student_names, num_buses, size_bus, edges, group_indptr, group_members)
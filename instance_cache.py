@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+import numpy as np
+from instance import Instance, load_instance
+
+####################################################
+# Binary cache of preprocessed inputs.
+#
+# The first load of an input folder parses it and
+# saves the Instance arrays as .npy files under
+# path_to_cache. Later loads memory-map them. An
+# entry is trusted while the size and mtime of
+# graph.gml and parameters.txt are unchanged, and
+# is re-validated against the content hash of both
+# files when they are not.
+####################################################
+
+###########################################
+# Change this variable if you want the
+# cache to live somewhere else
+###########################################
+path_to_cache = "./instance_cache"
+
+# bump when the saved layout changes so old entries get rebuilt
+cache_version = 1
+
+source_files = ["graph.gml", "parameters.txt"]
+
+
+def hash_input(folder_name):
+    '''Returns the SHA-1 hex digest of the contents of graph.gml and parameters.txt'''
+    digest = hashlib.sha1()
+    for file_name in source_files:
+        with open(folder_name + "/" + file_name, "rb") as source:
+            for chunk in iter(lambda: source.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_input(folder_name):
+    '''Returns the [size, mtime in ns] of graph.gml and parameters.txt'''
+    stats = []
+    for file_name in source_files:
+        file_stat = os.stat(folder_name + "/" + file_name)
+        stats.append([file_stat.st_size, file_stat.st_mtime_ns])
+    return stats
+
+
+def entry_path(folder_name, cache_root):
+    return cache_root + "/" + hashlib.sha1(os.path.abspath(folder_name).encode()).hexdigest()[:20]
+
+
+def write_atomically(file_name, write):
+    temp_name = "{}.{}.tmp".format(file_name, os.getpid())
+    with open(temp_name, "wb") as temp_file:
+        write(temp_file)
+    os.replace(temp_name, file_name)
+
+
+def write_meta(entry, meta):
+    write_atomically(entry + "/meta.json", lambda meta_file: meta_file.write(json.dumps(meta).encode()))
+
+
+def save_entry(entry, instance, content_hash, stats):
+    os.makedirs(entry, exist_ok=True)
+    for field in Instance.array_fields:
+        array = np.ascontiguousarray(getattr(instance, field))
+        write_atomically(entry + "/" + field + ".npy", lambda array_file: np.save(array_file, array))
+    # meta.json goes last, so an entry is never visible before all of its arrays are
+    write_meta(entry, {
+        "version": cache_version,
+        "content_hash": content_hash,
+        "stats": stats,
+        "num_buses": instance.num_buses,
+        "size_bus": instance.size_bus,
+        "student_names": instance.student_names,
+    })
+
+
+def read_entry(entry, meta):
+    arrays = {field: np.load(entry + "/" + field + ".npy", mmap_mode="r") for field in Instance.array_fields}
+    return Instance.from_arrays(meta["student_names"], meta["num_buses"], meta["size_bus"], arrays)
+
+
+def load_cached_instance(folder_name, cache_root=None):
+    '''
+        Loads an input folder through the cache, parsing and caching it on a miss
+
+        Inputs:
+            folder_name - a string representing the path to the input folder
+            cache_root - the cache folder, path_to_cache by default
+
+        Outputs:
+            an Instance whose arrays are read-only memory maps when it came from the cache
+    '''
+    if cache_root is None:
+        cache_root = path_to_cache
+    entry = entry_path(folder_name, cache_root)
+    stats = stat_input(folder_name)
+    content_hash = None
+
+    try:
+        with open(entry + "/meta.json") as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        meta = None
+
+    if meta is not None and meta.get("version") == cache_version:
+        try:
+            if meta["stats"] == stats:
+                return read_entry(entry, meta)
+            content_hash = hash_input(folder_name)
+            if meta["content_hash"] == content_hash:
+                # touched but not changed, remember the new mtimes so the next load skips hashing
+                instance = read_entry(entry, meta)
+                meta["stats"] = stats
+                write_meta(entry, meta)
+                return instance
+        except (OSError, ValueError):
+            pass
+
+    if content_hash is None:
+        content_hash = hash_input(folder_name)
+    instance = load_instance(folder_name)
+    try:
+        save_entry(entry, instance, content_hash, stats)
+    except OSError:
+        # a read-only or full disk only costs us the cache
+        pass
+    return instance
@@ -1,12 +1,51 @@
-import cvxpy
-import numpy as np
+import sys
+import argparse
+import importlib
 
-# construct a dictionary mapping each person to the rowdy groups they're in
+####################################################
+# To run:
+#   python3 main.py solve [input folders] [options]
+#   python3 main.py score <input_folder> <output_file>
+#   python3 main.py grade [options]
+#   python3 main.py bench [inputs] [options]
+#   python3 main.py serve [options]
+#
+# One entry point for solver.py, output_scorer.py,
+# autograder.py, benchmark.py and daemon.py, taking
+# the same options as each of them (see
+# python3 main.py <command> --help). Only the module
+# of the command given is imported, so scoring one
+# output doesn't load matplotlib and solving one
+# input doesn't load the benchmark or the plots.
+####################################################
 
-# iterate through every person
+# command -> (module, description)
+commands = {
+    "solve": ("solver", "solve every input, or just the given input folders"),
+    "score": ("output_scorer", "score one output file on its input"),
+    "grade": ("autograder", "score every output and plot the scores"),
+    "bench": ("benchmark", "time parsing, solving and scoring"),
+    "serve": ("daemon", "serve solve and score requests on localhost"),
+}
 
-# iterate through the buses and construct an array with the number of friends they have on the buses
-# ILP to pick the bus with the max heuristic (based on vectors)
-# heuristic is # of friendships created - factor * potential rowdy groups created (but make -large value if a rowdy group is created--recalculate friendships if a rowdy group has to be made)
 
-# simulated anealing to swap for best solution
+def main(argv=None):
+    '''
+        Runs the command named by the first argument with the rest of the arguments
+
+        Outputs:
+            the exit status returned by the command's run function
+    '''
+    parser = argparse.ArgumentParser(
+        prog="main.py", description="Solve, score, grade and benchmark bus assignments",
+        epilog="commands:\n" + "\n".join("  {:<7} {}".format(command, description) for command, (_, description) in commands.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=commands, metavar="command", help="one of " + ", ".join(commands))
+    parser.add_argument("arguments", nargs=argparse.REMAINDER, help="the options of the command, see main.py <command> --help")
+    args = parser.parse_args(argv)
+    module = importlib.import_module(commands[args.command][0])
+    return module.run(module.make_parser("main.py " + args.command).parse_args(args.arguments))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
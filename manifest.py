@@ -0,0 +1,102 @@
+import os
+import json
+import hashlib
+from instance_cache import hash_input, stat_input
+
+####################################################
+# Record of how each output was made.
+#
+# outputs/manifest.json maps "<size>/<input name>" to
+# the content hash (and size/mtime) of the input, the
+# hash of the solver config that solved it, its score
+# and how long it took. A batch run then only solves
+# the inputs that are new, changed, missing their
+# .out file or were solved with another config -- or,
+# with an improvement threshold, the ones scoring
+# below it.
+####################################################
+
+manifest_name = "manifest.json"
+
+# bump when a solver change should invalidate every recorded output
+solver_version = 1
+
+
+def manifest_path(outputs_path):
+    return outputs_path + "/" + manifest_name
+
+
+def load_manifest(outputs_path):
+    '''
+        Outputs:
+            the manifest of outputs_path as a dictionary, empty when there is none or it is unreadable
+    '''
+    try:
+        with open(manifest_path(outputs_path)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_manifest(outputs_path, manifest):
+    '''Writes the manifest next to its final path and renames it into place'''
+    path = manifest_path(outputs_path)
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def config_hash(config):
+    '''
+        Hashes the solver settings that decide what an output looks like
+
+        Inputs:
+            config - a dictionary of JSON values
+    '''
+    settings = dict(config, solver_version=solver_version)
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def input_fingerprint(folder_name, entry=None):
+    '''
+        The content hash and the [size, mtime] stats of an input folder. The hash recorded in entry
+        is reused while the stats are unchanged, so unchanged inputs are not read again.
+
+        Outputs:
+            (content_hash, stats)
+    '''
+    stats = stat_input(folder_name)
+    if entry is not None and entry.get("input_stats") == stats and "input_hash" in entry:
+        return entry["input_hash"], stats
+    return hash_input(folder_name), stats
+
+
+def needs_solving(entry, content_hash, solver_config_hash, output_file, improve_below=None):
+    '''
+        Whether an input has to be solved again
+
+        Inputs:
+            entry - the manifest entry of the input, or None
+            content_hash - the current content hash of the input
+            solver_config_hash - the config_hash of this run
+            output_file - the path of the input's .out file
+            improve_below - a score; when given, unchanged inputs are solved again only if their
+                recorded score is below it, whatever config they were solved with
+    '''
+    if entry is None or entry.get("input_hash") != content_hash or not os.path.isfile(output_file):
+        return True
+    if improve_below is not None:
+        return entry.get("score", -1) < improve_below
+    return entry.get("config_hash") != solver_config_hash
+
+
+def make_entry(content_hash, stats, solver_config_hash, score, seconds):
+    return {
+        "input_hash": content_hash,
+        "input_stats": stats,
+        "config_hash": solver_config_hash,
+        "score": score,
+        "seconds": round(seconds, 3),
+    }
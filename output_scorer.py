@@ -1,7 +1,8 @@
 import os
-import sys
-import networkx as nx
-import matplotlib.pyplot as plt
+import argparse
+import numpy as np
+from instance_cache import load_cached_instance
+from output_sidecar import read_sidecar
 
 ####################################################
 # To run:
@@ -26,78 +27,141 @@ def score_output(input_folder, output_file):
             (score, msg)
             score - a number between 0 and 1 which represents what fraction of friendships were broken
             msg - a string which stores error messages in case the output file is not valid for the given input
+
+        When the solver left a matching sidecar (see output_sidecar.py) its student->bus array is
+        scored without parsing the output file. Invalid arrays still go through the text checks,
+        so the error messages are the same either way.
+    '''
+    instance = load_cached_instance(input_folder)
+    student_to_bus = read_sidecar(output_file, instance)
+    if student_to_bus is not None and is_valid_bus_array(instance, student_to_bus):
+        score = score_bus_array(instance, student_to_bus)
+        return score, "Valid output submitted with score: {}".format(score)
+    return score_assignments(instance, read_assignments(output_file))
+
+def read_assignments(output_file):
+    '''
+        Reads an output file into a list where each element is the list of student names on one bus
     '''
-    graph = nx.read_gml(input_folder + "/graph.gml")
-    parameters = open(input_folder + "/parameters.txt")
-    num_buses = int(parameters.readline())
-    size_bus = int(parameters.readline())
-    constraints = []
-
-    for line in parameters:
-        line = line[1: -2]
-        curr_constraint = [node.replace("'","") for node in line.split(", ")]
-        constraints.append(curr_constraint)
-
-    output = open(output_file)
     assignments = []
-    for line in output:
-        line = line[1: -2]
-        curr_assignment = [node.replace("'","") for node in line.split(", ")]
-        assignments.append(curr_assignment)
+    with open(output_file) as output:
+        for line in output:
+            line = line[1: -2]
+            curr_assignment = [node.replace("'","") for node in line.split(", ")]
+            assignments.append(curr_assignment)
+    return assignments
+
+def score_assignments(instance, assignments):
+    '''
+        Validates bus assignments and scores them, with the same checks and messages as score_output
+
+        Inputs:
+            instance - the Instance the assignments are for
+            assignments - a list where each element is the list of student names on one bus
+
+        Outputs:
+            (score, msg) as returned by score_output
+    '''
+    num_buses = instance.num_buses
+    size_bus = instance.size_bus
 
     if len(assignments) != num_buses:
         return -1, "Must assign students to exactly {} buses, found {} buses".format(num_buses, len(assignments))
-    
+
     # make sure no bus is empty or above capacity
-    for i in range(len(assignments)):
-        if len(assignments[i]) > size_bus:
+    bus_loads = np.array([len(bus) for bus in assignments], dtype=np.int64)
+    invalid_buses = np.flatnonzero((bus_loads > size_bus) | (bus_loads <= 0))
+    if len(invalid_buses) > 0:
+        i = invalid_buses[0]
+        if bus_loads[i] > size_bus:
             return -1, "Bus {} is above capacity".format(i)
-        if len(assignments[i]) <= 0:
-            return -1, "Bus {} is empty".format(i)
-        
-    bus_assignments = {}
-    attendance_count = 0
-        
-    # make sure each student is in exactly one bus
-    attendance = {student:False for student in graph.nodes()}
-    for i in range(len(assignments)):
-        if not all([student in graph for student in assignments[i]]):
-            return -1, "Bus {} references a non-existant student: {}".format(i, assignments[i])
-
-        for student in assignments[i]:
-            # if a student appears more than once
-            if attendance[student] == True:
-                print(assignments[i])
-                return -1, "{0} appears more than once in the bus assignments".format(student)
-                
-            attendance[student] = True
-            bus_assignments[student] = i
-    
+        return -1, "Bus {} is empty".format(i)
+
+    # make sure each student is in exactly one bus; buses are checked in order and, within a bus,
+    # unknown students are reported before repeated ones
+    name_to_index = instance.name_to_index
+    students = np.array([name_to_index.get(student, -1) for bus in assignments for student in bus], dtype=np.int64)
+    bus_offsets = np.zeros(num_buses + 1, dtype=np.int64)
+    np.cumsum(bus_loads, out=bus_offsets[1:])
+    student_buses = np.repeat(np.arange(num_buses), bus_loads)
+
+    unknown = np.flatnonzero(students < 0)
+    first_unknown_bus = student_buses[unknown[0]] if len(unknown) > 0 else num_buses
+    order = np.argsort(students, kind="stable")
+    sorted_students = students[order]
+    repeats = order[1:][(sorted_students[1:] == sorted_students[:-1]) & (sorted_students[1:] >= 0)]
+    first_repeat = repeats.min() if len(repeats) > 0 else len(students)
+
+    if first_unknown_bus < num_buses and (first_repeat == len(students) or first_unknown_bus <= student_buses[first_repeat]):
+        return -1, "Bus {} references a non-existant student: {}".format(first_unknown_bus, assignments[first_unknown_bus])
+    if first_repeat < len(students):
+        i = student_buses[first_repeat]
+        print(assignments[i])
+        return -1, "{0} appears more than once in the bus assignments".format(assignments[i][first_repeat - bus_offsets[i]])
+
     # make sure each student is accounted for
-    if not all(attendance.values()):
+    if len(students) != instance.num_students:
         return -1, "Not all students have been assigned a bus"
-    
-    total_edges = graph.number_of_edges()
-    # Remove nodes for rowdy groups which were not broken up
-    for i in range(len(constraints)):
-        busses = set()
-        for student in constraints[i]:
-            busses.add(bus_assignments[student])
-        if len(busses) <= 1:
-            for student in constraints[i]:
-                if student in graph:
-                    graph.remove_node(student)
+
+    student_to_bus = np.empty(instance.num_students, dtype=np.int64)
+    student_to_bus[students] = student_buses
+    score = score_bus_array(instance, student_to_bus)
+
+    return score, "Valid output submitted with score: {}".format(score)
+
+def is_valid_bus_array(instance, student_to_bus):
+    '''
+        Whether an array mapping each student index to its bus is a valid assignment: every bus
+        holds between 1 and size_bus students
+    '''
+    if len(student_to_bus) != instance.num_students or len(student_to_bus) == 0:
+        return False
+    if student_to_bus.min() < 0 or student_to_bus.max() >= instance.num_buses:
+        return False
+    bus_loads = np.bincount(student_to_bus, minlength=instance.num_buses)
+    return bus_loads.min() >= 1 and bus_loads.max() <= instance.size_bus
+
+def score_bus_array(instance, student_to_bus):
+    '''
+        Scores a complete, valid assignment given as an array mapping each student index to its bus
+
+        Outputs:
+            the fraction of friendships kept, where a friendship is lost if its students are on different
+            buses or if either student is in a rowdy group that was not broken up
+    '''
+    student_to_bus = np.asarray(student_to_bus)
+    total_edges = len(instance.edges)
+
+    # a rowdy group is not broken up when the smallest and largest bus ids of its members agree
+    group_sizes = np.diff(instance.group_indptr)
+    nonempty = group_sizes > 0
+    member_buses = student_to_bus[instance.group_members]
+    group_starts = instance.group_indptr[:-1][nonempty]
+    intact = np.zeros(instance.num_groups, dtype=bool)
+    if len(group_starts) > 0:
+        intact[nonempty] = np.minimum.reduceat(member_buses, group_starts) == np.maximum.reduceat(member_buses, group_starts)
+
+    # remove the students of rowdy groups which were not broken up
+    removed = np.zeros(instance.num_students, dtype=bool)
+    removed[instance.group_members[np.repeat(intact, group_sizes)]] = True
 
     # score output
-    score = 0
-    for edge in graph.edges():
-        if bus_assignments[edge[0]] == bus_assignments[edge[1]]:
-            score += 1
-    score = score / total_edges
+    sources = instance.edges[:, 0]
+    targets = instance.edges[:, 1]
+    kept = (student_to_bus[sources] == student_to_bus[targets]) & ~removed[sources] & ~removed[targets]
+    score = int(np.count_nonzero(kept))
+    return score / total_edges
 
+def make_parser(prog=None):
+    '''The command line options of output_scorer.py, also used by `python3 main.py score`'''
+    parser = argparse.ArgumentParser(prog=prog, description="Score one output file on its input")
+    parser.add_argument("input_folder", help="the path to the input folder")
+    parser.add_argument("output_file", help="the path to the output file")
+    return parser
 
-    return score, "Valid output submitted with score: {}".format(score)
+def run(args):
+    score, msg = score_output(args.input_folder, args.output_file)
+    print(msg)
 
 if __name__ == '__main__':
-    score, msg = score_output(sys.argv[1], sys.argv[2])
-    print(msg)
\ No newline at end of file
+    run(make_parser().parse_args())
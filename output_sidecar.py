@@ -0,0 +1,88 @@
+import os
+import hashlib
+import numpy as np
+
+####################################################
+# Binary sidecar of an output file.
+#
+# Next to each <input>.out the solver writes
+# <input>.out.npy, an uncompressed int64 array
+# starting with the [size, mtime in ns] of the .out
+# file and a key of the student names in graph order,
+# followed by the student->bus array the text was
+# written from. The scorer uses the array instead of
+# parsing the text only while the .out file's stats
+# and the names still match, so the .out file stays
+# the canonical artifact: edit or replace it and the
+# sidecar is simply ignored.
+####################################################
+
+# the entries before the student->bus array
+header_length = 3
+
+
+def sidecar_path(output_file):
+    return output_file + ".npy"
+
+
+def names_key(student_names):
+    '''The first 60 bits of the SHA-1 of the student names in graph order, as an integer'''
+    return int(hashlib.sha1("\n".join(student_names).encode()).hexdigest()[:15], 16)
+
+
+def file_digest(file_name):
+    '''The SHA-1 hex digest of the contents of a file'''
+    digest = hashlib.sha1()
+    with open(file_name, "rb") as source:
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def output_header(output_file, instance):
+    output_stat = os.stat(output_file)
+    return [output_stat.st_size, output_stat.st_mtime_ns, names_key(instance.student_names)]
+
+
+def write_sidecar(output_file, instance, student_to_bus):
+    '''
+        Writes the sidecar of output_file, once output_file is in place
+
+        Inputs:
+            output_file - the path of the .out file the sidecar belongs to
+            instance - the Instance the output is for
+            student_to_bus - an integer array with the bus of each student, as written to output_file
+    '''
+    path = sidecar_path(output_file)
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    sidecar = np.empty(header_length + len(student_to_bus), dtype=np.int64)
+    sidecar[:header_length] = output_header(output_file, instance)
+    sidecar[header_length:] = student_to_bus
+    with open(temp_path, "wb") as sidecar_file:
+        np.save(sidecar_file, sidecar)
+    os.replace(temp_path, path)
+
+
+def read_sidecar(output_file, instance):
+    '''
+        Loads the student->bus array of output_file from its sidecar
+
+        Outputs:
+            the array, or None if there is no sidecar or it no longer matches output_file or instance
+    '''
+    try:
+        with open(sidecar_path(output_file), "rb") as sidecar_file:
+            data = sidecar_file.read()
+        # parsing the header is most of the time np.load takes on a small file, so the layout np.save
+        # writes (magic, version 1.0, header length, header) is read directly and anything else ignored
+        header_end = 10 + int.from_bytes(data[8:10], "little")
+        if data[:8] != b"\x93NUMPY\x01\x00" or b"'descr': '<i8', 'fortran_order': False," not in data[10:header_end]:
+            return None
+        sidecar = np.frombuffer(data, dtype=np.int64, offset=header_end)
+        if len(sidecar) != header_length + instance.num_students:
+            return None
+        if sidecar[:header_length].tolist() != output_header(output_file, instance):
+            return None
+    except (OSError, ValueError):
+        return None
+    return sidecar[header_length:]
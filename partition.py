@@ -0,0 +1,236 @@
+import numpy as np
+from evaluator import ScoreEvaluator
+
+####################################################
+# Graph partitioning pre-pass that seeds the bus
+# assignment with a global view of the friendship
+# graph:
+#
+#   1. label propagation over the CSR adjacency,
+#      never letting a label grow past size_bus or
+#      hold all of a rowdy group, finds tightly knit
+#      clusters of friends
+#   2. the largest clusters open one bus each and the
+#      rest join the bus they have the most friends
+#      on (again without completing a rowdy group),
+#      so exactly num_buses parts come out
+#   3. rowdy groups that still ended up whole on a
+#      bus are broken up by moving one member away
+#
+# The result is a valid assignment that the greedy
+# passes or the annealer refine further.
+####################################################
+
+# rounds of label propagation and of rowdy group repair
+propagation_rounds = 10
+repair_rounds = 3
+
+
+def completes_groups(group_counts, groups, sizes, targets):
+    '''
+        For each target (cluster or bus), whether adding a student of the given rowdy groups to it
+        would put all of one of those groups together. group_counts holds the members of each group
+        already in each target.
+    '''
+    if len(groups) == 0:
+        return np.zeros(len(targets), dtype=bool)
+    return (group_counts[np.ix_(groups, targets)] == (sizes[:, None] - 1)).any(axis=0)
+
+
+def completes_groups_by_label(group_label_counts, num_labels, groups, sizes, own, candidates):
+    '''
+        completes_groups for a student of cluster own during label propagation. A groups x clusters
+        matrix would be groups x students there, so group_label_counts instead holds a dictionary per
+        rowdy group from each cluster label to the members of the group in that cluster, and
+        num_labels the length of each. Joining another cluster completes a group exactly when the
+        student is alone in own and the other members all share that cluster's label.
+    '''
+    if (sizes == 1).any():
+        # the student alone already is all of the group
+        return np.ones(len(candidates), dtype=bool)
+    blocked = []
+    for group in groups[num_labels[groups] == 2].tolist():
+        label_counts = group_label_counts[group]
+        if label_counts[own] == 1:
+            blocked.extend(label for label in label_counts if label != own)
+    if not blocked:
+        return np.zeros(len(candidates), dtype=bool)
+    return np.isin(candidates, blocked)
+
+
+def propagate_labels(instance, rng, rounds=None):
+    '''
+        Size-constrained label propagation: every student starts in its own cluster and repeatedly
+        joins the cluster most of its friends are in, as long as that cluster still fits on a bus
+        and would not then hold all of a rowdy group
+
+        Outputs:
+            an integer array with the cluster label of each student
+    '''
+    if rounds is None:
+        rounds = propagation_rounds
+    num_students = instance.num_students
+    size_bus = instance.size_bus
+    neighbors = [np.asarray(instance.neighbors(i)) for i in range(num_students)]
+    student_groups = [np.asarray(instance.groups_of(i)) for i in range(num_students)]
+    group_sizes = np.diff(instance.group_indptr)
+    labels = np.arange(num_students)
+    cluster_sizes = np.ones(num_students, dtype=np.int64)
+    # members of each rowdy group per cluster label, while labels are still student indices
+    group_label_counts = [dict.fromkeys(instance.members_of(group).tolist(), 1) for group in range(instance.num_groups)]
+    num_labels = np.array([len(label_counts) for label_counts in group_label_counts], dtype=np.int64)
+
+    for _ in range(rounds):
+        changed = 0
+        for student in rng.permutation(num_students).tolist():
+            friends = neighbors[student]
+            if len(friends) == 0:
+                continue
+            own = int(labels[student])
+            candidates, counts = np.unique(labels[friends], return_counts=True)
+            allowed = (cluster_sizes[candidates] < size_bus) & ~completes_groups_by_label(
+                group_label_counts, num_labels, student_groups[student], group_sizes[student_groups[student]], own, candidates)
+            counts = np.where(allowed | (candidates == own), counts, -1)
+            best = np.argmax(counts)
+            own_count = counts[candidates == own]
+            if candidates[best] != own and counts[best] > (own_count[0] if len(own_count) > 0 else 0):
+                new = int(candidates[best])
+                cluster_sizes[own] -= 1
+                cluster_sizes[new] += 1
+                for group in student_groups[student].tolist():
+                    label_counts = group_label_counts[group]
+                    label_counts[own] -= 1
+                    if label_counts[own] == 0:
+                        del label_counts[own]
+                        num_labels[group] -= 1
+                    if new in label_counts:
+                        label_counts[new] += 1
+                    else:
+                        label_counts[new] = 1
+                        num_labels[group] += 1
+                labels[student] = new
+                changed += 1
+        if changed == 0:
+            break
+    return labels
+
+
+def pack_clusters(instance, labels):
+    '''
+        Packs clusters onto exactly num_buses non-empty buses of at most size_bus students,
+        avoiding buses where a cluster would complete a rowdy group
+
+        Outputs:
+            an integer array with the bus of each student
+    '''
+    num_students = instance.num_students
+    num_buses = instance.num_buses
+    size_bus = instance.size_bus
+    neighbors = [np.asarray(instance.neighbors(i)) for i in range(num_students)]
+    student_groups = [np.asarray(instance.groups_of(i)) for i in range(num_students)]
+    group_sizes = np.diff(instance.group_indptr)
+    all_buses = np.arange(num_buses)
+    student_to_bus = np.full(num_students, -1, dtype=np.int64)
+    bus_loads = np.zeros(num_buses, dtype=np.int64)
+    group_counts = np.zeros((instance.num_groups, num_buses), dtype=np.int32)
+
+    def place(students, bus):
+        student_to_bus[students] = bus
+        bus_loads[bus] += len(students)
+        np.add.at(group_counts, (np.concatenate([student_groups[s] for s in students] + [[]]).astype(np.int64), bus), 1)
+
+    cluster_labels, cluster_sizes = np.unique(labels, return_counts=True)
+    members_by_label = {label: np.flatnonzero(labels == label) for label in cluster_labels.tolist()}
+    # largest clusters first; the first num_buses of them each open a bus
+    for rank, label in enumerate(cluster_labels[np.argsort(-cluster_sizes, kind="stable")].tolist()):
+        members = members_by_label[label].tolist()
+        if rank < num_buses:
+            place(members, rank)
+            continue
+        friend_buses = student_to_bus[np.concatenate([neighbors[m] for m in members])]
+        connections = np.bincount(friend_buses[friend_buses >= 0], minlength=num_buses)
+        cluster_groups, cluster_group_counts = np.unique(np.concatenate([student_groups[m] for m in members] + [[]]).astype(np.int64),
+                                                         return_counts=True)
+        completes = (group_counts[cluster_groups] + cluster_group_counts[:, None] == group_sizes[cluster_groups, None]).any(axis=0)
+        fits = (bus_loads + len(members) <= size_bus) & ~completes
+        if fits.any():
+            place(members, int(np.argmax(np.where(fits, connections, -1))))
+            continue
+        # no bus takes it whole: split it up student by student
+        for member in members:
+            friend_buses = student_to_bus[neighbors[member]]
+            connections = np.bincount(friend_buses[friend_buses >= 0], minlength=num_buses)
+            room = bus_loads < size_bus
+            safe = room & ~completes_groups(group_counts, student_groups[member], group_sizes[student_groups[member]], all_buses)
+            place([member], int(np.argmax(np.where(safe if safe.any() else room, connections, -1))))
+
+    # fewer clusters than buses: fill the empty buses with the loneliest students of the fullest buses
+    for bus in np.flatnonzero(bus_loads == 0).tolist():
+        donor = int(np.argmax(bus_loads))
+        riders = np.flatnonzero(student_to_bus == donor)
+        friends_on_bus = [np.count_nonzero(student_to_bus[neighbors[rider]] == donor) for rider in riders.tolist()]
+        student = int(riders[int(np.argmin(friends_on_bus))])
+        bus_loads[donor] -= 1
+        group_counts[student_groups[student], donor] -= 1
+        place([student], bus)
+    return student_to_bus
+
+
+def break_up_groups(instance, student_to_bus, rounds=None):
+    '''
+        Moves one member of each rowdy group that sits whole on a bus to the bus with room where
+        it keeps the most friendships, whenever that keeps more friendships overall
+
+        Outputs:
+            the repaired student->bus array
+    '''
+    if rounds is None:
+        rounds = repair_rounds
+    evaluator = ScoreEvaluator(instance, student_to_bus)
+    size_bus = instance.size_bus
+    for _ in range(rounds):
+        intact = np.flatnonzero((evaluator.group_bus_counts == evaluator.group_sizes[:, None]).any(axis=1)
+                                & (evaluator.group_sizes > 0))
+        moved = 0
+        for group in intact.tolist():
+            members = evaluator.group_member_lists[group]
+            bus = evaluator.student_to_bus[members[0]]
+            if evaluator.group_bus_counts[group, bus] != len(members) or evaluator.bus_loads[bus] <= 1:
+                continue
+            best_delta, best_move = 0, None
+            for member in members.tolist():
+                room = evaluator.bus_loads < size_bus
+                room[bus] = False
+                if not room.any():
+                    break
+                if evaluator.alive_friend_counts is not None:
+                    target = int(np.argmax(np.where(room, evaluator.alive_friend_counts[member], -1)))
+                else:
+                    target = int(np.flatnonzero(room)[0])
+                delta = evaluator.move_delta(member, target)
+                if delta > best_delta:
+                    best_delta, best_move = delta, (member, target)
+            if best_move is not None:
+                evaluator.apply_move(*best_move)
+                evaluator.clear_history()
+                moved += 1
+        if moved == 0:
+            break
+    return evaluator.student_to_bus.copy()
+
+
+def partition_assignment(instance, seed=None):
+    '''
+        Seeds a bus assignment by partitioning the friendship graph
+
+        Inputs:
+            instance - the Instance to solve
+            seed - seeds the order students are visited in by label propagation
+
+        Outputs:
+            an integer array with the bus of each student
+    '''
+    rng = np.random.default_rng(seed)
+    labels = propagate_labels(instance, rng)
+    student_to_bus = pack_clusters(instance, labels)
+    return break_up_groups(instance, student_to_bus)
@@ -0,0 +1,271 @@
+import time
+import itertools
+import numpy as np
+from evaluator import ScoreEvaluator
+
+####################################################
+# Fiduccia-Mattheyses style refinement of a bus
+# assignment.
+#
+# Every student is filed in a gain bucket under the
+# exact change in kept friendships of its best action:
+# a move to the bus with room it has the most friends
+# on, or, when that bus is full, a swap with the rider
+# of that bus who would gain most from the trade.
+# Gains come from ScoreEvaluator, so rowdy groups that
+# a move completes or breaks up are part of the gain.
+#
+# A pass repeatedly takes the best action, locks the
+# students it moved and refiles the students whose
+# best action it may have changed: their friends, the
+# members of rowdy groups it completed or broke up,
+# and the students filed against a bus that filled up
+# or got room.
+# Up to max_uphill_moves actions in a row that do not
+# beat the best assignment of the pass are allowed,
+# after which the pass is rolled back to that best
+# one. The buckets are kept from pass to pass, so
+# after the first pass only the students a pass
+# touched are refiled. Passes repeat until one finds
+# no improvement.
+####################################################
+
+
+class GainBuckets:
+    '''
+        Students filed under integer gains, with constant-time insert and remove and a pointer
+        to the highest non-empty bucket
+    '''
+
+    def __init__(self):
+        self.buckets = {}
+        self.gain_of = {}
+        self.max_gain = None
+
+    def __len__(self):
+        return len(self.gain_of)
+
+    def insert(self, student, gain):
+        if student in self.gain_of:
+            self.remove(student)
+        self.gain_of[student] = gain
+        self.buckets.setdefault(gain, set()).add(student)
+        if self.max_gain is None or gain > self.max_gain:
+            self.max_gain = gain
+
+    def remove(self, student):
+        gain = self.gain_of.pop(student, None)
+        if gain is not None:
+            self.buckets[gain].discard(student)
+
+    def top(self, count):
+        '''Up to count students with the highest gains, highest first, without removing them'''
+        students = []
+        for gain in sorted(self.buckets, reverse=True):
+            students.extend(itertools.islice(self.buckets[gain], count - len(students)))
+            if len(students) >= count:
+                break
+        return students
+
+    def pop_max(self):
+        '''Removes and returns (student, gain) for a student with the highest gain'''
+        while not self.buckets.get(self.max_gain):
+            self.buckets.pop(self.max_gain, None)
+            self.max_gain -= 1
+        student = self.buckets[self.max_gain].pop()
+        del self.gain_of[student]
+        return student, self.max_gain
+
+
+class FMRefiner:
+    '''
+        Deterministic local refinement of a valid assignment, see the top of this file
+
+        Attributes:
+            evaluator - the ScoreEvaluator holding the assignment being refined
+            buckets - the GainBuckets every unlocked student with an action is filed in
+            target_of - an integer array with the bus of the action each student is filed under, -1 if none
+            passes - the number of passes run by refine
+    '''
+
+    # actions in a row without a new best before a pass gives up
+    max_uphill_moves = 50
+    max_passes = 20
+
+    def __init__(self, instance, student_to_bus):
+        self.instance = instance
+        self.num_buses = instance.num_buses
+        self.size_bus = instance.size_bus
+        self.evaluator = ScoreEvaluator(instance, student_to_bus)
+        self.buckets = GainBuckets()
+        self.target_of = np.full(instance.num_students, -1, dtype=np.int64)
+        # the students filed under an action on each bus
+        self.targeting = [set() for _ in range(instance.num_buses)]
+        self.locked = np.zeros(instance.num_students, dtype=bool)
+        self.passes = 0
+
+    def friend_counts(self, student):
+        '''The number of friends of student on each bus whose friendships count'''
+        evaluator = self.evaluator
+        if evaluator.alive_friend_counts is not None:
+            return evaluator.alive_friend_counts[student]
+        friends = evaluator.student_neighbors[student]
+        counted = evaluator.intact_groups_of_student[friends] == 0
+        return np.bincount(evaluator.student_to_bus[friends][counted], minlength=self.num_buses)
+
+    def best_action(self, student, locked):
+        '''
+            Finds the best action of student as described at the top of this file
+
+            Outputs:
+                (gain, action) where action is ("move", bus) or ("swap", other student), or (None, None)
+        '''
+        evaluator = self.evaluator
+        bus = evaluator.student_to_bus[student]
+        counts = self.friend_counts(student)
+        scores = counts.astype(np.int64) - counts[bus]
+        scores[bus] = np.iinfo(np.int64).min
+        target = int(np.argmax(scores))
+        if target == bus:
+            return None, None
+
+        if evaluator.bus_loads[target] < self.size_bus and evaluator.bus_loads[bus] > 1:
+            return evaluator.move_delta(student, target), ("move", target)
+
+        if evaluator.alive_friend_counts is None:
+            return None, None
+        riders = evaluator.riders_of(target)
+        riders = riders[~locked[riders]]
+        if len(riders) == 0:
+            return None, None
+        rider_scores = evaluator.alive_friend_counts[riders, bus] - evaluator.alive_friend_counts[riders, target]
+        other = int(riders[int(np.argmax(rider_scores))])
+        return evaluator.swap_delta(student, other), ("swap", other)
+
+    def file(self, student, gain, action):
+        '''Files student under gain, or takes it out of the buckets when action is None'''
+        target = self.target_of[student]
+        if target >= 0:
+            self.targeting[target].discard(student)
+            self.target_of[student] = -1
+        if action is None:
+            self.buckets.remove(student)
+            return
+        self.buckets.insert(student, gain)
+        kind, target = action
+        target = target if kind == "move" else int(self.evaluator.student_to_bus[target])
+        self.target_of[student] = target
+        self.targeting[target].add(student)
+
+    def refile(self, students):
+        '''Refiles each student of students under the gain of its current best action, if it is unlocked'''
+        for student in students:
+            if self.locked[student]:
+                self.file(student, None, None)
+            else:
+                self.file(student, *self.best_action(student, self.locked))
+
+    def refine(self, deadline=None):
+        '''
+            Runs passes until one finds no improvement (or max_passes passes)
+
+            Inputs:
+                deadline - a time.time() value after which the current pass is cut short and no new one starts
+
+            Outputs:
+                the refined student->bus array
+        '''
+        self.refile(range(self.instance.num_students))
+        for _ in range(self.max_passes):
+            if deadline is not None and time.time() >= deadline:
+                break
+            self.passes += 1
+            if not self.refine_pass(deadline):
+                break
+        return self.evaluator.student_to_bus.copy()
+
+    def affected_by(self, moved, buses, changed, loads_before):
+        '''The students whose best action may have changed when the students in moved left or joined buses'''
+        evaluator = self.evaluator
+        affected = set()
+        for student in moved:
+            affected.update(evaluator.student_neighbors[student].tolist())
+        for group in changed.tolist():
+            affected.update(evaluator.group_member_lists[group].tolist())
+        for bus, load_before in zip(buses, loads_before):
+            load = evaluator.bus_loads[bus]
+            if (load_before < self.size_bus) != (load < self.size_bus):
+                # whether a student may move onto the bus changed; other gains on it are checked when popped
+                affected.update(self.targeting[bus])
+            if min(load_before, load) <= 1:
+                # whether a rider may leave the bus changed
+                affected.update(evaluator.riders_of(bus).tolist())
+        return affected
+
+    def refine_pass(self, deadline=None):
+        '''Runs one pass and returns whether it kept more friendships than before it'''
+        evaluator = self.evaluator
+        buckets = self.buckets
+        locked = self.locked
+        evaluator.clear_history()
+        start_kept = best_kept = evaluator.kept
+        best_history = 0
+        uphill = 0
+        touched = set()
+        while len(buckets) > 0 and uphill < self.max_uphill_moves:
+            if deadline is not None and time.time() >= deadline:
+                break
+            student, filed_gain = buckets.pop_max()
+            gain, action = self.best_action(student, locked)
+            if action is None or gain != filed_gain:
+                # filed before an earlier action changed it
+                self.file(student, gain, action)
+                continue
+
+            kind, target = action
+            if kind == "move":
+                changed = evaluator.changed_groups(student, target)
+                buses = [int(evaluator.student_to_bus[student]), target]
+                moved = [student]
+            else:
+                changed = np.concatenate([evaluator.changed_groups(student, evaluator.student_to_bus[target]),
+                                          evaluator.changed_groups(target, evaluator.student_to_bus[student])])
+                buses = [int(evaluator.student_to_bus[student]), int(evaluator.student_to_bus[target])]
+                moved = [student, target]
+            loads_before = evaluator.bus_loads[buses].tolist()
+            if kind == "move":
+                evaluator.apply_move(student, target)
+            else:
+                evaluator.apply_swap(student, target)
+            locked[moved] = True
+            self.refile(moved)
+
+            if evaluator.kept > best_kept:
+                best_kept = evaluator.kept
+                best_history = len(evaluator.history)
+                uphill = 0
+            else:
+                uphill += 1
+
+            affected = self.affected_by(moved, buses, changed, loads_before)
+            touched.update(affected)
+            touched.update(moved)
+            self.refile(affected)
+
+        evaluator.undo(len(evaluator.history) - best_history)
+        evaluator.clear_history()
+        # the students the pass moved are unlocked again, and undoing its last actions changed the
+        # best actions of the same students their doing did
+        locked[:] = False
+        self.refile(sorted(touched))
+        return best_kept > start_kept
+
+
+def refine_assignment(instance, student_to_bus, deadline=None):
+    '''
+        Refines a valid assignment with FMRefiner, stopping at deadline (a time.time() value)
+
+        Outputs:
+            a student->bus array keeping at least as many friendships as student_to_bus
+    '''
+    return FMRefiner(instance, student_to_bus).refine(deadline)
@@ -1,13 +1,17 @@
 from __future__ import print_function
 
 import os
+import math
+import time
 import random
+import multiprocessing
 
-import networkx as nx
 # import cvxpy
 import numpy as np
-from simanneal import Annealer
-from functools import reduce
+from instance_cache import load_cached_instance
+from evaluator import ScoreEvaluator
+from solver import greedy_assignment, assignment_to_buses, dict_to_string
+from partition import partition_assignment
 
 ###########################################
 # Change this variable to the path to
@@ -26,328 +30,334 @@ path_to_outputs = "./outputs"
 
 def parse_input(folder_name):
     '''
-        Parses an input and returns the corresponding graph and parameters
+        Parses an input and returns the corresponding graph and parameters.
+        Inputs that were parsed before are memory-mapped from the cache in instance_cache.py.
 
         Inputs:
             folder_name - a string representing the path to the input folder
 
         Outputs:
-            (graph, num_buses, size_bus, constraints)
-            graph - the graph as a NetworkX object
-            num_buses - an integer representing the number of buses you can allocate to
-            size_buses - an integer representing the number of students that can fit on a bus
-            constraints - a list where each element is a list vertices which represents a single rowdy group
+            an Instance (see instance.py) holding the friendship graph as CSR adjacency arrays,
+            the number of buses, the bus size and the rowdy groups as flat arrays of student indices
     '''
-    graph = nx.read_gml(folder_name + "/graph.gml")
-    parameters = open(folder_name + "/parameters.txt")
-    num_buses = int(parameters.readline())
-    size_bus = int(parameters.readline())
-    constraints = []
-
-    for line in parameters:
-        line = line[1: -2]
-        curr_constraint = [num.replace("'", "") for num in line.split(", ")]
-        constraints.append(curr_constraint)
-
-    return graph, num_buses, size_bus, constraints
-
-
-class SimulatedAnnealer(Annealer):
-
-    # pass extra data (the distance matrix) into the constructor
-    def __init__(self, bus_assignments, friendships_in_bus_for_student, fraction_of_rowdy_group_in_bus,
-                 rowdy_group_student_membership_matrix, name_to_index, student_names,
-                 number_of_friendships_in_bus_for_rowdy_group, scaled_rowdy_group_student_membership_matrix,
-                 constraints, size_bus, graph):
-        self.friendships_in_bus_for_student = friendships_in_bus_for_student
-        self.fraction_of_rowdy_group_in_bus = fraction_of_rowdy_group_in_bus
-        self.rowdy_group_student_membership_matrix = rowdy_group_student_membership_matrix
-        self.name_to_index = name_to_index
-        self.student_names = student_names
-        self.number_of_friendships_in_bus_for_rowdy_group = number_of_friendships_in_bus_for_rowdy_group
-        self.bus_assignments = bus_assignments
-        self.student_assignments = {}
-        for bus in self.bus_assignments:
-            for student_name in self.bus_assignments[bus]:
-                self.student_assignments[self.name_to_index[student_name]] = bus
-        self.scaled_rowdy_group_student_membership_matrix = scaled_rowdy_group_student_membership_matrix
-        self.constraints = constraints
-        self.size_bus = size_bus
-        self.graph = graph
-        super(SimulatedAnnealer, self).__init__(bus_assignments)  # important!
-        self.buses_filled_minimally = list(filter(lambda key: len(bus_assignments[key]) == 1, self.bus_assignments.keys()))
-        self.buses_filled_maximally = list(filter(lambda key: len(bus_assignments[key]) == size_bus , self.bus_assignments.keys()))
-        self.buses_not_filled_minimally = list(filter(lambda key: len(bus_assignments[key]) > 1, self.bus_assignments.keys()))
-        self.buses_not_filled_maximally = list(filter(lambda key: len(bus_assignments[key]) < size_bus , self.bus_assignments.keys()))
-
-        self.max_energy = np.sum([len(self.friendships_in_bus_for_student[self.name_to_index[student_name]])
-                                  for student_name in self.student_names])
-        self.Tmax = 3 * self.energy()
-
-        self.actions = [self.transfer, self.swap, self.permutation]
-        self.action_probabilities = [0.5, 0.3, 0.2]
-        self.cummulative_action_probabilities = np.cumsum(self.action_probabilities)
-
-    def move(self):
-        action = np.random.choice(self.actions, 1, p=[0.5, 0.3, 0.2])
-        action[0]()
-
-    def transfer(self):
-        student_name = ''
-        bus_sent_from = -1
-        num_attempts = 10 # infinite loop catch in case all buses are minimally filled
-        while student_name == '' and num_attempts > 0:
-            student_name = self.student_names[np.random.randint(len(self.student_names))]
-            bus_sent_from = self.student_assignments[self.name_to_index[student_name]]
-            if bus_sent_from in self.buses_filled_minimally:
-                student_name = ''
-            num_attempts -= 1
-
-        if student_name == '':
-            return None
-
-        if num_attempts >= 0:
-            feasible_buses_to_accept_transfer = self.buses_not_filled_maximally
-            if bus_sent_from in feasible_buses_to_accept_transfer:
-                feasible_buses_to_accept_transfer = list(filter(lambda e: bus_sent_from != e, feasible_buses_to_accept_transfer))
-            if len(feasible_buses_to_accept_transfer) > 0:
-                bus_received_in = feasible_buses_to_accept_transfer[np.random.randint(low=0, high=len(feasible_buses_to_accept_transfer))]
-
-                try:
-                    self.move_student_and_update_memo(student_name, self.bus_assignments.index(bus_sent_from), self.bus_assignments.index(bus_received_in))
-
-                    if len(self.state[bus_sent_from]) == 1:
-                        self.buses_not_filled_minimally.remove(bus_sent_from)
-                        self.buses_filled_minimally.append(bus_sent_from)
-                    elif bus_sent_from not in self.buses_not_filled_minimally and bus_sent_from in self.buses_filled_minimally:
-                        self.buses_not_filled_minimally.append(bus_sent_from)
-                        self.buses_filled_minimally.remove(bus_sent_from)
-
-                    if len(self.state[bus_received_in]) == self.size_bus:
-                        self.buses_not_filled_maximally.remove(bus_received_in)
-                        self.buses_filled_maximally.append(bus_received_in)
-                    elif bus_received_in not in self.buses_not_filled_maximally and bus_received_in in self.buses_filled_maximally:
-                        self.buses_not_filled_maximally.append(bus_received_in)
-                        self.buses_filled_maximally.remove(bus_received_in)
-                except:
-                    pass
-
-    def swap(self):
-        student_names = ['', '']
-        buses = [-1, -1]
-        num_attempts = 10 # infinite loop catch in case all buses are minimally filled
-        while (student_names[0] == '' or student_names[1] == '') and num_attempts > 0:
-            student_names[0] = np.random.choice(self.student_names)
-            student_names[1] = np.random.choice(self.student_names)
-            buses = list(map(lambda student_name: self.student_assignments[self.name_to_index[student_name]], student_names))
-            if student_names[0] == student_names[1] or buses[0] == buses[1]:
-                student_names = ['', '']
-            num_attempts -= 1
-
-        if student_names[0] == '' or student_names[1] == '':
-            return None
+    return load_cached_instance(folder_name)
 
-        try:
-            if num_attempts >= 0:
-                for i in range(2):
-                    bus_sent_from = buses[i]
-                    bus_received_in = buses[1 - i]
-                    self.move_student_and_update_memo(student_names[i], i, 1-i)
-        except:
-            pass
-
-    def permutation(self):
-        num_students_in_cyle = int(np.random.exponential(scale=2)) + 3
-        student_names = map(lambda index: self.student_names[index], np.random.choice(len(self.student_names), num_students_in_cyle))
-        buses = list(map(lambda student_name: self.student_assignments[self.name_to_index[student_name]], student_names))
-        permutation = np.random.permutation(num_students_in_cyle)
-
-        for i in range(num_students_in_cyle):
-            bus_sent_from = buses[i]
-            bus_received_in = buses[permutation[i]]
-            try:
-                self.move_student_and_update_memo(student_names[i], i, permutation[i])
-            except:
-                pass
 
-    def move_student_and_update_memo(self, student_name, bus_sent_from, bus_received_in):
-        student_index = self.name_to_index[student_name]
-        # move student
-        try:
-            self.state[self.bus_assignments[bus_sent_from]].remove(student_name)
-            self.state[self.bus_assignments[bus_received_in]].append(student_name)
-            self.student_assignments[student_index] = bus_received_in
-            # update memo
-            rowdy_groups_student_is_in = self.rowdy_group_student_membership_matrix[:, student_index]
-
-            # update bus student is sent from
-            self.fraction_of_rowdy_group_in_bus[bus_sent_from,:] -= np.multiply(self.scaled_rowdy_group_student_membership_matrix[:, student_index], rowdy_groups_student_is_in)
-            friendships_in_bus_sent_from_for_student = self.friendships_in_bus_for_student[student_index][bus_sent_from]
-            for friend_name in self.graph.adj[student_name]:
-                friend_index = self.name_to_index[friend_name]
-                self.friendships_in_bus_for_student[friend_index][bus_sent_from].remove(student_index)
-            delta_number_of_friendships_in_bus_sent_from_for_rowdy_group = np.zeros(self.rowdy_group_student_membership_matrix.shape[0])
-            rowdy_groups_of_friends_in_bus_sent_from = list(map(lambda friend_index: np.where(self.rowdy_group_student_membership_matrix[:,friend_index] == 1), friendships_in_bus_sent_from_for_student))
-            for i in range(len(rowdy_groups_of_friends_in_bus_sent_from)):
-                rowdy_group_indices = rowdy_groups_of_friends_in_bus_sent_from[i]
-                for rowdy_group_index in rowdy_group_indices:
-                    delta_number_of_friendships_in_bus_sent_from_for_rowdy_group[rowdy_group_index] += 1
-            self.number_of_friendships_in_bus_for_rowdy_group[bus_sent_from,:] -= delta_number_of_friendships_in_bus_sent_from_for_rowdy_group
-
-            # update bus student is received in
-            self.fraction_of_rowdy_group_in_bus[bus_received_in,:] += np.multiply(self.scaled_rowdy_group_student_membership_matrix[:, student_index], rowdy_groups_student_is_in)
-            friendships_in_bus_received_in_for_student = self.friendships_in_bus_for_student[student_index][bus_received_in]
-            for friend_name in self.graph.adj[student_name]:
-                friend_index = self.name_to_index[friend_name]
-                self.friendships_in_bus_for_student[friend_index][bus_received_in].append(student_index)
-            delta_number_of_friendships_in_bus_received_in_for_rowdy_group = np.zeros(self.rowdy_group_student_membership_matrix.shape[0])
-            rowdy_groups_of_friends_in_bus_received_in = list(map(lambda friend_index: np.where(self.rowdy_group_student_membership_matrix[:,friend_index] == 1), friendships_in_bus_received_in_for_student))
-            for i in range(len(rowdy_groups_of_friends_in_bus_received_in)):
-                rowdy_group_indices = rowdy_groups_of_friends_in_bus_received_in[i]
-                for rowdy_group_index in rowdy_group_indices:
-                    delta_number_of_friendships_in_bus_received_in_for_rowdy_group[rowdy_group_index] += 1
-            self.number_of_friendships_in_bus_for_rowdy_group[bus_received_in,:] += delta_number_of_friendships_in_bus_received_in_for_rowdy_group
-        except:
-            1 / 0
+class SimulatedAnnealer:
+    '''
+        Simulated annealing over bus assignments, minimising the number of friendships lost
+
+        The state is the student->bus array of a ScoreEvaluator, so a step costs one exact
+        incremental delta and rejected moves never touch the state. Buses with room for
+        another student are kept in a constant-time set, and the best state is snapshotted
+        with a single array copy.
+
+        Set tracer to an anytime_trace.Tracer to have anneal record its progress every
+        clock_interval steps.
+    '''
+
+    Tmax = 3.0
+    Tmin = 0.05
+    steps = 200000
+    # probability that a step tries a transfer rather than a swap
+    transfer_probability = 0.5
+    # steps between clock reads when annealing against a deadline
+    clock_interval = 256
+
+    def __init__(self, instance, student_to_bus, seed=None):
+        self.instance = instance
+        self.size_bus = instance.size_bus
+        self.num_students = instance.num_students
+        self.num_buses = instance.num_buses
+        self.evaluator = ScoreEvaluator(instance, student_to_bus)
+        self.random = random.Random(seed)
+        self.tracer = None
+        self.accepted = 0
+        self.rejected = 0
+
+        # buses with room for one more student
+        self.receivers = BusSet(self.num_buses)
+        for bus in range(self.num_buses):
+            self.update_bus(bus)
+
+        self.best_state = self.state.copy()
+        self.best_energy = self.energy()
+
+    @property
+    def state(self):
+        return self.evaluator.student_to_bus
 
     def energy(self):
-        """Calculates the length of the route."""
-        # nullify all friendships of students for which
-        # at least one of the students belongs to a rowdy group
-        # which is fully present in the students' bus
-        number_friendships_per_student = np.zeros(len(self.student_names))
-        removed_rowdy_groups = np.where(self.fraction_of_rowdy_group_in_bus == 1)[1].tolist()
-        removed_students = []
-        for rowdy_group_index in removed_rowdy_groups:
-            removed_students += self.constraints[rowdy_group_index]
-        for student_name in self.student_names:
-            if student_name not in removed_students:
-                student_index = self.name_to_index[student_name]
-                number_friendships_per_student[student_index] = len(self.friendships_in_bus_for_student[student_index])
-        # sum up all remaining friendships
-        return self.max_energy - np.sum(number_friendships_per_student)
-
-def dict_to_string(dict):
-    result = ""
-    for key in dict:
-        if len(dict[key]) != 0:
-            result = result + str(dict[key]) + "\n"
+        """Calculates the number of friendships lost by the current state."""
+        return self.evaluator.energy()
+
+    def update_bus(self, bus):
+        self.receivers.set(bus, self.evaluator.bus_loads[bus] < self.size_bus)
+
+    def accept(self, energy_change, temperature):
+        return energy_change <= 0 or self.random.random() < math.exp(-energy_change / temperature)
+
+    def transfer(self, temperature):
+        '''Tries to move a random student onto a random bus with room, without emptying its own bus'''
+        if len(self.receivers) == 0:
+            return False
+        student = self.random.randrange(self.num_students)
+        bus_sent_from = self.state[student]
+        bus_received_in = self.receivers.sample(self.random)
+        if bus_sent_from == bus_received_in or self.evaluator.bus_loads[bus_sent_from] <= 1:
+            return False
+        energy_change = -self.evaluator.move_delta(student, bus_received_in)
+        if not self.accept(energy_change, temperature):
+            return False
+        self.evaluator.apply_move(student, bus_received_in)
+        self.evaluator.clear_history()
+        self.update_bus(bus_sent_from)
+        self.update_bus(bus_received_in)
+        return True
+
+    def swap(self, temperature):
+        '''Tries to swap two random students on different buses'''
+        student = self.random.randrange(self.num_students)
+        other = self.random.randrange(self.num_students)
+        if self.state[student] == self.state[other]:
+            return False
+        energy_change = -self.evaluator.swap_delta(student, other)
+        if not self.accept(energy_change, temperature):
+            return False
+        self.evaluator.apply_swap(student, other)
+        self.evaluator.clear_history()
+        return True
+
+    def step(self, temperature):
+        '''Tries one transfer or swap at temperature, remembering the state if it is the best so far'''
+        if self.random.random() < self.transfer_probability:
+            moved = self.transfer(temperature)
         else:
-            result = result + "[]" + "\n"
-    return result
-
-
-def solve(graph, num_buses, size_bus, constraints):
-    # TODO: Write this method as you like. We'd recommend changing the arguments here as well
-    # graph, num_buses, size_bus, constraints = parse_input(path_to_outputs)
-
-    # construct a dictionary mapping each person to the rowdy groups they're in
-
-    student_names = list(graph.nodes())
-    name_to_index = dict()
-
-    for i, student in enumerate(student_names):
-        name_to_index[student] = i
-
-    num_rowdy_groups = len(constraints)
-    bus_assignments = {}
-    for i in range(num_buses):
-        bus_assignments[i] = []
-    # M
-    rowdy_group_student_membership_matrix = np.zeros((len(constraints), len(student_names)))
-    for rowdy_group_index in range(len(constraints)):
-        for student_name in student_names:
-            if student_name in constraints[rowdy_group_index]:
-                rowdy_group_student_membership_matrix[rowdy_group_index, name_to_index[student_name]] = 1
-
-    sums = np.sum(rowdy_group_student_membership_matrix, axis=1)
-
-    scaled_rowdy_group_student_membership_matrix = rowdy_group_student_membership_matrix / sums[:, None]
-    # C
-    fraction_of_rowdy_group_in_bus = np.zeros(shape=(num_buses, num_rowdy_groups), dtype=float)
-    # L
-    number_of_friendships_in_bus_for_rowdy_group = np.zeros(shape=(num_buses, num_rowdy_groups), dtype=float)
-    # sort students by number of rowdy groups they're in
-    # iterate through every person
-    student_ordering = np.argsort(-np.sum(rowdy_group_student_membership_matrix, axis=0))
-    for i, student_index in enumerate(student_ordering[:num_buses]):
-        update_data(student_index, i, student_names, rowdy_group_student_membership_matrix,
-                    np.zeros(shape=(num_buses, num_rowdy_groups)), fraction_of_rowdy_group_in_bus,
-                    number_of_friendships_in_bus_for_rowdy_group,
-                    bus_assignments, scaled_rowdy_group_student_membership_matrix)
-
-    for student_index in student_ordering[num_buses:]:
-        additional_friendships = np.zeros(shape=(num_buses, 1), dtype=float)
-        friend_count_in_rgs = np.zeros(shape=(num_buses, num_rowdy_groups))
-
-        for bus in range(num_buses):
-            count = 0
-            for friend in graph.adj[student_names[student_index]]:
-                if name_to_index[friend] in bus_assignments[bus]:
-                    friend_rg = rowdy_group_student_membership_matrix[:, name_to_index[friend]]
-                    student_rg = rowdy_group_student_membership_matrix[:, student_index]
-                    common_rgs = np.where(friend_rg + student_rg == 2)
-                    for common_rg in common_rgs:
-                        friend_count_in_rgs[bus, common_rg] += 1
-                    count += 1
-            additional_friendships[bus] = count
-
-        number_of_friendships_in_bus_for_rowdy_group_temp = number_of_friendships_in_bus_for_rowdy_group + additional_friendships @ rowdy_group_student_membership_matrix[:,student_index].reshape(1, num_rowdy_groups)
-        fraction_of_rowdy_group_in_bus_temp = fraction_of_rowdy_group_in_bus + np.ones(shape=additional_friendships.shape) @ scaled_rowdy_group_student_membership_matrix[:, student_index].reshape(1,num_rowdy_groups)
-        floored_fraction_of_rowdy_group_in_bus_temp = np.floor(fraction_of_rowdy_group_in_bus_temp)
-
-        reward_vector = additional_friendships.reshape(additional_friendships.size)
-        cost_matrix = np.multiply(floored_fraction_of_rowdy_group_in_bus_temp,
-                                  number_of_friendships_in_bus_for_rowdy_group_temp) + fraction_of_rowdy_group_in_bus_temp / num_rowdy_groups
-        rowdy_groups_student_is_in = rowdy_group_student_membership_matrix[:, student_index]
-        cost_vector = cost_matrix @ rowdy_groups_student_is_in
-        heuristics = reward_vector - cost_vector
-        sorted_heuristic_indices = np.argsort(-heuristics)
-
-        for index in sorted_heuristic_indices:
-            load = len(bus_assignments[index])
-            if load < size_bus:
-                update_data(student_index, index, student_names, rowdy_group_student_membership_matrix, friend_count_in_rgs,
-                            fraction_of_rowdy_group_in_bus, number_of_friendships_in_bus_for_rowdy_group,
-                            bus_assignments, scaled_rowdy_group_student_membership_matrix)
+            moved = self.swap(temperature)
+        if not moved:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        energy = self.energy()
+        if energy < self.best_energy:
+            self.best_energy = energy
+            self.best_state = self.state.copy()
+        return True
+
+    def sample(self, temperature, steps, deadline=None):
+        '''Runs steps steps at a fixed temperature, stopping early at deadline, and returns the energy reached'''
+        for step in range(steps):
+            if deadline is not None and step % self.clock_interval == 0 and time.time() >= deadline:
                 break
+            self.step(temperature)
+        return self.energy()
+
+    def anneal(self, deadline=None):
+        '''
+            Runs self.steps steps, cooling exponentially from Tmax to Tmin
+
+            Inputs:
+                deadline - a time.time() value; when given, steps are run until the deadline instead
+                    and the temperature follows the fraction of the time used
+
+            Outputs:
+                (best_state, best_energy) - the best student->bus array seen and its energy
+        '''
+        temperature = self.Tmax
+        cooling = math.exp(math.log(self.Tmin / self.Tmax) / max(self.steps, 1))
+        start_time = time.time()
+        step = 0
+        while step < self.steps or deadline is not None:
+            if step % self.clock_interval == 0:
+                if self.tracer is not None:
+                    self.trace(step)
+                if deadline is not None:
+                    now = time.time()
+                    if now >= deadline or self.best_energy == 0:
+                        break
+                    temperature = self.Tmax * (self.Tmin / self.Tmax) ** ((now - start_time) / (deadline - start_time))
+            step += 1
+            self.step(temperature)
+            if deadline is None:
+                temperature *= cooling
+        if self.tracer is not None:
+            self.trace(step, force=True)
+        return self.best_state, self.best_energy
+
+    def trace(self, step, force=False):
+        total_edges = self.evaluator.total_edges
+        self.tracer.record("anneal", step, self.evaluator.score(), (total_edges - self.best_energy) / total_edges,
+                           self.accepted, self.rejected, force)
+
+
+class ParallelTempering:
+    '''
+        Runs several annealing chains in separate processes, each at a fixed temperature of a
+        geometric ladder between SimulatedAnnealer.Tmin and SimulatedAnnealer.Tmax. Every
+        exchange_interval steps neighbouring chains swap temperatures with the usual Metropolis
+        rule, which has the same effect as swapping their states but only sends two numbers.
+    '''
 
-    # create a matrix mapping a student's number of friends in the bus they're in
-    friendships_in_bus_for_student = [[[] for j in range(num_buses)] for i in range(len(student_names))] # np.zeros(shape=(num_buses, len(student_names)))
-    for student in student_names:
-        for friend in graph.adj[student]:
-            for bus in bus_assignments:
-                if friend in bus_assignments[bus]:
-                    friendships_in_bus_for_student[name_to_index[student]][bus].append(name_to_index[friend])
-
-    tsp = SimulatedAnnealer(bus_assignments, friendships_in_bus_for_student, fraction_of_rowdy_group_in_bus, rowdy_group_student_membership_matrix,
-                            name_to_index, student_names,
-                            number_of_friendships_in_bus_for_rowdy_group,
-                            scaled_rowdy_group_student_membership_matrix, constraints, size_bus, graph)
-
-    tsp.steps = 10000
-    # since our state is just a list, slice is the fastest way to copy
-    # tsp.copy_strategy = "slice"
-    if tsp.energy() > 0:
-        state, e = tsp.anneal()
-        return dict_to_string(state)
-    else:
-        return dict_to_string(tsp.state)
-
-
-# Update memoized data
-def update_data(student_index, bus_index, student_names, rowdy_group_student_membership_matrix, friend_count_in_rgs, fraction_of_rowdy_group_in_bus, number_of_friendships_in_bus_for_rowdy_group, bus_assignments, scaled_rowdy_group_student_membership_matrix):
-    bus_assignments[bus_index].append(student_names[student_index])
-    rowdy_groups_student_is_in = rowdy_group_student_membership_matrix[:, student_index]
-    fraction_of_rowdy_group_in_bus[bus_index,:] += np.multiply(scaled_rowdy_group_student_membership_matrix[:, student_index], rowdy_groups_student_is_in)
-    number_of_friendships_in_bus_for_rowdy_group += friend_count_in_rgs
+    num_chains = 4
+    exchange_interval = 2000
+
+    def __init__(self, instance, student_to_bus, num_chains=None, exchange_interval=None, seed=None):
+        self.instance = instance
+        self.student_to_bus = np.asarray(student_to_bus)
+        if num_chains is not None:
+            self.num_chains = num_chains
+        if exchange_interval is not None:
+            self.exchange_interval = exchange_interval
+        self.random = random.Random(seed)
+        self.chain_seeds = [self.random.getrandbits(32) for _ in range(self.num_chains)]
+        if self.num_chains == 1:
+            self.temperatures = [SimulatedAnnealer.Tmin]
+        else:
+            ratio = SimulatedAnnealer.Tmax / SimulatedAnnealer.Tmin
+            self.temperatures = [SimulatedAnnealer.Tmin * ratio ** (k / (self.num_chains - 1)) for k in range(self.num_chains)]
+        self.exchanges_tried = 0
+        self.exchanges_accepted = 0
+
+    def run(self, steps=None, deadline=None):
+        '''
+            Runs every chain for steps steps (SimulatedAnnealer.steps by default), or until deadline
+            (a time.time() value) when one is given
+
+            Outputs:
+                (best_state, best_energy) - the best student->bus array seen by any chain and its energy
+        '''
+        if steps is None:
+            steps = SimulatedAnnealer.steps
+        connections = []
+        processes = []
+        for chain_seed in self.chain_seeds:
+            connection, chain_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_chain, args=(chain_connection, self.instance, self.student_to_bus, chain_seed))
+            process.start()
+            connections.append(connection)
+            processes.append(process)
+
+        # chain_at[k] is the chain currently running at temperatures[k]
+        chain_at = list(range(self.num_chains))
+        try:
+            steps_done = 0
+            round_number = 0
+            while steps_done < steps or deadline is not None:
+                if deadline is not None and time.time() >= deadline:
+                    break
+                round_steps = self.exchange_interval if deadline is not None else min(self.exchange_interval, steps - steps_done)
+                for k, chain in enumerate(chain_at):
+                    connections[chain].send((self.temperatures[k], round_steps, deadline))
+                reports = [connection.recv() for connection in connections]
+                steps_done += round_steps
+                if min(best_energy for _, best_energy in reports) == 0:
+                    break
+                self.exchange(chain_at, [energy for energy, _ in reports], round_number % 2)
+                round_number += 1
+
+            for connection in connections:
+                connection.send(None)
+            results = [connection.recv() for connection in connections]
+        finally:
+            # when a chain fails the others are left waiting for their next message, so stop them
+            # rather than wait for them (after a normal run they have sent their results already)
+            for connection in connections:
+                connection.close()
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+        return min(results, key=lambda result: result[1])
+
+    def exchange(self, chain_at, energies, first):
+        # alternate between the (0, 1), (2, 3), ... and (1, 2), (3, 4), ... pairs of temperatures
+        for k in range(first, self.num_chains - 1, 2):
+            colder, hotter = chain_at[k], chain_at[k + 1]
+            exponent = (1 / self.temperatures[k] - 1 / self.temperatures[k + 1]) * (energies[colder] - energies[hotter])
+            self.exchanges_tried += 1
+            if exponent >= 0 or self.random.random() < math.exp(exponent):
+                chain_at[k], chain_at[k + 1] = hotter, colder
+                self.exchanges_accepted += 1
+
+
+def run_chain(connection, instance, student_to_bus, seed):
+    '''
+        The loop of one ParallelTempering chain: receives (temperature, steps, deadline) and answers with
+        (energy, best_energy) until it receives None, then sends back (best_state, best_energy)
+    '''
+    annealer = SimulatedAnnealer(instance, student_to_bus, seed)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        temperature, steps, deadline = message
+        energy = annealer.sample(temperature, steps, deadline)
+        connection.send((energy, annealer.best_energy))
+    connection.send((annealer.best_state, annealer.best_energy))
+    connection.close()
+
+
+class BusSet:
+    '''A set of bus ids with constant-time add, remove, membership and uniform sampling'''
+
+    def __init__(self, num_buses):
+        self.members = []
+        self.position = [-1] * num_buses
+
+    def __len__(self):
+        return len(self.members)
+
+    def set(self, bus, present):
+        if present and self.position[bus] < 0:
+            self.position[bus] = len(self.members)
+            self.members.append(bus)
+        elif not present and self.position[bus] >= 0:
+            last = self.members.pop()
+            if last != bus:
+                self.members[self.position[bus]] = last
+                self.position[last] = self.position[bus]
+            self.position[bus] = -1
+
+    def sample(self, rng):
+        return self.members[rng.randrange(len(self.members))]
+
+
+def solve(instance, steps=None, seed=None, time_budget=None, num_chains=1, exchange_interval=None, seeding="greedy"):
+    '''
+        Solves an input by annealing the greedy assignment from solver.py, or the graph
+        partitioning from partition.py with seeding="partition"
 
+        Inputs:
+            instance - the Instance to solve
+            steps - the number of annealing steps (per chain), SimulatedAnnealer.steps by default
+            seed - seeds the random moves
+            time_budget - a wall-clock budget in seconds for the whole solve; when given, annealing
+                runs until it is used up (steps is ignored) and the best assignment so far is returned
+            num_chains - above 1, runs that many chains with ParallelTempering instead of one annealer
+            exchange_interval - the steps between temperature exchanges, ParallelTempering.exchange_interval by default
+            seeding - "greedy" or "partition", where the assignment to anneal comes from
 
-def decrease(student_index, bus_index, student_names, rowdy_group_student_membership_matrix, friend_count_in_rgs, fraction_of_rowdy_group_in_bus, number_of_friendships_in_bus_for_rowdy_group, bus_assignments, scaled_rowdy_group_student_membership_matrix):
-    bus_assignments[bus_index].remove(student_names[student_index])
-    rowdy_groups_student_is_in = rowdy_group_student_membership_matrix[:, student_index]
-    fraction_of_rowdy_group_in_bus[bus_index,:] -= np.multiply(scaled_rowdy_group_student_membership_matrix[:, student_index], rowdy_groups_student_is_in)
-    number_of_friendships_in_bus_for_rowdy_group -= friend_count_in_rgs
+        Outputs:
+            the output file contents for the best assignment found
+    '''
+    deadline = None if time_budget is None else time.time() + time_budget
+    if seeding == "partition":
+        student_to_bus = partition_assignment(instance, seed)
+        bus_assignments = assignment_to_buses(instance, student_to_bus)
+    else:
+        bus_assignments, student_to_bus = greedy_assignment(instance, deadline)
+    if deadline is not None and time.time() >= deadline:
+        return dict_to_string(bus_assignments)
+    if num_chains > 1:
+        tempering = ParallelTempering(instance, student_to_bus, num_chains, exchange_interval, seed)
+        student_to_bus, _ = tempering.run(steps, deadline)
+        return dict_to_string(assignment_to_buses(instance, student_to_bus))
+    annealer = SimulatedAnnealer(instance, student_to_bus, seed)
+    if steps is not None:
+        annealer.steps = steps
+    if annealer.energy() > 0:
+        student_to_bus, _ = annealer.anneal(deadline)
+    return dict_to_string(assignment_to_buses(instance, student_to_bus))
 
 
 def main():
@@ -371,15 +381,14 @@ def main():
 
         for input_folder in os.listdir(category_dir):
             input_name = os.fsdecode(input_folder)
-            graph, num_buses, size_bus, constraints = '', '', '', ''
+            instance = None
             execute = True
             try:
-                graph, num_buses, size_bus, constraints = parse_input(category_path + "/" + input_name)
-                graph.remove_edges_from(graph.selfloop_edges())
+                instance = parse_input(category_path + "/" + input_name)
             except:
                 execute = False
             if execute:
-                solution = solve(graph, num_buses, size_bus, constraints)
+                solution = solve(instance)
                 output_file = open(output_category_path + "/" + input_name + ".out", "w")
 
                 # TODO: modify this to write your solution to your
@@ -1,8 +1,20 @@
-import networkx as nx
 # import cvxpy
 import numpy as np
 import os
+import sys
 import heapq
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from instance_cache import load_cached_instance
+from evaluator import ScoreEvaluator
+import ilp
+import partition
+import refine
+import decompose
+import output_sidecar
+import manifest
+from anytime_trace import Tracer
 
 ###########################################
 # Change this variable to the path to
@@ -18,161 +30,715 @@ path_to_inputs = "./all_inputs"
 ###########################################
 path_to_outputs = "./outputs"
 
+# how a seeded greedy pass is perturbed: each student's number of rowdy groups is jittered by
+# up to greedy_ordering_noise before sorting, and the rowdy group cost is scaled by a factor
+# drawn from greedy_cost_weights
+greedy_ordering_noise = 2.0
+greedy_cost_weights = (0.5, 2.0)
+
+# size categories solved with the integer program in ilp.py when asked to (--exact) and PuLP is
+# installed, and the most seconds CBC gets on each of those inputs
+exact_categories = ["small"]
+exact_time_limit = 30
+
+# whether a binary <input>.out.npy is written next to each output for output_scorer.py to load
+write_sidecars = True
+
 def parse_input(folder_name):
     '''
-        Parses an input and returns the corresponding graph and parameters
+        Parses an input and returns the corresponding graph and parameters.
+        Inputs that were parsed before are memory-mapped from the cache in instance_cache.py.
 
         Inputs:
             folder_name - a string representing the path to the input folder
 
         Outputs:
-            (graph, num_buses, size_bus, constraints)
-            graph - the graph as a NetworkX object
-            num_buses - an integer representing the number of buses you can allocate to
-            size_buses - an integer representing the number of students that can fit on a bus
-            constraints - a list where each element is a list vertices which represents a single rowdy group
+            an Instance (see instance.py) holding the friendship graph as CSR adjacency arrays,
+            the number of buses, the bus size and the rowdy groups as flat arrays of student indices
     '''
-    graph = nx.read_gml(folder_name + "/graph.gml")
-    parameters = open(folder_name + "/parameters.txt")
-    num_buses = int(parameters.readline())
-    size_bus = int(parameters.readline())
-    constraints = []
+    return load_cached_instance(folder_name)
 
-    for line in parameters:
-        line = line[1: -2]
-        curr_constraint = [num.replace("'", "") for num in line.split(", ")]
-        constraints.append(curr_constraint)
-
-    return graph, num_buses, size_bus, constraints
+def bus_line(students):
+    if len(students) != 0:
+        return str(students) + "\n"
+    return "[]" + "\n"
 
 def dict_to_string(dict):
-    result = ""
-    for key in dict:
-        if len(dict[key]) != 0:
-            result = result + str(dict[key]) + "\n"
-        else:
-            result = result + "[]" + "\n"
-    return result
+    return "".join(bus_line(dict[key]) for key in dict)
 
-def solve(graph, num_buses, size_bus, constraints):
-    #TODO: Write this method as you like. We'd recommend changing the arguments here as well
-    # graph, num_buses, size_bus, constraints = parse_input(path_to_outputs)
+def assignment_to_buses(instance, student_to_bus):
+    '''
+        Turns an array with the bus of each student into a dictionary mapping each bus
+        to the list of student names on it, ready for dict_to_string
+    '''
+    bus_assignments = {}
+    for i in range(instance.num_buses):
+        bus_assignments[i] = []
+    for student_idx, bus in enumerate(np.asarray(student_to_bus).tolist()):
+        bus_assignments[bus].append(instance.student_names[student_idx])
+    return bus_assignments
 
-    # construct a dictionary mapping each person to the rowdy groups they're in
+def solve(instance, time_budget=None, num_starts=1, seed=None, seeding="greedy", refinement=False, decomposition=False, engine="anneal",
+          replicas=None):
+    '''
+        Solves an input with the greedy heuristic and returns the output file contents.
+        With num_starts above 1 the best of that many greedy passes is kept (see multi_start_assignment),
+        with seeding="partition" the graph partitioning in partition.py is used instead of the greedy,
+        with refinement the result is improved by the local search in refine.py, with decomposition
+        only the part of the input decompose.py cannot pack directly is solved this way, and with a
+        time_budget (in seconds) it is annealed (or with engine="tabu", tabu searched, or with
+        engine="tempering", annealed by replicas chains at once) until the budget runs out, see anytime_assignment.
+    '''
+    deadline = None if time_budget is None else time.time() + time_budget
+    bus_assignments, _ = anytime_assignment(instance, deadline, num_starts, seed, num_workers=None, seeding=seeding,
+                                            refinement=refinement, decomposition=decomposition, engine=engine, replicas=replicas)
+    return dict_to_string(bus_assignments)
+
+def anytime_assignment(instance, deadline=None, num_starts=1, seed=None, num_workers=1, exact_time_limit=None, seeding="greedy",
+                       refinement=False, decomposition=False, tracer=None, engine="anneal", replicas=None):
+    '''
+        Returns the best valid assignment found before deadline (a time.time() value)
 
-    student_names = list(graph.nodes())
-    name_to_idx = dict()
+        Without a deadline this is just the initial assignment: the greedy (or multi-start greedy)
+        one, or with seeding="partition" the one from partition.partition_assignment. With a
+        deadline, greedy passes are cut short if they run out of time and whatever time is left
+        goes to simann.SimulatedAnnealer, or with engine="tabu" to tabu.TabuSearch, or with
+        engine="tempering" to a simann.ParallelTempering of replicas chains (ParallelTempering.num_chains
+        by default), each in its own process.
 
-    for i, student in enumerate(student_names):
-        name_to_idx[student] = i
+        With an exact_time_limit (in seconds) the greedy assignment is handed to the integer program
+        in ilp.py as a warm start first, and annealing only runs if it could not be proven optimal.
+        With a deadline CBC gets at most half the time left, so annealing always has the other half.
+        With refinement, the assignment goes through refine.FMRefiner before annealing.
 
-    num_rowdy_groups = len(constraints)
+        With decomposition, friendship components that no rowdy group touches are packed onto buses
+        whole by decompose.py and all of the above only runs on the rest of the input.
+
+        With a tracer (see anytime_trace.py) the greedy and the annealing record their progress and
+        every other stage records the score it ends with. The rest of a decomposed input is not traced.
+
+        Outputs:
+            (bus_assignments, student_to_bus) as returned by greedy_assignment
+    '''
+    if decomposition:
+        student_to_bus = decompose.decomposed_assignment(instance, lambda hard_instance: anytime_assignment(
+            hard_instance, deadline, num_starts, seed, num_workers, exact_time_limit, seeding, refinement, engine=engine, replicas=replicas)[1])
+        if student_to_bus is not None:
+            trace_assignment(tracer, "decompose", instance, student_to_bus)
+            return assignment_to_buses(instance, student_to_bus), student_to_bus
+
+    if seeding == "partition":
+        student_to_bus = partition.partition_assignment(instance, seed)
+        bus_assignments = assignment_to_buses(instance, student_to_bus)
+        trace_assignment(tracer, "partition", instance, student_to_bus)
+    elif num_starts > 1:
+        bus_assignments, student_to_bus = multi_start_assignment(instance, num_starts, seed, num_workers, deadline)
+        trace_assignment(tracer, "multi_start", instance, student_to_bus)
+    else:
+        bus_assignments, student_to_bus = greedy_assignment(instance, deadline, tracer=tracer)
+    if exact_time_limit is not None:
+        # CBC rarely improves on the warm start without proving it optimal, so it must not take the whole budget
+        time_limit = exact_time_limit if deadline is None else min(exact_time_limit, (deadline - time.time()) / 2)
+        # building the model alone takes a good fraction of a second
+        if time_limit >= 1:
+            student_to_bus, optimal = ilp.solve_exact(instance, student_to_bus, time_limit)
+            bus_assignments = assignment_to_buses(instance, student_to_bus)
+            trace_assignment(tracer, "ilp", instance, student_to_bus)
+            if optimal:
+                return bus_assignments, student_to_bus
+    if refinement and (deadline is None or time.time() < deadline):
+        student_to_bus = refine.refine_assignment(instance, student_to_bus, deadline)
+        bus_assignments = assignment_to_buses(instance, student_to_bus)
+        trace_assignment(tracer, "refine", instance, student_to_bus)
+    if deadline is None or time.time() >= deadline:
+        return bus_assignments, student_to_bus
+    if engine == "tabu":
+        # like simann, tabu imports this module
+        from tabu import tabu_assignment
+        student_to_bus = tabu_assignment(instance, student_to_bus, deadline=deadline, seed=seed)
+        trace_assignment(tracer, "tabu", instance, student_to_bus)
+        return assignment_to_buses(instance, student_to_bus), student_to_bus
+    if engine == "tempering":
+        from simann import ParallelTempering
+        student_to_bus, _ = ParallelTempering(instance, student_to_bus, replicas, seed=seed).run(deadline=deadline)
+        trace_assignment(tracer, "tempering", instance, student_to_bus)
+        return assignment_to_buses(instance, student_to_bus), student_to_bus
+    # simann imports this module, so it can only be imported once both are loaded
+    from simann import SimulatedAnnealer
+    annealer = SimulatedAnnealer(instance, student_to_bus, seed)
+    if annealer.energy() == 0:
+        return bus_assignments, student_to_bus
+    annealer.tracer = tracer
+    student_to_bus, _ = annealer.anneal(deadline)
+    return assignment_to_buses(instance, student_to_bus), student_to_bus
+
+def trace_assignment(tracer, solver_name, instance, student_to_bus, step=None):
+    '''Records the score a stage of anytime_assignment ended with, if there is a tracer'''
+    if tracer is not None:
+        score = ScoreEvaluator(instance, student_to_bus, track_friend_counts=False).score()
+        tracer.record(solver_name, step, score, score, force=True)
+
+def greedy_assignment(instance, deadline=None, seed=None, tracer=None):
+    '''
+        Places students one at a time, most rowdy groups first, on the bus with the best heuristic value
+
+        Inputs:
+            instance - the Instance to solve
+            deadline - a time.time() value; students still unplaced by then go on the bus with room
+                holding the most of their friends, so a valid assignment is always returned
+            seed - when given, the ordering and the weight of the rowdy group cost are randomly
+                perturbed (see greedy_ordering_noise and greedy_cost_weights); None is the plain greedy
+            tracer - an anytime_trace.Tracer recording the number of students placed as the greedy goes
+
+        Outputs:
+            (bus_assignments, student_to_bus)
+            bus_assignments - a dictionary mapping each bus to the list of student names on it, in placement order
+            student_to_bus - an integer array with the bus of each student
+    '''
+    # construct a dictionary mapping each person to the rowdy groups they're in
+
+    student_names = instance.student_names
+    num_buses = instance.num_buses
+    size_bus = instance.size_bus
+
+    num_rowdy_groups = instance.num_groups
     bus_assignments = {}
     for i in range(num_buses):
         bus_assignments[i] = []
-    #M
-    rowdy_group_to_students = np.zeros((len(constraints), len(student_names)))
-    for rg_index in range(len(constraints)):
-        for student_string in student_names:
-            if student_string in constraints[rg_index]:
-                rowdy_group_to_students[rg_index, name_to_idx[student_string]] = 1
-
-    sums = np.sum(rowdy_group_to_students, axis=1)
-
-    scaled_rowdy_group_to_students = rowdy_group_to_students / sums[:,None]
+    #M, stored sparsely
+    student_groups = [instance.groups_of(i) for i in range(len(student_names))]
+    group_sizes = np.diff(instance.group_indptr).astype(float)
     #C
     fraction_of_rowdy_group_in_bus = np.zeros(shape=(num_buses, num_rowdy_groups), dtype=float)
     #L
     number_of_friendships_in_bus_for_rowdy_group = np.zeros(shape=(num_buses, num_rowdy_groups), dtype=float)
     #sort students by number of rowdy groups they're in
     # iterate through every person
-    student_ordering = np.argsort(-np.sum(rowdy_group_to_students, axis=0))
+    # friends of each student as integer indices
+    neighbors = [instance.neighbors(i) for i in range(len(student_names))]
+    # bus each student is on (-1 while unplaced) and number of friends each student already has on each bus
+    student_to_bus = np.full(len(student_names), -1, dtype=np.int64)
+    friends_on_bus = np.zeros(shape=(len(student_names), num_buses), dtype=np.int32)
+    groups_per_student = np.array([len(groups) for groups in student_groups], dtype=float)
+    student_group_indptr = np.asarray(instance.student_group_indptr)
+    student_group_indices = np.asarray(instance.student_group_indices)
+    # scratch space: the position of each group among the groups of the student being placed, -1 for the others
+    group_position = np.full(num_rowdy_groups, -1, dtype=np.int64)
+    cost_weight = 1.0
+    if seed is None:
+        student_ordering = np.argsort(-groups_per_student)
+    else:
+        rng = np.random.default_rng(seed)
+        student_ordering = np.argsort(-(groups_per_student + greedy_ordering_noise * rng.random(len(student_names))))
+        cost_weight = rng.uniform(*greedy_cost_weights)
     for i, student_idx in enumerate(student_ordering[:num_buses]):
-        update_data(student_idx, i, student_names, rowdy_group_to_students, np.zeros(shape=(num_buses, num_rowdy_groups)), fraction_of_rowdy_group_in_bus, number_of_friendships_in_bus_for_rowdy_group,
-                        bus_assignments, scaled_rowdy_group_to_students)
-
-    for student_idx in student_ordering[num_buses:]:
-        additional_friendships = np.zeros(shape=(num_buses, 1), dtype=float)
-        friend_count_in_rgs = np.zeros(shape=(num_buses, num_rowdy_groups))
-
-        for bus in range(num_buses):
-            count = 0
-            for friend in graph.adj[student_names[student_idx]]:
-                if friend in bus_assignments[bus]:
-                    friend_rg = rowdy_group_to_students[:,name_to_idx[friend]]
-                    student_rg = rowdy_group_to_students[:,student_idx]
-                    common_rgs = np.where(friend_rg + student_rg == 2)
-                    for common_rg in common_rgs:
-                        friend_count_in_rgs[bus, common_rg] += 1
-                    count+=1
-            additional_friendships[bus] = count
-
-        number_of_friendships_in_bus_for_rowdy_group_temp = number_of_friendships_in_bus_for_rowdy_group + additional_friendships @ rowdy_group_to_students[:,student_idx].reshape(1,num_rowdy_groups)
-        fraction_of_rowdy_group_in_bus_temp               = fraction_of_rowdy_group_in_bus +  np.ones(shape=additional_friendships.shape) @ scaled_rowdy_group_to_students[:,student_idx].reshape(1, num_rowdy_groups)
+        update_data(student_idx, i, student_names, student_groups, np.zeros(shape=(num_buses, len(student_groups[student_idx]))), fraction_of_rowdy_group_in_bus, number_of_friendships_in_bus_for_rowdy_group,
+                        bus_assignments, group_sizes, student_to_bus, friends_on_bus, neighbors)
+
+    for order_idx in range(num_buses, len(student_ordering)):
+        student_idx = student_ordering[order_idx]
+        if tracer is not None:
+            tracer.record("greedy", order_idx, None)
+        if deadline is not None and time.time() >= deadline:
+            place_by_friends(student_ordering[order_idx:], student_names, size_bus, bus_assignments, student_to_bus, friends_on_bus, neighbors)
+            break
+        additional_friendships = friends_on_bus[student_idx].reshape(num_buses, 1).astype(float)
+        # only the columns of L and C for the student's own rowdy groups change, and only they
+        # count towards the cost, so everything below is num_buses x (groups of this student)
+        rowdy_groups_student_is_in = student_groups[student_idx]
+        num_groups_of_student = len(rowdy_groups_student_is_in)
+        friend_count_in_rgs = np.zeros(shape=(num_buses, num_groups_of_student))
+
+        if num_groups_of_student > 0:
+            # the groups of all placed friends at once, each with the bus of its friend
+            placed_friends = neighbors[student_idx][student_to_bus[neighbors[student_idx]] >= 0]
+            group_counts = student_group_indptr[placed_friends + 1] - student_group_indptr[placed_friends]
+            starts = np.repeat(student_group_indptr[placed_friends] - np.cumsum(group_counts) + group_counts, group_counts)
+            friend_groups = student_group_indices[starts + np.arange(len(starts))]
+            group_position[rowdy_groups_student_is_in] = np.arange(num_groups_of_student)
+            positions = group_position[friend_groups]
+            common_rgs = positions >= 0
+            cells = np.repeat(student_to_bus[placed_friends], group_counts)[common_rgs] * num_groups_of_student + positions[common_rgs]
+            friend_count_in_rgs += np.bincount(cells, minlength=num_buses * num_groups_of_student).reshape(num_buses, num_groups_of_student)
+            group_position[rowdy_groups_student_is_in] = -1
+
+        number_of_friendships_in_bus_for_rowdy_group_temp = number_of_friendships_in_bus_for_rowdy_group[:, rowdy_groups_student_is_in] + additional_friendships
+        fraction_of_rowdy_group_in_bus_temp               = fraction_of_rowdy_group_in_bus[:, rowdy_groups_student_is_in] + 1 / group_sizes[rowdy_groups_student_is_in]
         floored_fraction_of_rowdy_group_in_bus_temp       = np.floor(fraction_of_rowdy_group_in_bus_temp)
 
         reward_vector = additional_friendships.reshape(additional_friendships.size)
         cost_matrix = np.multiply(floored_fraction_of_rowdy_group_in_bus_temp, number_of_friendships_in_bus_for_rowdy_group_temp) + fraction_of_rowdy_group_in_bus_temp / num_rowdy_groups
-        rowdy_groups_student_is_in = rowdy_group_to_students[:,student_idx]
-        cost_vector = cost_matrix @ rowdy_groups_student_is_in
-        heuristics = reward_vector - cost_vector
+        cost_vector = cost_matrix.sum(axis=1)
+        heuristics = reward_vector - cost_weight * cost_vector
+        if len(rowdy_groups_student_is_in) > 2 and is_near_tie(heuristics, bus_assignments, size_bus):
+            cost_vector = full_width_cost(cost_matrix, rowdy_groups_student_is_in, num_rowdy_groups)
+            heuristics = reward_vector - cost_weight * cost_vector
         sorted_heuristic_indices = np.argsort(-heuristics)
 
         for idx in sorted_heuristic_indices:
             load = len(bus_assignments[idx])
             if load < size_bus:
-                update_data(student_idx, idx, student_names, rowdy_group_to_students, friend_count_in_rgs, fraction_of_rowdy_group_in_bus, number_of_friendships_in_bus_for_rowdy_group,
-                                bus_assignments, scaled_rowdy_group_to_students)
+                update_data(student_idx, idx, student_names, student_groups, friend_count_in_rgs, fraction_of_rowdy_group_in_bus, number_of_friendships_in_bus_for_rowdy_group,
+                                bus_assignments, group_sizes, student_to_bus, friends_on_bus, neighbors)
                 break
 
-    return dict_to_string(bus_assignments)
+    trace_assignment(tracer, "greedy", instance, student_to_bus, len(student_names))
+    return bus_assignments, student_to_bus
 
         #append friend to bus
     # heuristic is # of friendships created - factor * potential rowdy groups created (but make -large value if a rowdy group is created--recalculate friendships if a rowdy group has to be made)
 
     # simulated anealing to swap for best solution
 
+# Whether the best buses with room for a student are too close to tell apart by summation order
+def is_near_tie(heuristics, bus_assignments, size_bus):
+    open_heuristics = heuristics[[len(bus_assignments[bus]) < size_bus for bus in range(len(heuristics))]]
+    if len(open_heuristics) < 2:
+        return False
+    best = open_heuristics.max()
+    return np.count_nonzero(open_heuristics >= best - 1e-9 * max(1.0, abs(best))) > 1
+
+# The cost of each bus summed the way the dense num_buses x num_rowdy_groups product always did.
+# With three or more groups the order of the sum changes the last bits, and buses whose costs are
+# equal on paper are then ranked by those bits, so near ties are settled like before.
+def full_width_cost(cost_matrix, rowdy_groups_student_is_in, num_rowdy_groups):
+    full_cost_matrix = np.zeros(shape=(cost_matrix.shape[0], num_rowdy_groups))
+    full_cost_matrix[:, rowdy_groups_student_is_in] = cost_matrix
+    rowdy_groups_student_is_in_dense = np.zeros(num_rowdy_groups)
+    rowdy_groups_student_is_in_dense[rowdy_groups_student_is_in] = 1
+    return full_cost_matrix @ rowdy_groups_student_is_in_dense
+
 # Update memoized data
-def update_data(student_idx, bus_idx, student_names, rowdy_group_to_students, friend_count_in_rgs, fraction_of_rowdy_group_in_bus, number_of_friendships_in_bus_for_rowdy_group,
-                bus_assignments, scaled_rowdy_group_to_students):
+def update_data(student_idx, bus_idx, student_names, student_groups, friend_count_in_rgs, fraction_of_rowdy_group_in_bus, number_of_friendships_in_bus_for_rowdy_group,
+                bus_assignments, group_sizes, student_to_bus, friends_on_bus, neighbors):
     bus_assignments[bus_idx].append(student_names[student_idx])
-    rowdy_groups_student_is_in = rowdy_group_to_students[:, student_idx]
-    fraction_of_rowdy_group_in_bus[bus_idx,:] += np.multiply(scaled_rowdy_group_to_students[:, student_idx], rowdy_groups_student_is_in)
-    number_of_friendships_in_bus_for_rowdy_group += friend_count_in_rgs
+    student_to_bus[student_idx] = bus_idx
+    friends_on_bus[neighbors[student_idx], bus_idx] += 1
+    rowdy_groups_student_is_in = student_groups[student_idx]
+    fraction_of_rowdy_group_in_bus[bus_idx, rowdy_groups_student_is_in] += 1 / group_sizes[rowdy_groups_student_is_in]
+    # friend_count_in_rgs only has the columns of the student's rowdy groups
+    number_of_friendships_in_bus_for_rowdy_group[:, rowdy_groups_student_is_in] += friend_count_in_rgs
+
+
+# Place the remaining students by friends alone, once the heuristic has run out of time
+def place_by_friends(remaining_students, student_names, size_bus, bus_assignments, student_to_bus, friends_on_bus, neighbors):
+    loads = np.array([len(bus_assignments[bus]) for bus in range(len(bus_assignments))])
+    for student_idx in remaining_students:
+        bus_idx = int(np.argmax(np.where(loads < size_bus, friends_on_bus[student_idx], -1)))
+        bus_assignments[bus_idx].append(student_names[student_idx])
+        student_to_bus[student_idx] = bus_idx
+        friends_on_bus[neighbors[student_idx], bus_idx] += 1
+        loads[bus_idx] += 1
+
+# the instance restarted on in each worker process, set by start_greedy_worker
+greedy_worker_instance = None
+
+def start_greedy_worker(instance):
+    global greedy_worker_instance
+    greedy_worker_instance = instance
+
+def greedy_pass(seed, deadline=None, instance=None):
+    '''
+        Runs one greedy pass and scores it
+
+        Outputs:
+            (kept, bus_assignments, student_to_bus), or None if deadline passed before the pass could start
+    '''
+    if instance is None:
+        instance = greedy_worker_instance
+    if deadline is not None and time.time() >= deadline:
+        return None
+    bus_assignments, student_to_bus = greedy_assignment(instance, deadline, seed)
+    return ScoreEvaluator(instance, student_to_bus, track_friend_counts=False).kept, bus_assignments, student_to_bus
+
+def multi_start_assignment(instance, num_starts, seed=None, num_workers=None, deadline=None):
+    '''
+        Runs the plain greedy pass and num_starts - 1 randomly perturbed ones, and keeps the best
 
+        Inputs:
+            instance - the Instance to solve
+            num_starts - the number of greedy passes
+            seed - makes the perturbed passes reproducible
+            num_workers - the number of worker processes for the passes (one per core by default, in-process when 1)
+            deadline - a time.time() value after which no new pass is started
+
+        Outputs:
+            (bus_assignments, student_to_bus) of the pass keeping the most friendships; ties go to the
+            earlier pass, so this is never worse than greedy_assignment
+    '''
+    seeds = [None] + np.random.SeedSequence(seed).spawn(num_starts - 1)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, num_starts)
+
+    if num_workers == 1:
+        results = [greedy_pass(pass_seed, deadline, instance) for pass_seed in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=start_greedy_worker, initargs=(instance,)) as executor:
+            results = list(executor.map(greedy_pass, seeds, [deadline] * num_starts))
+
+    best = None
+    for result in results:
+        if result is not None and (best is None or result[0] > best[0]):
+            best = result
+    if best is None:
+        # out of time before even the plain pass started
+        return greedy_assignment(instance, deadline)
+    return best[1], best[2]
+
+def list_inputs(inputs_path, size_categories):
+    '''
+        Lists every input folder, ordered longest-job-first so the big inputs
+        don't end up as the tail of a parallel run
 
+        Inputs:
+            inputs_path - the path to the folder containing the size category folders
+            size_categories - a list of size category folder names
+
+        Outputs:
+            a list of (size, input_name) tuples, larger categories first and larger graphs first within a category
+    '''
+    jobs = []
+    for rank, size in enumerate(size_categories):
+        category_path = inputs_path + "/" + size
+        for input_folder in os.listdir(os.fsencode(category_path)):
+            input_name = os.fsdecode(input_folder)
+            graph_file = category_path + "/" + input_name + "/graph.gml"
+            graph_bytes = os.path.getsize(graph_file) if os.path.isfile(graph_file) else 0
+            jobs.append((-rank, -graph_bytes, size, input_name))
+    jobs.sort()
+    return [(size, input_name) for _, _, size, input_name in jobs]
 
-def main():
+def write_output(output_file_path, bus_assignments, instance=None, student_to_bus=None):
+    '''
+        Streams the bus lines to a file next to output_file_path and renames it into place, so an
+        interrupted run never leaves a half-written .out file behind. When instance and student_to_bus
+        are given and write_sidecars is set, the binary sidecar from output_sidecar.py is written too.
+
+        Inputs:
+            output_file_path - the path of the .out file
+            bus_assignments - a dictionary mapping each bus to the list of student names on it
+            instance - the Instance solved
+            student_to_bus - an integer array with the bus of each student, matching bus_assignments
+    '''
+    temp_path = "{}.{}.tmp".format(output_file_path, os.getpid())
+    with open(temp_path, "wb") as output_file:
+        for bus in bus_assignments:
+            output_file.write(bus_line(bus_assignments[bus]).encode())
+    os.replace(temp_path, output_file_path)
+    if write_sidecars and instance is not None and student_to_bus is not None:
+        output_sidecar.write_sidecar(output_file_path, instance, student_to_bus)
+
+def solve_input(inputs_path, outputs_path, size, input_name, time_budget=None, num_starts=1, seed=None, exact_time_limit=None,
+                seeding="greedy", refinement=False, decomposition=False, previous_score=None, trace_folder=None, engine="anneal",
+                replicas=None):
+    '''
+        Parses, solves and writes a single input. This is the unit of work of the batch driver,
+        so multi-start passes run one after another inside it.
+        time_budget, in seconds, covers parsing, solving and writing. exact_time_limit, seeding,
+        refinement, decomposition, engine and replicas are passed on to anytime_assignment. When previous_score is
+        given the existing .out file is only replaced by a solution scoring higher. With a trace_folder
+        the progress of the solve is written to <size>-<input_name>.jsonl in it (see anytime_trace.py).
+
+        Outputs:
+            (size, input_name, seconds, score) - the input solved, its wall time and its score
+    '''
+    start_time = time.time()
+    deadline = None if time_budget is None else start_time + time_budget
+    instance = parse_input(inputs_path + "/" + size + "/" + input_name)
+    tracer = None if trace_folder is None else Tracer(trace_folder + "/" + size + "-" + input_name + ".jsonl", size + "/" + input_name)
+    try:
+        bus_assignments, student_to_bus = anytime_assignment(instance, deadline, num_starts, seed, exact_time_limit=exact_time_limit, seeding=seeding,
+                                                              refinement=refinement, decomposition=decomposition, tracer=tracer, engine=engine,
+                                                              replicas=replicas)
+    finally:
+        if tracer is not None:
+            tracer.close()
+    score = ScoreEvaluator(instance, student_to_bus).score()
+    if previous_score is None or score > previous_score:
+        write_output(outputs_path + "/" + size + "/" + input_name + ".out", bus_assignments, instance, student_to_bus)
+    return size, input_name, time.time() - start_time, score
+
+def input_weight(inputs_path, size, input_name):
+    '''
+        How much of a batch time budget an input should get, relative to the others: the size of its graph.gml
+    '''
+    graph_file = inputs_path + "/" + size + "/" + input_name + "/graph.gml"
+    return (os.path.getsize(graph_file) if os.path.isfile(graph_file) else 0) + 1
+
+def allot_time(batch_deadline, num_workers, reserved, weight, remaining_weight):
+    '''
+        Splits the worker time left before batch_deadline between the inputs that have not started,
+        in proportion to their weight. Inputs that finish early leave more time behind for the rest.
+
+        Inputs:
+            batch_deadline - the time.time() value by which the batch has to be done
+            num_workers - the number of inputs solved at once
+            reserved - the seconds still allotted to inputs being solved right now
+            weight - the weight of the input about to start
+            remaining_weight - the total weight of the inputs that have not started, this one included
+
+        Outputs:
+            the time budget for the input in seconds
+    '''
+    time_left = batch_deadline - time.time()
+    available = num_workers * time_left - reserved
+    return max(0.0, min(time_left, available * weight / remaining_weight))
+
+def main(num_workers=None, time_budget=None, input_budget=None, num_starts=1, seed=None, exact=False, seeding="greedy",
+         refinement=False, decomposition=False, improve_below=None, resolve_all=False, trace_folder=None, engine="anneal", replicas=None):
     '''
         Main method which iterates over all inputs and calls `solve` on each.
-        The student should modify `solve` to return their solution and modify
-        the portion which writes it to a file to make sure their output is
-        formatted correctly.
+        Inputs are fanned out to a pool of `num_workers` processes (one per core
+        by default, in-process when 1) and each .out is written as soon as its
+        input is solved. Inputs whose content and solver settings match the
+        manifest (see manifest.py) from an earlier run are skipped, and unless
+        resolve_all, the output of an unchanged input is only replaced by one
+        scoring higher than the score recorded for it.
+
+        Inputs:
+            num_workers - the number of worker processes
+            time_budget - a wall-clock budget in seconds for the whole batch. Inputs are then started
+                smallest first and each gets a share of the time left in proportion to its graph size,
+                so time not used by quick inputs goes to the large ones at the end.
+            input_budget - a wall-clock budget in seconds for each input
+            num_starts - the number of greedy passes per input, the best is kept
+            seed - makes the perturbed greedy passes reproducible
+            exact - whether inputs in exact_categories go to the integer program first (needs PuLP)
+            seeding - "greedy" or "partition", where the initial assignment of each input comes from
+            refinement - whether each assignment is improved by the local search in refine.py
+            decomposition - whether friendship components without rowdy groups are packed onto buses directly
+            improve_below - only solve the unchanged inputs whose recorded score is below this
+            resolve_all - solve every input, whatever the manifest says, and replace every output
+            trace_folder - a folder to write the anytime trace of each input to, see anytime_trace.py
+            engine - "anneal", "tabu" or "tempering", what the time left after the initial assignment goes to
+            replicas - the number of chains with engine="tempering", simann.ParallelTempering.num_chains by default
     '''
     size_categories = ["small", "medium", "large"]
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
     if not os.path.isdir(path_to_outputs):
         os.mkdir(path_to_outputs)
 
     for size in size_categories:
-        category_path = path_to_inputs + "/" + size
         output_category_path = path_to_outputs + "/" + size
-        category_dir = os.fsencode(category_path)
-
         if not os.path.isdir(output_category_path):
             os.mkdir(output_category_path)
 
-        for input_folder in os.listdir(category_dir):
-            input_name = os.fsdecode(input_folder)
-            graph, num_buses, size_bus, constraints = parse_input(category_path + "/" + input_name)
-            solution = solve(graph, num_buses, size_bus, constraints)
-            output_file = open(output_category_path + "/" + input_name + ".out", "w")
+    if trace_folder is not None and not os.path.isdir(trace_folder):
+        os.makedirs(trace_folder)
+
+    jobs = list_inputs(path_to_inputs, size_categories)
+    if exact and not ilp.available():
+        print("PuLP is not installed, solving {} inputs without the integer program".format("/".join(exact_categories)))
+        exact = False
+
+    def time_limit_for(size):
+        return exact_time_limit if exact and size in exact_categories else None
+
+    solver_manifest = manifest.load_manifest(path_to_outputs)
+    config_hashes = {size: manifest.config_hash({
+        "time_budget": time_budget, "input_budget": input_budget, "num_starts": num_starts, "seed": seed,
+        "exact_time_limit": time_limit_for(size), "seeding": seeding, "refinement": refinement, "decomposition": decomposition,
+        "engine": engine, "replicas": replicas if engine == "tempering" else None,
+    }) for size in size_categories}
+    fingerprints = {}
+    pending = []
+    for size, input_name in jobs:
+        key = size + "/" + input_name
+        try:
+            fingerprints[key] = manifest.input_fingerprint(path_to_inputs + "/" + key, solver_manifest.get(key))
+        except OSError:
+            # let solve_input report what is wrong with the input
+            pending.append((size, input_name))
+            continue
+        output_file = path_to_outputs + "/" + key + ".out"
+        if resolve_all or manifest.needs_solving(solver_manifest.get(key), fingerprints[key][0], config_hashes[size], output_file, improve_below):
+            pending.append((size, input_name))
+    touched = [key for key, (content_hash, stats) in fingerprints.items() if key in solver_manifest
+               and solver_manifest[key].get("input_hash") == content_hash and solver_manifest[key].get("input_stats") != stats]
+    for key in touched:
+        # touched but not changed, remember the new stats so the next run skips hashing
+        solver_manifest[key]["input_stats"] = fingerprints[key][1]
+    if touched:
+        manifest.save_manifest(path_to_outputs, solver_manifest)
+    if len(pending) < len(jobs):
+        print("Skipping {} of {} inputs whose outputs are up to date".format(len(jobs) - len(pending), len(jobs)))
+    jobs = pending
+
+    def recorded_score(key):
+        entry = solver_manifest.get(key)
+        if resolve_all or entry is None or key not in fingerprints or not os.path.isfile(path_to_outputs + "/" + key + ".out"):
+            return None
+        return entry.get("score") if entry.get("input_hash") == fingerprints[key][0] else None
+
+    # the score of the output already there for each unchanged input, which only a better one replaces,
+    # whatever settings either was solved with
+    previous_scores = {(size, input_name): recorded_score(size + "/" + input_name) for size, input_name in jobs}
+
+    def previous_score(size, input_name):
+        return previous_scores[(size, input_name)]
+
+    def job_arguments(size, input_name, budget):
+        return (path_to_inputs, path_to_outputs, size, input_name, budget, num_starts, seed, time_limit_for(size), seeding, refinement,
+                decomposition, previous_score(size, input_name), trace_folder, engine, replicas)
+
+    batch_start_time = time.time()
+    failures = 0
+
+    def report(size, input_name, result):
+        nonlocal failures
+        try:
+            _, _, seconds, score = result()
+        except Exception as e:
+            failures += 1
+            print("{}-{} failed: {!r}".format(size, input_name, e))
+            return
+        key = size + "/" + input_name
+        kept = previous_score(size, input_name)
+        if kept is not None and score <= kept:
+            print("{}-{} solved in {:.2f}s with score {:.4f}, keeping the earlier {:.4f}".format(size, input_name, seconds, score, kept))
+            # these settings have had their go, so the next run with them leaves the better output alone
+            solver_manifest[key]["config_hash"] = config_hashes[size]
+            manifest.save_manifest(path_to_outputs, solver_manifest)
+            return
+        print("{}-{} solved in {:.2f}s with score {:.4f}".format(size, input_name, seconds, score))
+        if key in fingerprints:
+            content_hash, stats = fingerprints[key]
+            solver_manifest[key] = manifest.make_entry(content_hash, stats, config_hashes[size], score, seconds)
+            manifest.save_manifest(path_to_outputs, solver_manifest)
+
+    if time_budget is not None:
+        # smallest first, so whatever the quick inputs leave over is spread across the big ones
+        jobs.reverse()
+        batch_deadline = batch_start_time + time_budget
+        weights = [input_weight(path_to_inputs, size, input_name) for size, input_name in jobs]
+        remaining_weight = sum(weights)
+
+        def job_budget(job_idx, reserved):
+            nonlocal remaining_weight
+            budget = allot_time(batch_deadline, num_workers, reserved, weights[job_idx], remaining_weight)
+            remaining_weight -= weights[job_idx]
+            return budget if input_budget is None else min(budget, input_budget)
+
+        if num_workers == 1:
+            for job_idx, (size, input_name) in enumerate(jobs):
+                budget = job_budget(job_idx, 0)
+                report(size, input_name, lambda: solve_input(*job_arguments(size, input_name, budget)))
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                # only as many inputs as workers are submitted, so each budget is set when its input starts
+                running = {}
+                next_job = 0
+                while next_job < len(jobs) or running:
+                    while next_job < len(jobs) and len(running) < num_workers:
+                        size, input_name = jobs[next_job]
+                        now = time.time()
+                        reserved = sum(max(0.0, input_deadline - now) for _, _, input_deadline in running.values())
+                        budget = job_budget(next_job, reserved)
+                        future = executor.submit(solve_input, *job_arguments(size, input_name, budget))
+                        running[future] = (size, input_name, now + budget)
+                        next_job += 1
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        size, input_name, _ = running.pop(future)
+                        report(size, input_name, future.result)
+    elif num_workers == 1:
+        for size, input_name in jobs:
+            report(size, input_name, lambda: solve_input(*job_arguments(size, input_name, input_budget)))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(solve_input, *job_arguments(size, input_name, input_budget)): (size, input_name)
+                       for size, input_name in jobs}
+            for future in as_completed(futures):
+                size, input_name = futures[future]
+                report(size, input_name, future.result)
+
+    print("Solved {} of {} inputs in {:.2f}s with {} worker(s)".format(
+        len(jobs) - failures, len(jobs), time.time() - batch_start_time, num_workers))
+
+def solve_folders(input_folders, time_budget=None, input_budget=None, num_starts=1, seed=None, exact=False, seeding="greedy",
+                  refinement=False, decomposition=False, trace_folder=None, engine="anneal", replicas=None):
+    '''
+        Solves the given input folders one after another in this process, writing each output to
+        path_to_outputs/<size>/<input name>.out like main does, but without reading or updating the manifest
 
-            #TODO: modify this to write your solution to your
-            #      file properly as it might not be correct to
-            #      just write the variable solution to a file
-            output_file.write(solution)
+        Inputs:
+            input_folders - paths of the form <inputs>/<size>/<input name>
+            time_budget - seconds for all of them, split evenly
+            the rest - as for main
 
-            output_file.close()
+        Outputs:
+            the number of inputs that failed
+    '''
+    budget = input_budget
+    if time_budget is not None:
+        budget = time_budget / len(input_folders) if budget is None else min(budget, time_budget / len(input_folders))
+    if trace_folder is not None:
+        os.makedirs(trace_folder, exist_ok=True)
+    failures = 0
+    for input_folder in input_folders:
+        category_path, input_name = os.path.split(os.path.normpath(input_folder))
+        inputs_path, size = os.path.split(category_path)
+        os.makedirs(path_to_outputs + "/" + size, exist_ok=True)
+        time_limit = exact_time_limit if exact and size in exact_categories and ilp.available() else None
+        try:
+            _, _, seconds, score = solve_input(inputs_path or ".", path_to_outputs, size, input_name, budget, num_starts, seed, time_limit,
+                                               seeding, refinement, decomposition, None, trace_folder, engine, replicas)
+        except Exception as e:
+            failures += 1
+            print("{}-{} failed: {!r}".format(size, input_name, e))
+            continue
+        print("{}-{} solved in {:.2f}s with score {:.4f}".format(size, input_name, seconds, score))
+    return failures
+
+def make_parser(prog=None):
+    '''The command line options of solver.py, also used by `python3 main.py solve`'''
+    parser = argparse.ArgumentParser(prog=prog, description="Solve every input under --inputs, or just the given input folders")
+    parser.add_argument("folders", nargs="*", help="input folders (<inputs>/<size>/<name>) to solve on their own, ignoring the manifest")
+    parser.add_argument("--inputs", default=path_to_inputs, help="folder with the size category folders (default: %(default)s)")
+    parser.add_argument("--outputs", default=path_to_outputs, help="folder to write the .out files to (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="seconds for the whole batch, shared out between inputs by graph size")
+    parser.add_argument("--input-budget", type=float, default=None,
+                        help="seconds for each input; the greedy assignment is annealed until it runs out")
+    parser.add_argument("--starts", type=int, default=1,
+                        help="greedy passes per input; all but the first use a perturbed ordering and cost weight")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the perturbed greedy passes")
+    parser.add_argument("--exact", action="store_true",
+                        help="hand the small inputs to the integer program in ilp.py first (needs PuLP)")
+    parser.add_argument("--exact-time-limit", type=float, default=exact_time_limit,
+                        help="most seconds the integer program gets on each small input with --exact (default: %(default)s)")
+    parser.add_argument("--seeding", choices=["greedy", "partition"], default="greedy",
+                        help="start from the greedy assignment or from the graph partitioning in partition.py")
+    parser.add_argument("--refine", action="store_true",
+                        help="improve each assignment with the Fiduccia-Mattheyses style local search in refine.py")
+    parser.add_argument("--decompose", action="store_true",
+                        help="pack friendship components without rowdy groups onto buses whole and only solve the rest")
+    parser.add_argument("--improve-below", type=float, default=None,
+                        help="only solve again the inputs scoring below this, keeping their outputs unless the new one is better")
+    parser.add_argument("--force", action="store_true", help="solve every input, even when the manifest says its output is up to date")
+    parser.add_argument("--trace", default=None, metavar="FOLDER",
+                        help="write how the score of each input improves over time to FOLDER, for autograder.py --curves")
+    parser.add_argument("--engine", choices=["anneal", "tabu", "tempering"], default="anneal",
+                        help="spend the time budget on simulated annealing, on the tabu search in tabu.py or on parallel tempering")
+    parser.add_argument("--replicas", type=int, default=None,
+                        help="annealing chains run at once with --engine tempering (default: simann.ParallelTempering.num_chains)")
+    return parser
+
+def run(args):
+    '''Runs solver.py with the options parsed by make_parser'''
+    global path_to_inputs, path_to_outputs, exact_time_limit
+    path_to_inputs = args.inputs
+    path_to_outputs = args.outputs
+    exact_time_limit = args.exact_time_limit
+    if args.folders:
+        failures = solve_folders(args.folders, args.time_budget, args.input_budget, args.starts, args.seed, args.exact,
+                                 args.seeding, args.refine, args.decompose, args.trace, args.engine, args.replicas)
+        return 1 if failures else None
+    main(args.workers, args.time_budget, args.input_budget, args.starts, args.seed, args.exact, args.seeding, args.refine,
+         args.decompose, args.improve_below, args.force, args.trace, args.engine, args.replicas)
 
 if __name__ == '__main__':
-    main()
+    sys.exit(run(make_parser().parse_args()))
@@ -0,0 +1,254 @@
+import time
+import heapq
+import numpy as np
+from evaluator import ScoreEvaluator
+from refine import GainBuckets
+from solver import greedy_assignment, assignment_to_buses, dict_to_string
+
+####################################################
+# Tabu search over bus assignments.
+#
+# Every iteration takes the best admissible action
+# among a candidate list: the best transfers of the
+# students with the most friends to gain (kept in the
+# gain buckets of refine.py, refiled from the friend
+# counts of the ScoreEvaluator only for the students
+# an action touches), and the best transfers of a few
+# members of rowdy groups that sit whole on a bus
+# and of a few random students. A transfer
+# to a full bus becomes a swap with the rider of that
+# bus who would gain most from the trade. Each is
+# scored with the exact delta from ScoreEvaluator, and
+# the best is taken even when it loses friendships.
+#
+# A student that leaves a bus may not go back to it
+# for tenure iterations (plus a random extra of up to
+# tenure_spread), unless that would beat the best
+# assignment found so far (aspiration). Transfers
+# never empty a bus or overfill one.
+####################################################
+
+
+class TabuSearch:
+    '''
+        Tabu search starting from a valid assignment, see the top of this file
+
+        Attributes:
+            evaluator - the ScoreEvaluator holding the current assignment
+            best_state, best_energy - the best student->bus array seen and the friendships it loses
+            iterations - the number of iterations run so far
+            buckets - a refine.GainBuckets of the students by the friends their best transfer gains,
+                or None when the evaluator has no friend counts
+    '''
+
+    steps = 20000
+    tenure = 10
+    tenure_spread = 5
+    # transfers ranked by friend counts that are scored exactly each iteration
+    candidate_moves = 32
+    # random students whose best transfer is scored each iteration as well
+    random_candidates = 8
+
+    def __init__(self, instance, student_to_bus, seed=None):
+        self.instance = instance
+        self.num_students = instance.num_students
+        self.num_buses = instance.num_buses
+        self.size_bus = instance.size_bus
+        self.evaluator = ScoreEvaluator(instance, student_to_bus)
+        self.rng = np.random.default_rng(seed)
+        # the iteration until which each student may not move back onto each bus, and a heap of
+        # (iteration, (student, bus)) to drop the entries that ran out
+        self.tabu_until = {}
+        self.expiries = []
+        self.iterations = 0
+        self.best_state = self.evaluator.student_to_bus.copy()
+        self.best_energy = self.evaluator.energy()
+        # students by the friends their best transfer gains, without friend counts there are none
+        self.buckets = None
+        if self.evaluator.alive_friend_counts is not None:
+            self.buckets = GainBuckets()
+            self.refile(np.arange(self.num_students))
+
+    def friend_counts(self, student):
+        '''The number of friends of student on each bus whose friendships count'''
+        evaluator = self.evaluator
+        if evaluator.alive_friend_counts is not None:
+            return evaluator.alive_friend_counts[student]
+        friends = evaluator.student_neighbors[student]
+        counted = evaluator.intact_groups_of_student[friends] == 0
+        return np.bincount(evaluator.student_to_bus[friends][counted], minlength=self.num_buses)
+
+    def best_bus(self, student):
+        '''The other bus with the most friends of student on it'''
+        counts = self.friend_counts(student).astype(np.int64)
+        counts[self.evaluator.student_to_bus[student]] = -1
+        return int(np.argmax(counts))
+
+    def refile(self, students):
+        '''Files each of students in the gain buckets under the friends its best transfer gains'''
+        evaluator = self.evaluator
+        rows = np.arange(len(students))
+        buses = evaluator.student_to_bus[students]
+        counts = evaluator.alive_friend_counts[students].astype(np.int64)
+        own = counts[rows, buses]
+        counts[rows, buses] = -1
+        for student, gain in zip(students.tolist(), (counts.max(axis=1) - own).tolist()):
+            self.buckets.insert(student, gain)
+
+    def refile_around(self, students, groups):
+        '''
+            Refiles every student whose friend counts an action changed: the students it moved and
+            their friends, and the members of the rowdy groups it completed or broke up and theirs
+        '''
+        evaluator = self.evaluator
+        members = [evaluator.group_member_lists[group] for group in groups.tolist()]
+        touched = np.concatenate([np.asarray(students, dtype=np.int64)] + members)
+        self.refile(np.unique(np.concatenate([touched] + [evaluator.student_neighbors[student] for student in touched.tolist()])))
+
+    def candidates(self):
+        '''
+            Outputs:
+                a list of distinct (student, bus) transfers to score this iteration
+        '''
+        evaluator = self.evaluator
+        pairs = []
+        if self.buckets is not None:
+            # the transfers with the most to gain all belong to the students whose best ones gain most
+            students = np.array(self.buckets.top(self.candidate_moves), dtype=np.int64)
+            rows = np.arange(len(students))
+            gains = evaluator.alive_friend_counts[students].astype(np.int64)
+            gains -= gains[rows, evaluator.student_to_bus[students]][:, None]
+            gains[rows, evaluator.student_to_bus[students]] = np.iinfo(gains.dtype).min
+            flat = gains.ravel()
+            top = min(self.candidate_moves, len(flat) - len(students))
+            if top > 0:
+                for cell in np.argpartition(flat, len(flat) - top)[len(flat) - top:].tolist():
+                    row, bus = divmod(cell, self.num_buses)
+                    pairs.append((int(students[row]), bus))
+        stuck = np.flatnonzero(evaluator.intact_groups_of_student > 0)
+        if len(stuck) > self.random_candidates:
+            stuck = self.rng.choice(stuck, size=self.random_candidates, replace=False)
+        sampled = self.rng.integers(0, self.num_students, size=self.random_candidates)
+        for student in np.concatenate([stuck, sampled]).tolist():
+            pairs.append((student, self.best_bus(student)))
+        return list(dict.fromkeys(pairs))
+
+    def best_rider(self, student, bus):
+        '''The rider of bus who would gain most from trading places with student'''
+        evaluator = self.evaluator
+        riders = evaluator.riders_of(bus)
+        student_bus = evaluator.student_to_bus[student]
+        if evaluator.alive_friend_counts is not None:
+            counts = evaluator.alive_friend_counts
+            return int(riders[int(np.argmax(counts[riders, student_bus] - counts[riders, bus]))])
+        return int(riders[self.rng.integers(len(riders))])
+
+    def is_tabu(self, student, bus):
+        return self.tabu_until.get((student, bus), -1) > self.iterations
+
+    def step(self):
+        '''
+            Takes the best admissible action and returns whether there was one
+        '''
+        evaluator = self.evaluator
+        student_to_bus = evaluator.student_to_bus
+        best = None
+        for student, bus in self.candidates():
+            old_bus = student_to_bus[student]
+            if bus == old_bus:
+                continue
+            if evaluator.bus_loads[bus] < self.size_bus:
+                if evaluator.bus_loads[old_bus] <= 1:
+                    continue
+                action = (student,)
+                delta = evaluator.move_delta(student, bus)
+                tabu = self.is_tabu(student, bus)
+            else:
+                other = self.best_rider(student, bus)
+                action = (student, other)
+                delta = evaluator.swap_delta(student, other)
+                tabu = self.is_tabu(student, bus) or self.is_tabu(other, old_bus)
+            # aspiration: a tabu action is fine if it beats the best assignment so far
+            if tabu and evaluator.energy() - delta >= self.best_energy:
+                continue
+            if best is None or delta > best[0]:
+                best = (delta, action, bus)
+        if best is None:
+            return False
+
+        _, action, bus = best
+        self.iterations += 1
+        while self.expiries and self.expiries[0][0] <= self.iterations:
+            expiry, key = heapq.heappop(self.expiries)
+            if self.tabu_until.get(key) == expiry:
+                del self.tabu_until[key]
+        for student in action:
+            key = (student, int(student_to_bus[student]))
+            self.tabu_until[key] = self.iterations + self.tenure + int(self.rng.integers(self.tenure_spread + 1))
+            heapq.heappush(self.expiries, (self.tabu_until[key], key))
+        if len(action) == 1:
+            changed = evaluator.changed_groups(action[0], bus)
+            evaluator.apply_move(action[0], bus)
+        else:
+            changed = np.concatenate([evaluator.changed_groups(action[0], bus),
+                                      evaluator.changed_groups(action[1], student_to_bus[action[0]])])
+            evaluator.apply_swap(*action)
+        evaluator.clear_history()
+        if self.buckets is not None:
+            self.refile_around(action, changed)
+        energy = evaluator.energy()
+        if energy < self.best_energy:
+            self.best_energy = energy
+            self.best_state = evaluator.student_to_bus.copy()
+        return True
+
+    def run(self, steps=None, deadline=None):
+        '''
+            Runs steps iterations (self.steps by default), or until deadline (a time.time() value)
+            when one is given, stopping early once no friendship is lost or no action is admissible
+
+            Outputs:
+                (best_state, best_energy) - the best student->bus array seen and its energy
+        '''
+        steps = self.steps if steps is None else steps
+        step = 0
+        while (step < steps or deadline is not None) and self.best_energy > 0:
+            # an iteration scores dozens of actions, so reading the clock every time costs nothing
+            if deadline is not None and time.time() >= deadline:
+                break
+            if not self.step():
+                break
+            step += 1
+        return self.best_state, self.best_energy
+
+
+def tabu_assignment(instance, student_to_bus, steps=None, deadline=None, seed=None):
+    '''
+        Improves a valid assignment with TabuSearch
+
+        Outputs:
+            a student->bus array keeping at least as many friendships as student_to_bus
+    '''
+    best_state, _ = TabuSearch(instance, student_to_bus, seed).run(steps, deadline)
+    return best_state
+
+
+def solve(instance, steps=None, seed=None, time_budget=None):
+    '''
+        Solves an input by tabu search from the greedy assignment in solver.py
+
+        Inputs:
+            instance - the Instance to solve
+            steps - the number of iterations, TabuSearch.steps by default
+            seed - seeds the random candidates and tenures
+            time_budget - a wall-clock budget in seconds for the whole solve; when given, the search
+                runs until it is used up (steps is ignored)
+
+        Outputs:
+            the output file contents for the best assignment found
+    '''
+    deadline = None if time_budget is None else time.time() + time_budget
+    bus_assignments, student_to_bus = greedy_assignment(instance, deadline)
+    if deadline is not None and time.time() >= deadline:
+        return dict_to_string(bus_assignments)
+    return dict_to_string(assignment_to_buses(instance, tabu_assignment(instance, student_to_bus, steps, deadline, seed)))